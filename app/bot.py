@@ -5,6 +5,8 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
 from .config import get_settings
+from .services.fsm_storage import create_storage
+from .services.metrics import TelegramMetrics
 
 settings = get_settings()
 
@@ -19,14 +21,18 @@ session = AiohttpSession(
 )
 
 # 2. Настройка кастомного сервера (опционально)
-# Если даже с прокси не идет, можно раскомментировать строку ниже для работы через зеркало
-# custom_api = TelegramAPIServer.from_base("https://api.tgproxy.me")
+# Зеркало, локальный Bot API сервер или заглушка для бенчмарков: TELEGRAM_API_URL=https://api.tgproxy.me
+telegram_api_url = os.getenv("TELEGRAM_API_URL")
+if telegram_api_url:
+    session.api = TelegramAPIServer.from_base(telegram_api_url.rstrip("/"))
 
 bot = Bot(
     token=settings.bot_token,
     session=session,
-    # Если используешь зеркало, добавь: server=custom_api
     default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
 )
+# Время и ошибки запросов к Telegram для /metrics
+bot.session.middleware(TelegramMetrics())
 
-dp = Dispatcher()
\ No newline at end of file
+# Состояния диалогов хранятся на диске и переживают перезапуск (см. FSM_STORAGE)
+dp = Dispatcher(storage=create_storage())
\ No newline at end of file
@@ -8,12 +8,30 @@ load_dotenv()
 class Settings:
     bot_token: str
     payment_token: str
+    # "polling" — long polling, "webhook" — обновления приходят на наш aiohttp-сервер
+    bot_mode: str = "polling"
+    public_url: str = ""
+    webhook_secret: str = ""
+    # Telegram id администраторов (служебные команды, например /health)
+    admin_ids: tuple = ()
 
 def get_settings() -> Settings:
     bot_token = os.getenv("BOT_TOKEN", "")
     if not bot_token:
         raise RuntimeError("BOT_TOKEN is missing in .env")
+    bot_mode = os.getenv("BOT_MODE", "polling")
+    public_url = os.getenv("PUBLIC_URL", "").rstrip("/")
+    if bot_mode == "webhook" and not public_url:
+        raise RuntimeError("PUBLIC_URL is required for BOT_MODE=webhook")
+    webhook_secret = os.getenv("WEBHOOK_SECRET", "")
+    if bot_mode == "webhook" and not webhook_secret:
+        # Без секрета любой, кто знает адрес вебхука, сможет присылать поддельные обновления
+        raise RuntimeError("WEBHOOK_SECRET is required for BOT_MODE=webhook")
     return Settings(
         bot_token=bot_token,
-        payment_token=os.getenv("PAYMENT_TOKEN", "")
+        payment_token=os.getenv("PAYMENT_TOKEN", ""),
+        bot_mode=bot_mode,
+        public_url=public_url,
+        webhook_secret=webhook_secret,
+        admin_ids=tuple(int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x.isdigit()),
     )
@@ -1,12 +1,30 @@
 import os
 import aiohttp
 import asyncio
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
+from app.services import metrics, relay, tracing
+from app.services.health import backoff, retry_budget
+from app.services.poller import PollScheduler, POLL_MIN_INTERVAL
+
 load_dotenv()
 
 POLZA_API_KEY = os.getenv("POLZA_API_KEY")
-BASE_URL = "https://api.polza.ai/api/v1"
+BASE_URL = os.getenv("POLZA_BASE_URL", "https://api.polza.ai/api/v1").rstrip("/")
+
+# Колбэки о готовности (включаются отдельно, нужны публичный адрес бота и секрет):
+# провайдер сообщает о готовности на /polza/callback, а опрос статуса остается
+# редкой подстраховкой. Колбэк только запускает проверку статуса — ссылка на
+# результат берется из API провайдера, а не из тела запроса.
+POLZA_CALLBACKS = os.getenv("POLZA_CALLBACKS", "").lower() in ("1", "true", "yes")
+PUBLIC_URL = os.getenv("PUBLIC_URL", "").rstrip("/")
+POLZA_CALLBACK_SECRET = os.getenv("POLZA_CALLBACK_SECRET", "")
+POLL_FALLBACK_INTERVAL = float(os.getenv("POLL_FALLBACK_INTERVAL", 60))
+if POLZA_CALLBACKS and not (PUBLIC_URL and POLZA_CALLBACK_SECRET):
+    raise RuntimeError("POLZA_CALLBACKS requires PUBLIC_URL and POLZA_CALLBACK_SECRET")
+# Номер процесса-обработчика в многопроцессном режиме (см. app/supervisor.py)
+WORKER_INDEX = os.getenv("BOT_WORKER_INDEX")
 
 MODELS_MAP = {
     "nanabanana": "nano-banana",
@@ -14,12 +32,97 @@ MODELS_MAP = {
     "seadream": "seedream-v4.5"
 }
 
-
-async def _download_content_bytes(url: str):
-    """Универсальная функция скачивания байтов (фото/видео)"""
-    async with aiohttp.ClientSession() as s:
-        try:
-            async with s.get(url, timeout=300) as r:
+# --- ОБЩИЙ HTTP-КЛИЕНТ ---
+# Одна сессия на весь процесс: TCP/TLS-соединения и DNS переиспользуются между генерациями
+POLZA_MAX_CONNECTIONS = int(os.getenv("POLZA_MAX_CONNECTIONS", 100))
+POLZA_MAX_PER_HOST = int(os.getenv("POLZA_MAX_PER_HOST", 50))
+POLZA_KEEPALIVE = float(os.getenv("POLZA_KEEPALIVE", 60))
+
+# Таймауты по фазам: запуск генерации, опрос статуса, скачивание результата
+SUBMIT_TIMEOUT = aiohttp.ClientTimeout(total=float(os.getenv("POLZA_SUBMIT_TIMEOUT", 60)))
+POLL_TIMEOUT = aiohttp.ClientTimeout(total=float(os.getenv("POLZA_POLL_TIMEOUT", 20)))
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.getenv("POLZA_DOWNLOAD_TIMEOUT", 300)),
+    sock_read=float(os.getenv("POLZA_DOWNLOAD_READ_TIMEOUT", 60)),
+)
+
+# Повторы запуска генерации при 429/503 и ошибке соединения (с джиттером, в пределах бюджета повторов).
+# 502/504 не повторяем: шлюз мог ответить ошибкой, когда провайдер уже принял задачу, — повтор запустил бы
+# вторую платную генерацию
+SUBMIT_RETRIES = int(os.getenv("POLZA_SUBMIT_RETRIES", 2))
+SUBMIT_RETRY_BASE = float(os.getenv("POLZA_SUBMIT_RETRY_BASE", 1))
+SUBMIT_RETRY_MAX = float(os.getenv("POLZA_SUBMIT_RETRY_MAX", 10))
+RETRY_STATUSES = (429, 503)
+
+# Сколько всего ждать результат генерации
+IMAGE_TIMEOUT = float(os.getenv("POLZA_IMAGE_TIMEOUT", 240))
+VIDEO_TIMEOUT = float(os.getenv("POLZA_VIDEO_TIMEOUT", 1500))
+
+_session: aiohttp.ClientSession | None = None
+
+
+async def open_session() -> aiohttp.ClientSession:
+    """Создает общую сессию (вызывается при старте бота)."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POLZA_MAX_CONNECTIONS,
+            limit_per_host=POLZA_MAX_PER_HOST,
+            keepalive_timeout=POLZA_KEEPALIVE,
+            ttl_dns_cache=300,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_session():
+    """Закрывает общую сессию (вызывается при остановке бота)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    return await open_session()
+
+
+def _open_connections() -> int:
+    if _session is None or _session.closed:
+        return 0
+    connector = _session.connector
+    idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    return len(getattr(connector, "_acquired", ())) + idle
+
+
+@contextmanager
+def _measure(operation: str, model: str):
+    """Время и ошибки одного запроса к Polza (для /metrics)."""
+    metrics.requests_in_flight.inc(target="polza")
+    try:
+        with metrics.polza_seconds.time(operation=operation, model=model or ""):
+            yield
+    except Exception:
+        metrics.failures.inc(kind=f"polza_{operation}")
+        raise
+    finally:
+        metrics.requests_in_flight.dec(target="polza")
+
+
+def _headers():
+    return {"Authorization": f"Bearer {POLZA_API_KEY}", "Content-Type": "application/json"}
+
+
+async def _download_content(url: str, model: str = None):
+    """
+    Универсальная функция скачивания результата (фото/видео).
+    Возвращает RelayedMedia — содержимое читается кусками и при большом размере
+    сбрасывается во временный файл, поэтому не держится в памяти целиком.
+    """
+    session = await get_session()
+    try:
+        with tracing.span("download"), _measure("download", model):
+            async with session.get(url, timeout=DOWNLOAD_TIMEOUT) as r:
                 if r.status == 200:
                     content_type = r.headers.get("Content-Type", "").lower()
                     if "video" in content_type:
@@ -28,19 +131,123 @@ async def _download_content_bytes(url: str):
                         ext = "jpg"
                     else:
                         ext = "png"
-                    return await r.read(), ext
-        except Exception as e:
-            print(f"❌ Ошибка при скачивании контента: {e}")
+                    return await relay.receive(r, ext), ext
+        metrics.failures.inc(kind="polza_download")
+    except Exception as e:
+        print(f"❌ Ошибка при скачивании контента: {e}")
     return None, None
 
 
-async def process_with_polza(prompt: str, model_type: str, image_url: str = None):
-    """Генерация фото (Image-to-Image)"""
+def _image_result_url(result: dict):
+    # Ищем ссылку во всех возможных полях
+    return result.get("url") or (result.get("images")[0] if result.get("images") else None)
+
+
+def _video_result_url(result: dict):
+    # --- УЛУЧШЕННЫЙ ПОИСК ССЫЛКИ ---
+    # Проверяем все возможные ключи
+    video_url = (
+            result.get("videoUrl") or
+            result.get("url") or
+            (result.get("result") if isinstance(result.get("result"), str) else None)
+    )
+
+    # Если ссылка не найдена в основных полях, проверяем списки
+    if not video_url:
+        res_data = result.get("images") or result.get("videos") or result.get("result")
+        if isinstance(res_data, list) and len(res_data) > 0:
+            video_url = res_data[0]
+    return video_url
+
+
+def parse_status(kind: str, result: dict):
+    """Разбирает ответ о статусе задачи: ("pending" | "done" | "failed", url)."""
+    status = result.get("status")
+
+    if kind == "images":
+        res_url = _image_result_url(result)
+        if res_url:
+            return "done", res_url
+    else:
+        # Статус готов, но ссылка может еще "долетать" до API — тогда ждем дальше
+        video_url = _video_result_url(result)
+        if status in ["COMPLETED", "success"] and video_url:
+            return "done", video_url
+
+    if status in ["error", "failed"]:
+        print(f"❌ Ошибка генерации ({kind}): {result}")
+        return "failed", None
+    return "pending", None
+
+
+async def _fetch_status(kind: str, request_id: str):
+    """Один запрос статуса задачи. Используется планировщиком опроса."""
+    session = await get_session()
+    with tracing.request_span(request_id, "poll") as span, _measure("poll", poller.model_of(request_id)):
+        async with session.get(f"{BASE_URL}/{kind}/{request_id}", headers=_headers(),
+                               timeout=POLL_TIMEOUT) as resp:
+            if resp.status != 200:
+                metrics.failures.inc(kind="polza_poll")
+                span["status"] = resp.status
+                return "error", None
+            state, url = parse_status(kind, await resp.json())
+            span["state"] = state
+            return state, url
+
+
+def _callback_url():
+    if not POLZA_CALLBACKS:
+        return None
+    url = f"{PUBLIC_URL}/polza/callback?token={POLZA_CALLBACK_SECRET}"
+    if WORKER_INDEX is not None:
+        # Несколько процессов: супервизор вернет колбэк тому, кто ждет эту генерацию
+        url += f"&worker={WORKER_INDEX}"
+    return url
+
+
+# Один планировщик на процесс опрашивает все незавершенные задачи
+poller = PollScheduler(_fetch_status, min_interval=POLL_FALLBACK_INTERVAL if POLZA_CALLBACKS else POLL_MIN_INTERVAL)
+
+metrics.polls_in_flight.set_function(lambda: poller.in_flight)
+metrics.connections_open.set_function(_open_connections, target="polza")
+
+
+async def _submit(kind: str, payload: dict):
+    if _callback_url():
+        payload["callbackUrl"] = _callback_url()
+
+    session = await get_session()
+    for attempt in range(SUBMIT_RETRIES + 1):
+        try:
+            with _measure("submit", payload.get("model")):
+                async with session.post(f"{BASE_URL}/{kind}/generations", headers=_headers(), json=payload,
+                                        timeout=SUBMIT_TIMEOUT) as resp:
+                    # Повторяем только то, что провайдер точно не принял в работу
+                    retryable = resp.status in RETRY_STATUSES
+                    data = {} if retryable else await resp.json()
+        except aiohttp.ClientConnectorError as e:
+            retryable, data = True, {"error": str(e)}
+        if not retryable:
+            break
+        if attempt == SUBMIT_RETRIES or not retry_budget.withdraw():
+            data = data or {"error": f"HTTP {resp.status}"}
+            break
+        await asyncio.sleep(backoff(attempt, SUBMIT_RETRY_BASE, SUBMIT_RETRY_MAX))
+    if data.get("requestId"):
+        retry_budget.deposit()
+    else:
+        metrics.failures.inc(kind="polza_submit")
+    return data.get("requestId"), data
+
+
+# --- ФОТО (IMAGE-TO-IMAGE) ---
+
+async def submit_image(prompt: str, model_type: str, image_url: str = None):
+    """Запускает генерацию фото. Возвращает requestId или None."""
     if not POLZA_API_KEY:
-        return None, None
+        return None
 
     model_id = MODELS_MAP.get(model_type)
-    headers = {"Authorization": f"Bearer {POLZA_API_KEY}", "Content-Type": "application/json"}
 
     payload = {
         "model": model_id,
@@ -56,44 +263,53 @@ async def process_with_polza(prompt: str, model_type: str, image_url: str = None
         payload.update({"resolution": "1K"})
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{BASE_URL}/images/generations", headers=headers, json=payload) as resp:
-                data = await resp.json()
-                request_id = data.get("requestId")
-                if not request_id:
-                    print(f"❌ Ошибка API фото (запрос): {data}")
-                    return None, None
-
-            for i in range(60):
-                await asyncio.sleep(4)
-                async with session.get(f"{BASE_URL}/images/{request_id}", headers=headers) as s_resp:
-                    if s_resp.status != 200: continue
-                    result = await s_resp.json()
-
-                    # Ищем ссылку во всех возможных полях
-                    res_url = result.get("url") or (result.get("images")[0] if result.get("images") else None)
-
-                    if res_url:
-                        return await _download_content_bytes(res_url)
-
-                    if result.get("status") in ["error", "failed"]:
-                        print(f"❌ Ошибка генерации фото: {result}")
-                        break
+        request_id, data = await _submit("images", payload)
+        if not request_id:
+            print(f"❌ Ошибка API фото (запрос): {data}")
+        return request_id
     except Exception as e:
         print(f"❌ Ошибка в network (фото): {e}")
+    return None
+
+
+async def wait_image_url(model_type: str, request_id: str):
+    """Ждет готовности фото по requestId. Возвращает ссылку на результат или None."""
+    try:
+        with tracing.span("wait", request_id=request_id):
+            return await poller.wait("images", MODELS_MAP.get(model_type), request_id, IMAGE_TIMEOUT)
+    except Exception as e:
+        print(f"❌ Ошибка в network (фото): {e}")
+    return None
+
+
+async def wait_image(model_type: str, request_id: str):
+    """Ждет готовности фото по requestId и скачивает результат."""
+    res_url = await wait_image_url(model_type, request_id)
+    if res_url:
+        return await _download_content(res_url, MODELS_MAP.get(model_type))
     return None, None
 
 
+async def process_with_polza(prompt: str, model_type: str, image_url: str = None):
+    """Генерация фото (Image-to-Image)"""
+    request_id = await submit_image(prompt, model_type, image_url)
+    if not request_id:
+        return None, None
+    return await wait_image(model_type, request_id)
+
+
 # --- ОБНОВЛЕННАЯ ФУНКЦИЯ ДЛЯ ВИДЕО (KLING 2.5) ---
 
-async def process_video_polza(prompt: str, image_url: str, duration: int):
-    """Генерация видео с исправленным поиском ссылки при COMPLETED"""
+VIDEO_MODEL = "kling2.5-image-to-video"
+
+
+async def submit_video(prompt: str, image_url: str, duration: int):
+    """Запускает генерацию видео. Возвращает requestId или None."""
     if not POLZA_API_KEY:
-        return None, None
+        return None
 
-    headers = {"Authorization": f"Bearer {POLZA_API_KEY}", "Content-Type": "application/json"}
     payload = {
-        "model": "kling2.5-image-to-video",
+        "model": VIDEO_MODEL,
         "prompt": prompt,
         "duration": duration,
         "imageUrls": [image_url],
@@ -101,59 +317,46 @@ async def process_video_polza(prompt: str, image_url: str, duration: int):
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{BASE_URL}/videos/generations", headers=headers, json=payload) as resp:
-                data = await resp.json()
-                request_id = data.get("requestId")
-                if not request_id:
-                    print(f"❌ Видео API ошибка (старт): {data}")
-                    return None, None
-
-            print(f"⏳ Видео {request_id} создано. Начинаю опрос статуса...")
-
-            for i in range(300):
-                await asyncio.sleep(5)
-                async with session.get(f"{BASE_URL}/videos/{request_id}", headers=headers) as s_resp:
-                    if s_resp.status != 200:
-                        continue
-
-                    result = await s_resp.json()
-                    status = result.get("status")
-
-                    if i % 6 == 0:
-                        print(f"LOG: Видео {request_id} статус -> {status}")
-
-                    # --- УЛУЧШЕННЫЙ ПОИСК ССЫЛКИ ---
-                    # Проверяем все возможные ключи
-                    video_url = (
-                            result.get("videoUrl") or
-                            result.get("url") or
-                            (result.get("result") if isinstance(result.get("result"), str) else None)
-                    )
-
-                    # Если ссылка не найдена в основных полях, проверяем списки
-                    if not video_url:
-                        res_data = result.get("images") or result.get("videos") or result.get("result")
-                        if isinstance(res_data, list) and len(res_data) > 0:
-                            video_url = res_data[0]
-
-                    # Если статус завершен успешно
-                    if status in ["COMPLETED", "success"]:
-                        if video_url:
-                            print(f"✅ Ссылка найдена: {video_url}. Скачиваю...")
-                            return await _download_content_bytes(video_url)
-                        else:
-                            # Статус готов, но ссылка еще "долетает" до API
-                            print(f"⚠️ Статус {status}, но URL еще не появился. Ждем...")
-                            continue
-
-                    if status in ["error", "failed"]:
-                        print(f"❌ Ошибка Kling: {result}")
-                        break
-
-            print(f"⚠️ Видео {request_id} завершилось по таймауту.")
+        request_id, data = await _submit("videos", payload)
+        if not request_id:
+            print(f"❌ Видео API ошибка (старт): {data}")
+            return None
+        print(f"⏳ Видео {request_id} создано. Жду результат...")
+        return request_id
+    except Exception as e:
+        print(f"❌ Ошибка в network (видео): {e}")
+    return None
+
 
+async def wait_video_url(duration: int, request_id: str):
+    """Ждет готовности видео по requestId. Возвращает ссылку на результат или None."""
+    try:
+        with tracing.span("wait", request_id=request_id):
+            video_url = await poller.wait("videos", f"{VIDEO_MODEL}:{duration}", request_id, VIDEO_TIMEOUT)
+        if video_url:
+            print(f"✅ Ссылка найдена: {video_url}")
+        return video_url
     except Exception as e:
         print(f"❌ Ошибка в network (видео): {e}")
+    return None
+
+
+async def wait_video(duration: int, request_id: str):
+    """Ждет готовности видео по requestId и скачивает результат."""
+    video_url = await wait_video_url(duration, request_id)
+    if video_url:
+        return await _download_content(video_url, f"{VIDEO_MODEL}:{duration}")
+    return None, None
+
 
-    return None, None
\ No newline at end of file
+async def download_result(url: str, model: str = None):
+    """Скачивает готовый результат по ссылке провайдера: (RelayedMedia, ext) или (None, None)."""
+    return await _download_content(url, model)
+
+
+async def process_video_polza(prompt: str, image_url: str, duration: int):
+    """Генерация видео с исправленным поиском ссылки при COMPLETED"""
+    request_id = await submit_video(prompt, image_url, duration)
+    if not request_id:
+        return None, None
+    return await wait_video(duration, request_id)
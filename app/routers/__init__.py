@@ -4,6 +4,7 @@ from .start import router as start_router
 from .balance import router as balance_router
 from .photo import router as photo_router
 from .payments import router as payments_router
+from .admin import router as admin_router
 
 
 def setup_routers(dp: Dispatcher):
@@ -11,3 +12,4 @@ def setup_routers(dp: Dispatcher):
     dp.include_router(balance_router)
     dp.include_router(photo_router)
     dp.include_router(payments_router)
+    dp.include_router(admin_router)
@@ -0,0 +1,82 @@
+import time
+from collections import Counter
+
+from aiogram import Router, types, F
+from aiogram.filters import Command, CommandObject
+
+from app.bot import settings
+from app.services import health as health_module
+from app.services.health import health, retry_budget
+from app import supervisor
+from app.supervisor import WORKER_INDEX
+
+router = Router()
+router.message.filter(F.from_user.id.in_(settings.admin_ids))
+
+STATES = {
+    health_module.CLOSED: "🟢 работает",
+    health_module.HALF_OPEN: "🟡 пробная генерация",
+    health_module.OPEN: "🔴 отключена",
+}
+MODELS = ("nanabanana", "nanabanana_pro", "seadream", "kling_5", "kling_10")
+
+
+def _seconds(value) -> str:
+    return f"{value:.1f} с" if value is not None else "—"
+
+
+def _model_line(model: str) -> str:
+    h = health.get(model)
+    line = f"`{model}` — {STATES[h.state]}"
+    if h.state == health_module.OPEN and not h.available():
+        left = health_module.BREAKER_COOLDOWN - (time.monotonic() - h.opened_at)
+        line += f" (проба через {left:.0f} с)"
+    line += (
+        f"\n    ошибки {h.error_rate():.0%} ({h.errors}/{h.calls}), подряд {h.consecutive_failures}"
+        f"\n    p50 {_seconds(h.latency(0.5))} · p95 {_seconds(h.latency(0.95))}"
+    )
+    if h.slow():
+        line += " · 🐢 медленная"
+    route = health.route(model, acquire=False)
+    if route != model:
+        line += f"\n    → `{route}`" if route else "\n    → отказ"
+    return line
+
+
+async def _workers_summary(models: list) -> str:
+    """Автоматы есть в каждом процессе свои: сводка состояний по всем обработчикам."""
+    snapshots = await supervisor.ask_workers(supervisor.WORKER_HEALTH_PATH)
+    if not snapshots:
+        return ""
+    lines = []
+    for model in models:
+        counts = Counter(snapshot.get(model, health_module.CLOSED) for snapshot in snapshots.values())
+        lines.append(f"`{model}` — " + ", ".join(f"{STATES[state]}: {n}" for state, n in counts.most_common()))
+    return f"\n\n🧩 **Все процессы** ({len(snapshots)} из {supervisor.BOT_WORKERS})\n" + "\n".join(lines)
+
+
+@router.message(Command("health"))
+async def show_health(message: types.Message, command: CommandObject):
+    """
+    Состояние моделей и автоматов: /health, сброс — /health reset <модель>.
+    Подробности (ошибки, задержки) — по процессу, принявшему команду; состояния
+    автоматов остальных процессов — сводкой. Сброс выполняется во всех процессах.
+    """
+    args = (command.args or "").split()
+    if len(args) == 2 and args[0] == "reset":
+        reset = await supervisor.ask_workers(supervisor.WORKER_HEALTH_PATH, {"reset": args[1]})
+        if not reset:
+            health.get(args[1]).reset()
+        where = f" в {len(reset)} процессах" if reset else ""
+        return await message.answer(f"✅ Автомат `{args[1]}` сброшен{where}.", parse_mode="Markdown")
+
+    process = f" (процесс {WORKER_INDEX})" if WORKER_INDEX is not None else ""
+    models = list(MODELS) + [m for m in health.models if m not in MODELS]
+    text = (
+        f"🩺 **Состояние моделей**{process}\n"
+        f"Окно {health_module.HEALTH_WINDOW:.0f} с\n\n"
+        + "\n".join(_model_line(model) for model in models)
+        + f"\n\n🔁 Бюджет повторов: {retry_budget.tokens:.1f} / {retry_budget.maximum:.0f}"
+        + await _workers_summary(models)
+    )
+    await message.answer(text, parse_mode="Markdown")
@@ -1,4 +1,5 @@
 from aiogram import Router, types, F
+from app.services.referrals import referral_graph
 import database as db
 
 router = Router()
@@ -7,19 +8,24 @@ router = Router()
 @router.message(F.text == "👤 Мой баланс")
 async def balance(message: types.Message):
     user_id = message.from_user.id
-    bal = db.get_balance(user_id)
-    ref_count = db.get_referrals_count(user_id)  # Счетчик из БД
+    bal = await db.get_balance(user_id)
+    if referral_graph.loaded:
+        ref_count = referral_graph.referrals_count(user_id)  # Граф рефералов в памяти
+    else:
+        ref_count = await db.get_referrals_count(user_id)  # Счетчик из БД
 
-    bot_info = await message.bot.get_me()
+    # Данные бота запрашиваются один раз при старте и дальше берутся из кэша aiogram
+    bot_info = await message.bot.me()
     ref_link = f"https://t.me/{bot_info.username}?start={user_id}"
 
+    percent = round(referral_graph.levels[0] * 100) if referral_graph.levels else 0
     text = (
         f"👤 **Ваш профиль**\n"
         f"┣ ID: `{user_id}`\n"
         f"┗ Баланс: **{bal}** ⚡\n\n"
         f"👥 **Приглашено друзей:** `{ref_count}`\n\n"
         f"🎁 **Рeферальная программа:**\n"
-        f"Получайте **10%** от покупок друзей!\n\n"
+        f"Получайте **{percent}%** от покупок друзей!\n\n"
         f"🔗 **Ваша ссылка:**\n`{ref_link}`\n\n"
         f"_Нажмите на ссылку, чтобы скопировать._"
     )
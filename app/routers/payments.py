@@ -1,25 +1,76 @@
-import asyncio
+import hashlib
+import hmac
+import json
 import os
+import re
+import time
 from aiohttp import web
 from aiogram import Router, types, F
 from urllib.parse import urlencode
 
-from app.bot import bot
-from app.keyboards.reply import main_kb
+from app.services.events import event_log
+from app.services.payments import payment_pipeline
 import database as db
 
 router = Router()
 
 # URL страницы оплаты из переменных Railway
 PRODAMUS_BASE_URL = os.getenv("PRODAMUS_URL", "https://ai-photo-nano.payform.ru")
+# Секретный ключ из настроек Продамуса: им подписано каждое уведомление (заголовок Sign)
+PRODAMUS_SECRET_KEY = os.getenv("PRODAMUS_SECRET_KEY", "")
+
+# Пакеты: генерации -> цена в рублях
+PACKAGES = {10: 149, 25: 375, 45: 675, 60: 900}
+
+
+def _nested(fields: dict):
+    """products[0][name]=... -> {"products": [{"name": ...}]}, как форму разбирает PHP."""
+    data = {}
+    for key, value in fields.items():
+        parts = re.findall(r"[^\[\]]+", key) or [key]
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = str(value)
+
+    def lists(node):
+        if not isinstance(node, dict):
+            return node
+        node = {k: lists(v) for k, v in node.items()}
+        if node and sorted(node) == sorted(str(i) for i in range(len(node))):
+            return [node[str(i)] for i in range(len(node))]
+        return node
+
+    return lists(data)
+
+
+def prodamus_signature(fields: dict, key: str) -> str:
+    """Подпись Продамуса: HMAC-SHA256 от JSON полей, отсортированных по ключам (как в их Hmac::create)."""
+    payload = json.dumps(_nested(fields), ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    # json_encode в PHP экранирует слэши
+    payload = payload.replace("/", "\\/")
+    return hmac.new(key.encode(), payload.encode(), hashlib.sha256).hexdigest()
 
 
 # --- ВЕБХУК ДЛЯ ПРИЕМА ОПЛАТ ---
 async def prodamus_webhook(request):
-    """Обработчик уведомлений от Продамуса с анимацией и реферальным бонусом"""
+    """
+    Обработчик уведомлений от Продамуса.
+    Только проверяет уведомление и записывает заказ в журнал (уникальный ключ —
+    повторы игнорируются), а зачисление, реферальный бонус и сообщения
+    выполняет фоновый конвейер — Продамус получает ответ сразу.
+    """
     data = await request.post()
     raw_dict = dict(data)
 
+    if not PRODAMUS_SECRET_KEY:
+        print("❌ PRODAMUS_SECRET_KEY не задан — уведомления об оплате не принимаются")
+        return web.Response(text="Forbidden", status=403)
+    sign = request.headers.get("Sign", "")
+    if not hmac.compare_digest(sign.lower(), prodamus_signature(raw_dict, PRODAMUS_SECRET_KEY)):
+        print(f"⚠️ Уведомление Продамуса с неверной подписью: {raw_dict.get('order_num')}")
+        return web.Response(text="Forbidden", status=403)
+
     print(f"DEBUG: Входящий запрос от Prodamus: {raw_dict}")
 
     payment_status = data.get("payment_status")
@@ -36,88 +87,38 @@ async def prodamus_webhook(request):
             pass
 
     if payment_status == "success" and order_data:
-        try:
-            order_str = str(order_data)
-            if "_" not in order_str:
-                db.log_payment(temp_user_id, temp_amount, "failed_format", order_str, raw_dict)
-                return web.Response(text="Wrong order format", status=200)
-
-            user_id = temp_user_id
-            amount = temp_amount
-
-            # --- АНИМАЦИЯ ОБРАБОТКИ ---
-            status_msg = await bot.send_message(
-                chat_id=user_id,
-                text="⏳ **Платеж получен! Начинаем обработку...**\n`▒▒▒▒▒▒▒▒▒▒ 0%`",
-                parse_mode="Markdown"
-            )
-            await asyncio.sleep(0.7)
-
-            await status_msg.edit_text(
-                "💳 **Проверка транзакции банком...**\n`█████▒▒▒▒▒ 50%`",
-                parse_mode="Markdown"
-            )
-
-            # 1. Основное начисление покупателю
-            db.update_balance(user_id, amount)
-            db.log_payment(user_id, amount, "success", order_str, raw_dict)
-
-            # --- ЛОГИКА РЕФЕРАЛЬНОГО БОНУСА (Пункт 3) ---
-            referrer_id = db.get_referrer(user_id)
-            bonus_text = ""
-
-            if referrer_id:
-                bonus_amount = int(amount * 0.1)  # 10% от покупки
-                if bonus_amount >= 1:
-                    db.update_balance(referrer_id, bonus_amount)
-                    bonus_text = f"\n🎁 Ваш пригласитель получил бонус `{bonus_amount}` ⚡"
-
-                    # Уведомляем того, кто пригласил
-                    try:
-                        await bot.send_message(
-                            chat_id=referrer_id,
-                            text=(
-                                f"🎉 **Реферальный бонус!**\n\n"
-                                f"Ваш друг совершил покупку. Вам начислено `{bonus_amount}` ⚡\n"
-                                f"Ваш баланс: `{db.get_balance(referrer_id)}` ⚡"
-                            ),
-                            parse_mode="Markdown"
-                        )
-                    except:
-                        pass  # Если пригласивший заблокировал бота
-
-            await asyncio.sleep(0.7)
-
-            await status_msg.edit_text(
-                "⚡ **Зачисление генераций в облако...**\n`██████████ 100%`",
-                parse_mode="Markdown"
-            )
-            await asyncio.sleep(0.6)
-            await status_msg.delete()
-
-            # 4. Итоговое уведомление покупателю
-            await bot.send_message(
-                chat_id=user_id,
-                text=(
-                    f"✅ **Оплата подтверждена!**\n\n"
-                    f"Вам зачислено: `{amount}` ⚡\n"
-                    f"Ваш текущий баланс: `{db.get_balance(user_id)}` ⚡"
-                    f"{bonus_text}"
-                ),
-                reply_markup=main_kb(),
-                parse_mode="Markdown"
-            )
-
-            print(f"✅ УСПЕХ: Начислено {amount} генов пользователю {user_id}")
-            return web.Response(text="OK", status=200)
+        order_str = str(order_data)
+        if temp_user_id is None or temp_amount <= 0:
+            event_log.payment(temp_user_id, temp_amount, "failed_format", order_str, raw_dict)
+            return web.Response(text="Wrong order format", status=200)
 
+        # Количество генераций берется из номера заказа — сверяем его с фактически оплаченной суммой
+        try:
+            paid = float(data.get("sum") or 0)
+        except ValueError:
+            paid = 0
+        price = PACKAGES.get(temp_amount)
+        if price is None or abs(paid - price) > 0.01:
+            event_log.payment(temp_user_id, temp_amount, "failed_sum", order_str, raw_dict)
+            print(f"⚠️ Заказ {order_str}: оплачено {paid}₽, пакет {temp_amount} стоит {price}₽")
+            return web.Response(text="Wrong sum", status=200)
+
+        # order_id — номер платежа на стороне Продамуса, одинаковый во всех повторах уведомления
+        order_key = str(data.get("order_id") or order_str)
+        try:
+            if await db.record_order(order_key, temp_user_id, temp_amount, raw_dict):
+                payment_pipeline.submit(order_key)
+            else:
+                print(f"ℹ️ Повторное уведомление по заказу {order_key} — пропускаем")
         except Exception as e:
             error_msg = f"error: {str(e)}"
-            db.log_payment(temp_user_id, temp_amount, error_msg, str(order_data), raw_dict)
             print(f"❌ ОШИБКА: {error_msg}")
+            # 500 — Продамус повторит уведомление позже
             return web.Response(text="Error", status=500)
 
-    db.log_payment(temp_user_id, temp_amount, f"ignored_{payment_status}", str(order_data), raw_dict)
+        return web.Response(text="OK", status=200)
+
+    event_log.payment(temp_user_id, temp_amount, f"ignored_{payment_status}", str(order_data), raw_dict)
     return web.Response(text="Ignored", status=200)
 
 
@@ -126,10 +127,8 @@ async def prodamus_webhook(request):
 @router.message(F.text == "💳 Пополнить")
 async def show_deposit_menu(message: types.Message):
     kb = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="10 ген. — 149₽", callback_data="pay_10_149")],
-        [types.InlineKeyboardButton(text="25 ген. — 375₽", callback_data="pay_25_375")],
-        [types.InlineKeyboardButton(text="45 ген. — 675₽", callback_data="pay_45_675")],
-        [types.InlineKeyboardButton(text="60 ген. — 900₽", callback_data="pay_60_900")],
+        [types.InlineKeyboardButton(text=f"{amount} ген. — {price}₽", callback_data=f"pay_{amount}_{price}")]
+        for amount, price in PACKAGES.items()
     ])
 
     await message.answer(
@@ -142,12 +141,18 @@ async def show_deposit_menu(message: types.Message):
 
 @router.callback_query(F.data.startswith("pay_"))
 async def create_payment_link(callback: types.CallbackQuery):
-    _, amount, price = callback.data.split("_")
+    _, amount, _ = callback.data.split("_")
     user_id = callback.from_user.id
+    # Цена — из списка пакетов, а не из данных кнопки
+    price = PACKAGES.get(int(amount)) if amount.isdigit() else None
+    if price is None:
+        await callback.answer()
+        return
 
     params = {
         "do": "pay",
-        "order_id": f"{user_id}_{amount}",
+        # Метка времени делает номер заказа уникальным для каждой покупки
+        "order_id": f"{user_id}_{amount}_{int(time.time())}",
         "products[0][name]": f"Пакет {amount} генераций",
         "products[0][price]": price,
         "products[0][quantity]": 1,
@@ -1,13 +1,15 @@
 from aiogram import Router, types, F
 from aiogram.filters import Command  # Импорт для работы команды /counters
 from aiogram.fsm.context import FSMContext
-from aiogram.types import BufferedInputFile, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.states import PhotoProcess
 from app.keyboards.reply import main_kb, cancel_kb
 from app.keyboards.inline import model_inline
-from app.services.telegram_file import get_telegram_photo_url
-from app.services.generation import cost_for, has_balance, generate, charge, generate_video
+from app.services.generation import cost_for, has_balance
+from app.services.health import health
+from app.services.jobs import Job
+from app.services.worker import job_queue, enqueue
 import database as db
 
 router = Router()
@@ -19,13 +21,32 @@ MODEL_NAMES = {
     "seadream": "🎨 SeaDream 4.5"
 }
 
+UNAVAILABLE_TEXT = "⚠️ Эта модель сейчас работает со сбоями. Попробуйте через несколько минут или выберите другую."
+
+
+def _queue_text(position: int) -> str:
+    if position:
+        return f"📋 Ваше место в очереди: `{position}`"
+    return "Пожалуйста, подождите."
+
+
+async def _show_position(status_msg: types.Message, status_text: str, position: int):
+    """Дописывает в статус место в очереди, если генерация не началась сразу."""
+    if not position:
+        return
+    try:
+        await status_msg.edit_text(status_text + _queue_text(position), parse_mode="Markdown")
+    except Exception:
+        pass
+
+
 # --- СЛУЖЕБНЫЕ КОМАНДЫ ---
 
 @router.message(Command("counters"))
 async def show_counters(message: types.Message):
     """Отображает количество пользователей в боте"""
     try:
-        count = db.get_users_count()
+        count = await db.get_users_count()
         await message.answer(
             f"📊 **Статистика бота**\n\n"
             f"👤 Всего зарегистрировано: `{count}` пользователей.",
@@ -47,7 +68,7 @@ async def cancel_text(message: types.Message, state: FSMContext):
 @router.message(F.text == "📸 Начать фотосессию")
 async def start_photo(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    if db.get_balance(user_id) < 1:
+    if await db.get_balance(user_id) < 1:
         return await message.answer("❌ У вас недостаточно генераций.")
 
     await message.answer("🖼 **Пришлите фотографию**, которую хотите изменить:", reply_markup=cancel_kb(),
@@ -57,7 +78,7 @@ async def start_photo(message: types.Message, state: FSMContext):
 
 @router.message(PhotoProcess.waiting_for_photo, F.photo)
 async def on_photo(message: types.Message, state: FSMContext):
-    await state.update_data(photo_id=message.photo[-1].file_id)
+    await state.update_data(photo_id=message.photo[-1].file_id, photo_unique_id=message.photo[-1].file_unique_id)
     await message.answer("🤖 **Выберите нейросеть для обработки:**", reply_markup=model_inline(), parse_mode="Markdown")
     await state.set_state(PhotoProcess.waiting_for_model)
 
@@ -103,42 +124,25 @@ async def on_prompt(message: types.Message, state: FSMContext):
     model = data.get("chosen_model", "nanabanana")
     cost = cost_for(model)
 
-    if not has_balance(user_id, cost):
+    # Модель со сбоями и без замены — отказываем сразу, а не после долгого ожидания
+    if health.route(model, acquire=False) is None:
+        await state.clear()
+        return await message.answer(UNAVAILABLE_TEXT, reply_markup=main_kb())
+
+    # Учитываем генерации, которые уже стоят в очереди, но еще не списаны
+    if not await has_balance(user_id, cost + job_queue.pending_cost(user_id)):
         await state.clear()
         return await message.answer(f"❌ Недостаточно средств. Нужно {cost} ген.", reply_markup=main_kb())
 
+    await state.clear()
     nice_name = MODEL_NAMES.get(model, model)
-    status_msg = await message.answer(f"🚀 **Запускаю магию {nice_name}...**\nПожалуйста, подождите.",
-                                      parse_mode="Markdown")
+    status_text = f"🚀 **Запускаю магию {nice_name}...**\n"
+    status_msg = await message.answer(status_text + _queue_text(0), parse_mode="Markdown")
 
-    try:
-        photo_url = await get_telegram_photo_url(message.bot, data["photo_id"])
-        img_bytes, ext = await generate(photo_url, message.text, model)
-
-        if img_bytes:
-            charge(user_id, cost)
-            file = BufferedInputFile(img_bytes, filename=f"res.{ext or 'png'}")
-            await message.answer_photo(
-                photo=file,
-                caption=(
-                    f"✨ **Ваше фото готово!**\n\n"
-                    f"💰 Списано: `{cost}` ⚡\n"
-                    f"🔋 Баланс: `{db.get_balance(user_id)}` ⚡"
-                ),
-                reply_markup=main_kb(),
-                parse_mode="Markdown"
-            )
-            await state.clear()
-        else:
-            await message.answer("❌ Ошибка нейросети. Попробуйте другой запрос или модель.", reply_markup=main_kb())
-    except Exception as e:
-        print(f"❌ Error in photo: {e}")
-        await message.answer("❌ Произошла ошибка системы. Ваш баланс не был списан.")
-    finally:
-        try:
-            await status_msg.delete()
-        except:
-            pass
+    job = Job(user_id=user_id, chat_id=message.chat.id, model=model, prompt=message.text,
+              photo_id=data["photo_id"], photo_unique_id=data.get("photo_unique_id"), cost=cost,
+              priority=cost, status_message_id=status_msg.message_id)
+    await _show_position(status_msg, status_text, await enqueue(job))
 
 
 # --- БЛОК ОЖИВЛЕНИЯ (IMAGE-TO-VIDEO / KLING 2.5) ---
@@ -147,7 +151,7 @@ async def on_prompt(message: types.Message, state: FSMContext):
 async def start_video(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
 
-    if db.get_balance(user_id) < 5:
+    if await db.get_balance(user_id) < 5:
         return await message.answer("❌ Для оживления видео нужно минимум 5 генераций.")
 
     await message.answer("📸 **Пришлите фото**, которое вы хотите оживить:", reply_markup=cancel_kb(),
@@ -157,7 +161,7 @@ async def start_video(message: types.Message, state: FSMContext):
 
 @router.message(PhotoProcess.waiting_for_video_photo, F.photo)
 async def on_video_photo(message: types.Message, state: FSMContext):
-    await state.update_data(photo_id=message.photo[-1].file_id)
+    await state.update_data(photo_id=message.photo[-1].file_id, photo_unique_id=message.photo[-1].file_unique_id)
 
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="5 секунд (5 ⚡)", callback_data="v_dur_5")],
@@ -206,45 +210,21 @@ async def on_video_prompt(message: types.Message, state: FSMContext):
     model_key = f"kling_{duration}"
     cost = cost_for(model_key)
 
-    if not has_balance(user_id, cost):
+    if health.route(model_key, acquire=False) is None:
+        await state.clear()
+        return await message.answer(UNAVAILABLE_TEXT, reply_markup=main_kb())
+
+    if not await has_balance(user_id, cost + job_queue.pending_cost(user_id)):
         return await message.answer(f"❌ Недостаточно средств. Нужно {cost} ген.", reply_markup=main_kb())
 
-    status_msg = await message.answer(
+    await state.clear()
+    status_text = (
         f"🎬 **Оживляю фото (Kling 2.5, {duration}с)...**\n\n"
-        f"⏳ Процесс может занять до 20 минут. Я пришлю результат сюда!",
-        parse_mode="Markdown"
+        f"⏳ Процесс может занять до 20 минут. Я пришлю результат сюда!\n"
     )
+    status_msg = await message.answer(status_text, parse_mode="Markdown")
 
-    try:
-        photo_url = await get_telegram_photo_url(message.bot, data["photo_id"])
-        video_bytes, ext = await generate_video(photo_url, message.text, duration)
-
-        if video_bytes:
-            charge(user_id, cost)
-            video_file = BufferedInputFile(video_bytes, filename=f"video_{user_id}.mp4")
-
-            # Возвращаем стандартную отправку как VIDEO
-            await message.answer_video(
-                video=video_file,
-                caption=(
-                    f"✅ **Ваше видео готово!**\n\n"
-                    f"💰 Списано: `{cost}` ⚡\n"
-                    f"🔋 Баланс: `{db.get_balance(user_id)}` ⚡"
-                ),
-                reply_markup=main_kb(),
-                parse_mode="Markdown"
-            )
-            await state.clear()
-        else:
-            await message.answer(
-                "⚠️ Не удалось дождаться генерации видео. Попробуйте позже.",
-                reply_markup=main_kb()
-            )
-    except Exception as e:
-        print(f"❌ ERROR KLING: {e}")
-        await message.answer("❌ Ошибка при создании видео.", reply_markup=main_kb())
-    finally:
-        try:
-            await status_msg.delete()
-        except:
-            pass
\ No newline at end of file
+    job = Job(user_id=user_id, chat_id=message.chat.id, model=model_key, prompt=message.text,
+              photo_id=data["photo_id"], photo_unique_id=data.get("photo_unique_id"), cost=cost,
+              duration=duration, priority=cost, status_message_id=status_msg.message_id)
+    await _show_position(status_msg, status_text, await enqueue(job))
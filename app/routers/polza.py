@@ -0,0 +1,33 @@
+import hmac
+
+from aiohttp import web
+
+from app import network
+from app.services import tracing
+
+
+# --- ВЕБХУК ДЛЯ КОЛБЭКОВ POLZA ---
+async def polza_callback(request):
+    """
+    Провайдер сообщает о завершении генерации — статус проверяется сразу, без ожидания опроса.
+    Тело колбэка результатом не считается: ссылку планировщик получает из API провайдера.
+    """
+    if not network.POLZA_CALLBACKS:
+        return web.Response(text="Not found", status=404)
+    if not hmac.compare_digest(request.query.get("token", ""), network.POLZA_CALLBACK_SECRET):
+        return web.Response(text="Forbidden", status=403)
+
+    try:
+        data = await request.json()
+    except Exception:
+        return web.Response(text="Bad request", status=400)
+
+    request_id = data.get("requestId") or data.get("id")
+    if not request_id:
+        return web.Response(text="Bad request", status=400)
+
+    # Колбэк мог прийти раньше, чем задача поставлена на отслеживание, — планировщик его запомнит
+    with tracing.request_span(str(request_id), "callback", status=str(data.get("status"))):
+        known = network.poller.poke(str(request_id))
+    print(f"📬 Колбэк Polza: {request_id}{'' if known else ' (задача еще не отслеживается)'}")
+    return web.Response(text="OK", status=200)
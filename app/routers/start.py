@@ -4,6 +4,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import FSInputFile
 
 from app.keyboards.reply import main_kb
+from app.services.referrals import referral_graph
 import database as db
 
 router = Router()
@@ -19,11 +20,12 @@ async def start_cmd(message: types.Message, state: FSMContext):
         payload = args[1]
         if payload.isdigit():
             referrer_id = int(payload)
-            # ВАЖНО: Сначала записываем связь в базу
-            db.set_referrer(user_id, referrer_id)
+            # ВАЖНО: Сначала записываем связь в базу, граф — только если запись удалась
+            if await db.set_referrer(user_id, referrer_id):
+                referral_graph.add(user_id, referrer_id)
 
     # 2. Теперь инициализируем пользователя (даем баланс, если новый)
-    db.get_balance(user_id)
+    await db.get_balance(user_id)
 
     # 3. Приветствие
     await message.answer(
@@ -0,0 +1,67 @@
+import dataclasses
+import json
+import os
+import time
+
+from app.services.jobs import Job
+from app.services.local_db import LocalDB
+
+# Локальный файл с незавершенными генерациями
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "data/jobs.db")
+
+# Состояния задачи: queued — ждет в очереди, submitted — запущена у провайдера
+# (есть request_id), charged — списана, осталось доставить результат.
+QUEUED = "queued"
+SUBMITTED = "submitted"
+CHARGED = "charged"
+
+
+class JobStore:
+    """Журнал незавершенных генераций в SQLite. Запись удаляется после доставки."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self.db = LocalDB(path, name="jobs-db", schema=(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, data TEXT NOT NULL, updated REAL NOT NULL)"
+        ))
+
+    def _save(self, job: Job, state: str):
+        self.db.connect().execute(
+            "INSERT INTO jobs (id, state, data, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET state = excluded.state, data = excluded.data, updated = excluded.updated",
+            (job.id, state, json.dumps(dataclasses.asdict(job), ensure_ascii=False), time.time())
+        )
+
+    def _delete(self, job_id: str):
+        self.db.connect().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _load(self):
+        rows = self.db.connect().execute("SELECT state, data FROM jobs ORDER BY updated").fetchall()
+        return [(state, json.loads(data)) for state, data in rows]
+
+    async def save(self, job: Job, state: str):
+        try:
+            await self.db.run(self._save, job, state)
+        except Exception as e:
+            print(f"❌ Ошибка сохранения задачи {job.id}: {e}")
+
+    async def delete(self, job: Job):
+        try:
+            await self.db.run(self._delete, job.id)
+        except Exception as e:
+            print(f"❌ Ошибка удаления задачи {job.id}: {e}")
+
+    async def unfinished(self) -> list:
+        """Задачи, которые не успели завершиться до остановки процесса."""
+        fields = {f.name for f in dataclasses.fields(Job)}
+        jobs = []
+        for state, data in await self.db.run(self._load):
+            jobs.append((state, Job(**{k: v for k, v in data.items() if k in fields})))
+        return jobs
+
+    def close(self):
+        self.db.close()
+
+
+store = JobStore()
@@ -0,0 +1,18 @@
+import asyncio
+import os
+
+import database as db
+
+# Как часто сверять поддерживаемые счетчики с реальными данными (сек)
+COUNTERS_RECONCILE_INTERVAL = float(os.getenv("COUNTERS_RECONCILE_INTERVAL", 6 * 3600))
+
+
+async def reconcile_loop():
+    """Периодически пересчитывает счетчики пользователей и рефералов."""
+    while True:
+        try:
+            await db.reconcile_counters()
+            print("📊 Счетчики пользователей сверены")
+        except Exception as e:
+            print(f"❌ Ошибка сверки счетчиков: {e}")
+        await asyncio.sleep(COUNTERS_RECONCILE_INTERVAL)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import uuid
+
+from app.services import metrics
+from app.services.health import backoff
+from app.services.local_db import LocalDB
+import database as db
+
+# Локальный спул событий: копится здесь, пока база недоступна или медленная
+EVENTS_SPOOL_PATH = os.getenv("EVENTS_SPOOL_PATH", "data/events.db")
+# Отправка пачкой: по размеру буфера или по времени
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", 200))
+EVENTS_FLUSH_INTERVAL = float(os.getenv("EVENTS_FLUSH_INTERVAL", 5))
+# Пауза между попытками, если база не принимает пачку
+EVENTS_RETRY_MAX = float(os.getenv("EVENTS_RETRY_MAX", 300))
+# Сколько ждать последней отправки при остановке (остальное останется в спуле);
+# входит в бюджет остановки, см. JOB_DRAIN_TIMEOUT
+EVENTS_CLOSE_TIMEOUT = float(os.getenv("EVENTS_CLOSE_TIMEOUT", 5))
+
+PAYMENT_LOGS = "payment_logs"
+GENERATION_LOGS = "generation_logs"
+
+
+class EventLog:
+    """
+    Журнал событий (оплаты, генерации) с отложенной записью.
+
+    emit() только кладет событие в буфер и сразу возвращает управление.
+    Фоновая задача сбрасывает буфер в локальный SQLite-спул и оттуда
+    отправляет в базу пачками; из спула событие удаляется только после
+    успешной вставки. У каждого события свой event_id, поэтому повторная
+    отправка после сбоя не создает дублей.
+    """
+
+    def __init__(self, path: str = EVENTS_SPOOL_PATH, batch_size: int = EVENTS_BATCH_SIZE,
+                 flush_interval: float = EVENTS_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.spooled = 0
+        self.db = LocalDB(path, name="events-db", pragmas=("synchronous=NORMAL",), schema=(
+            "CREATE TABLE IF NOT EXISTS spool (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "tbl TEXT NOT NULL, payload TEXT NOT NULL)"
+        ))
+        self._wakeup = None
+        self._task = None
+        self._failures = 0
+
+    # --- ПУБЛИЧНЫЙ API ---
+
+    def emit(self, table: str, **fields):
+        fields["event_id"] = uuid.uuid4().hex
+        fields.setdefault("created_at", db.utc_timestamp())
+        self.buffer.append((table, fields))
+        self._ensure_started()
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def payment(self, user_id: int, amount: int, status: str, order_id: str, raw_data: dict):
+        self.emit(PAYMENT_LOGS, user_id=user_id, amount=amount, status=status, order_id=order_id,
+                  raw_data=raw_data)
+
+    def generation(self, job, outcome: str, duration: float):
+        self.emit(GENERATION_LOGS, job_id=job.id, user_id=job.user_id, model=job.model,
+                  routed_model=job.routed_model, cost=job.cost if job.charged else 0,
+                  duration=round(duration, 3), outcome=outcome)
+
+    async def start(self):
+        """Запускает фоновую отправку; события, оставшиеся в спуле с прошлого запуска, уйдут первыми."""
+        self.spooled = await self.db.run(self._count)
+        if self.spooled:
+            print(f"📼 В спуле событий {self.spooled} неотправленных записей")
+        self._ensure_started()
+
+    async def flush(self) -> bool:
+        """Буфер — в спул, спул — в базу. False, если база пока не принимает."""
+        if self.buffer:
+            batch, self.buffer = self.buffer, []
+            try:
+                await self.db.run(self._spool, batch)
+            except Exception:
+                # Спул недоступен (файл заблокирован, нет места) — события остаются в памяти до следующей попытки
+                self.buffer[:0] = batch
+                metrics.failures.inc(kind="events_spool")
+                raise
+            self.spooled += len(batch)
+        while self.spooled:
+            rows = await self.db.run(self._peek, self.batch_size)
+            if not rows:
+                self.spooled = 0
+                break
+            try:
+                await self._send(rows)
+            except Exception as e:
+                metrics.failures.inc(kind="events_flush")
+                print(f"⚠️ Журнал событий: база не приняла пачку ({len(rows)}): {e}")
+                return False
+            await self.db.run(self._ack, [row_id for row_id, _, _ in rows])
+            self.spooled = max(0, self.spooled - len(rows))
+        return True
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=EVENTS_CLOSE_TIMEOUT)
+        except (asyncio.TimeoutError, Exception) as e:
+            print(f"⚠️ Журнал событий: при остановке не отправлено {self.spooled} записей в спуле "
+                  f"и {len(self.buffer)} в памяти ({e!r})")
+        self.db.close()
+
+    # --- ФОНОВАЯ ОТПРАВКА ---
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            delay = self.flush_interval
+            if self._failures:
+                delay = backoff(self._failures, self.flush_interval, EVENTS_RETRY_MAX)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                ok = await self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка журнала событий: {e}")
+                ok = False
+            self._failures = 0 if ok else self._failures + 1
+
+    async def _send(self, rows: list):
+        tables = {}
+        for _, table, payload in rows:
+            tables.setdefault(table, []).append(json.loads(payload))
+        for table, events in tables.items():
+            await db.insert_events(table, events)
+            metrics.events_flushed.inc(len(events), table=table)
+
+    # --- СПУЛ (SQLite) ---
+
+    def _count(self) -> int:
+        return self.db.connect().execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def _write(self, sql: str, params: list):
+        with self.db.transaction() as conn:
+            conn.executemany(sql, params)
+
+    def _spool(self, batch: list):
+        self._write(
+            "INSERT INTO spool (tbl, payload) VALUES (?, ?)",
+            [(table, json.dumps(fields, ensure_ascii=False, separators=(",", ":"))) for table, fields in batch]
+        )
+
+    def _peek(self, limit: int) -> list:
+        return self.db.connect().execute("SELECT id, tbl, payload FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def _ack(self, ids: list):
+        self._write("DELETE FROM spool WHERE id = ?", [(row_id,) for row_id in ids])
+
+
+event_log = EventLog()
+metrics.events_buffered.set_function(lambda: len(event_log.buffer))
+metrics.events_spooled.set_function(lambda: event_log.spooled)
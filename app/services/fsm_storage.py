@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Mapping
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.services.local_db import LocalDB
+
+# Хранилище состояний диалогов: "sqlite" (по умолчанию), "memory" или "redis"
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+# Файл SQLite с состояниями
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "data/fsm.db")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+# Через сколько секунд бездействия брошенный диалог забывается
+FSM_TTL = float(os.getenv("FSM_TTL", 24 * 3600))
+# Изменения пишутся на диск пачками: раз в FSM_FLUSH_INTERVAL сек или при FSM_FLUSH_BATCH ключах
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 0.5))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", 200))
+
+
+def _dumps(data: dict) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в локальном SQLite.
+
+    Чтение идет из памяти (при промахе — из файла), изменения копятся и
+    записываются одной транзакцией в фоне. Файл в режиме WAL могут делить
+    несколько процессов бота; пользователь при этом должен обслуживаться
+    одним процессом, иначе его состояние в памяти другого процесса устареет.
+    """
+
+    def __init__(
+        self,
+        path: str = FSM_DB_PATH,
+        ttl: float = FSM_TTL,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        batch_size: int = FSM_FLUSH_BATCH,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.key_builder = DefaultKeyBuilder(prefix="fsm", separator=":", with_destiny=True)
+        # ключ -> [state, data, expires]
+        self.records = {}
+        self.dirty = set()
+        self.db = LocalDB(path, name="fsm-db", schema=(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, expires REAL NOT NULL"
+            ") WITHOUT ROWID"
+        ))
+        self._flusher = None
+        self._wake = None
+
+    # --- SQLITE (выполняется в отдельном потоке) ---
+
+    def _load(self, key: str):
+        row = self.db.connect().execute(
+            "SELECT state, data, expires FROM fsm WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return [row[0], json.loads(row[1]), row[2]]
+
+    def _write(self, upserts: list, deletes: list):
+        with self.db.transaction() as conn:
+            if upserts:
+                conn.executemany(
+                    "INSERT INTO fsm (key, state, data, expires) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                    "data = excluded.data, expires = excluded.expires",
+                    upserts
+                )
+            if deletes:
+                conn.executemany("DELETE FROM fsm WHERE key = ?", [(key,) for key in deletes])
+            conn.execute("DELETE FROM fsm WHERE expires <= ?", (time.time(),))
+
+    # --- ЗАПИСИ В ПАМЯТИ ---
+
+    async def _record(self, key: StorageKey) -> list:
+        name = self.key_builder.build(key)
+        record = self.records.get(name)
+        if record is None:
+            loaded = await self.db.run(self._load, name) or [None, {}, 0]
+            record = self.records.setdefault(name, loaded)
+        if record[2] and record[2] <= time.time():
+            # Брошенный диалог: начинаем с чистого листа
+            record[0], record[1] = None, {}
+        return record
+
+    def _touch(self, key: StorageKey, record: list):
+        name = self.key_builder.build(key)
+        record[2] = time.time() + self.ttl
+        self.dirty.add(name)
+        if self._flusher is None or self._flusher.done():
+            self._wake = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+        if len(self.dirty) >= self.batch_size:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка записи состояний FSM: {e}")
+            self._evict()
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией."""
+        if not self.dirty:
+            return
+        names, self.dirty = self.dirty, set()
+        upserts, deletes = [], []
+        for name in names:
+            state, data, expires = self.records[name]
+            if state is None and not data:
+                deletes.append(name)
+            else:
+                upserts.append((name, state, _dumps(data), expires))
+        try:
+            await self.db.run(self._write, upserts, deletes)
+        except Exception:
+            # Не потеряем изменения: запишем их при следующей попытке
+            self.dirty |= names
+            raise
+
+    def _evict(self):
+        """Пустые и просроченные записи, уже записанные на диск, больше не держим в памяти."""
+        now = time.time()
+        stale = [
+            name for name, (state, data, expires) in self.records.items()
+            if name not in self.dirty and ((state is None and not data) or (expires and expires <= now))
+        ]
+        for name in stale:
+            del self.records[name]
+
+    # --- ИНТЕРФЕЙС BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._record(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        record = await self._record(key)
+        record[1] = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return (await self._record(key))[1].copy()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"❌ Ошибка записи состояний FSM при остановке: {e}")
+        self.db.close()
+
+
+def create_storage() -> BaseStorage:
+    """Хранилище состояний по переменной FSM_STORAGE."""
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        # Требует пакет redis; хранилище общее для процессов на разных машинах
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(FSM_REDIS_URL, state_ttl=int(FSM_TTL), data_ttl=int(FSM_TTL))
+    return SQLiteStorage()
@@ -1,4 +1,7 @@
-from app.network import process_with_polza, process_video_polza
+from app.network import (
+    VIDEO_MODEL, MODELS_MAP, download_result, process_with_polza, process_video_polza, submit_image,
+    submit_video, wait_image_url, wait_video_url
+)
 import database as db
 
 # Словарь стоимости моделей
@@ -16,17 +19,17 @@ def cost_for(model: str) -> int:
     """
     return COSTS.get(model, 1)
 
-def has_balance(user_id: int, cost: int) -> bool:
+async def has_balance(user_id: int, cost: int) -> bool:
     """
     Проверяет, достаточно ли у пользователя средств для оплаты.
     """
-    return db.get_balance(user_id) >= cost
+    return await db.get_balance(user_id) >= cost
 
-def charge(user_id: int, cost: int):
+async def charge(user_id: int, cost: int):
     """
-    Списывает стоимость с баланса пользователя.
+    Списывает стоимость с баланса пользователя и возвращает новый баланс.
     """
-    db.update_balance(user_id, -cost)
+    return await db.update_balance(user_id, -cost)
 
 async def generate(image_url: str, prompt: str, model: str):
     """
@@ -39,4 +42,29 @@ async def generate_video(image_url: str, prompt: str, duration: int):
     Основная функция для генерации ВИДЕО (Kling 2.5).
     """
     # Вызываем новую функцию видео из network.py
-    return await process_video_polza(prompt, image_url, duration)
\ No newline at end of file
+    return await process_video_polza(prompt, image_url, duration)
+
+async def submit(image_url: str, prompt: str, model: str, duration: int = None):
+    """
+    Запускает генерацию у провайдера и возвращает requestId (или None).
+    Вместе с wait_result_url позволяет сохранить requestId между запуском и ожиданием.
+    """
+    if model.startswith("kling"):
+        return await submit_video(prompt, image_url, duration)
+    return await submit_image(prompt, model, image_url)
+
+async def wait_result_url(request_id: str, model: str, duration: int = None):
+    """
+    Дожидается результата уже запущенной генерации: ссылка на файл у провайдера или None.
+    """
+    if model.startswith("kling"):
+        return await wait_video_url(duration, request_id)
+    return await wait_image_url(model, request_id)
+
+async def download(url: str, model: str, duration: int = None):
+    """
+    Скачивает результат по ссылке: (RelayedMedia, ext) или (None, None).
+    """
+    if model.startswith("kling"):
+        return await download_result(url, f"{VIDEO_MODEL}:{duration}")
+    return await download_result(url, MODELS_MAP.get(model))
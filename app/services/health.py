@@ -0,0 +1,207 @@
+import os
+import random
+import time
+from collections import deque
+
+from app.services import metrics
+
+# Окно, по которому считаются доля ошибок и задержки модели (сек)
+HEALTH_WINDOW = float(os.getenv("HEALTH_WINDOW", 900))
+HEALTH_MAX_EVENTS = int(os.getenv("HEALTH_MAX_EVENTS", 500))
+# Автомат размыкается при доле ошибок >= BREAKER_ERROR_RATE (не меньше BREAKER_MIN_CALLS исходов в окне)
+# или после BREAKER_CONSECUTIVE ошибок подряд
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", 0.5))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))
+BREAKER_CONSECUTIVE = int(os.getenv("BREAKER_CONSECUTIVE", 5))
+# Через сколько секунд разомкнутый автомат пропускает одну пробную генерацию
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 120))
+# Модель считается медленной, если медиана времени генерации выше порога (сек)
+HEALTH_SLOW_SECONDS = {
+    "nanabanana": float(os.getenv("HEALTH_SLOW_NANABANANA", 90)),
+    "nanabanana_pro": float(os.getenv("HEALTH_SLOW_NANABANANA_PRO", 150)),
+    "seadream": float(os.getenv("HEALTH_SLOW_SEADREAM", 120)),
+    "kling_5": float(os.getenv("HEALTH_SLOW_KLING_5", 600)),
+    "kling_10": float(os.getenv("HEALTH_SLOW_KLING_10", 900)),
+}
+# Равноценные замены при сбое или замедлении модели: "модель:замена,..."
+MODEL_FALLBACKS = dict(
+    pair.split(":", 1) for pair in os.getenv("MODEL_FALLBACKS", "nanabanana:seadream,seadream:nanabanana").split(",")
+    if ":" in pair
+)
+# Бюджет повторов: каждый успешный запрос добавляет RETRY_BUDGET_RATIO повтора, не больше RETRY_BUDGET_MAX
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", 20))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Экспоненциальная пауза с полным джиттером: повторы разных задач не совпадают по времени."""
+    return random.uniform(base, max(base, min(cap, base * 2 ** attempt)))
+
+
+class RetryBudget:
+    """Ограничивает повторы долей от успешных запросов: при массовом сбое повторы не умножают нагрузку."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, maximum: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.maximum = maximum
+        self.tokens = maximum
+
+    def deposit(self):
+        self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            metrics.failures.inc(kind="retry_budget_exhausted")
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ModelHealth:
+    """Исходы генераций одной модели за окно и автомат (closed → open → half_open → closed)."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.events = deque(maxlen=HEALTH_MAX_EVENTS)  # (время, успех, длительность)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_at = None
+        self.consecutive_failures = 0
+
+    def _trim(self):
+        edge = time.monotonic() - HEALTH_WINDOW
+        while self.events and self.events[0][0] < edge:
+            self.events.popleft()
+
+    @property
+    def calls(self) -> int:
+        self._trim()
+        return len(self.events)
+
+    @property
+    def errors(self) -> int:
+        self._trim()
+        return sum(1 for _, ok, _ in self.events if not ok)
+
+    def error_rate(self) -> float:
+        calls = self.calls
+        return self.errors / calls if calls else 0.0
+
+    def latency(self, q: float):
+        self._trim()
+        values = sorted(d for _, ok, d in self.events if ok and d is not None)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def slow(self) -> bool:
+        self._trim()
+        samples = sum(1 for _, ok, d in self.events if ok and d is not None)
+        median = self.latency(0.5)
+        threshold = HEALTH_SLOW_SECONDS.get(self.model)
+        return bool(threshold and median and samples >= BREAKER_MIN_CALLS // 2 and median > threshold)
+
+    # --- АВТОМАТ ---
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            print(f"🩺 Модель {self.model}: {self.state} → {state} (ошибок {self.errors}/{self.calls})")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self.probe_at = None
+
+    def available(self) -> bool:
+        """Можно ли сейчас отправлять запросы (без учета занятой пробы)."""
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= BREAKER_COOLDOWN
+        return True
+
+    def acquire(self) -> bool:
+        """Разрешение на одну генерацию; в half_open — только одна проба за раз."""
+        now = time.monotonic()
+        if self.state == OPEN:
+            if now - self.opened_at < BREAKER_COOLDOWN:
+                return False
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            # Пробу возвращает release(); если и он не дошел, через окно разрешаем новую
+            if self.probe_at is not None and now - self.probe_at < HEALTH_WINDOW:
+                return False
+            self.probe_at = now
+        return True
+
+    def release(self, probe_at: float):
+        """Освобождает пробу, если генерация завершилась без исхода (ошибка до запроса, отмена)."""
+        if self.state == HALF_OPEN and self.probe_at == probe_at:
+            self.probe_at = None
+
+    def record(self, ok: bool, duration: float = None):
+        self.events.append((time.monotonic(), ok, duration))
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        if self.state == HALF_OPEN:
+            self._set_state(CLOSED if ok else OPEN)
+            if ok:
+                # Старые ошибки не должны сразу разомкнуть автомат снова
+                self.events.clear()
+                self.events.append((time.monotonic(), ok, duration))
+        elif self.state == CLOSED and not ok:
+            if self.consecutive_failures >= BREAKER_CONSECUTIVE or (
+                    self.calls >= BREAKER_MIN_CALLS and self.error_rate() >= BREAKER_ERROR_RATE):
+                self._set_state(OPEN)
+
+    def reset(self):
+        self.events.clear()
+        self.consecutive_failures = 0
+        self._set_state(CLOSED)
+
+
+class HealthRegistry:
+    """Состояние всех моделей процесса и выбор модели для новой генерации."""
+
+    def __init__(self):
+        self.models = {}
+
+    def get(self, model: str) -> ModelHealth:
+        health = self.models.get(model)
+        if health is None:
+            health = self.models[model] = ModelHealth(model)
+            metrics.circuit_state.set_function(lambda h=health: _STATE_VALUES[h.state], model=model)
+            metrics.model_error_rate.set_function(health.error_rate, model=model)
+        return health
+
+    def record(self, model: str, ok: bool, duration: float = None):
+        self.get(model).record(ok, duration)
+
+    def snapshot(self) -> dict:
+        """Состояния автоматов процесса: {модель: состояние}."""
+        return {model: h.state for model, h in self.models.items()}
+
+    def route(self, model: str, acquire: bool = True):
+        """
+        Модель, на которой выполнить генерацию: выбранная, ее замена (если выбранная
+        разомкнута или медленная, а замена здорова) или None — быстрый отказ.
+        С acquire=False только проверяет, не занимая пробу полуоткрытого автомата.
+        """
+        health = self.get(model)
+        fallback = MODEL_FALLBACKS.get(model)
+        spare = self.get(fallback) if fallback else None
+        spare_ok = spare is not None and spare.state == CLOSED and not spare.slow()
+
+        if health.state == CLOSED and not (health.slow() and spare_ok):
+            return model
+        # Разомкнутую модель после паузы проверяем одной пробной генерацией
+        if health.state != CLOSED and (health.acquire() if acquire else health.available()):
+            return model
+        if spare_ok:
+            if acquire:
+                metrics.reroutes.inc(source=model, target=fallback)
+            return fallback
+        return model if health.state == CLOSED else None
+
+
+health = HealthRegistry()
+retry_budget = RetryBudget()
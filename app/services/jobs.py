@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import time
+import uuid
+from dataclasses import dataclass, field
+
+# Сколько генераций может выполняться одновременно во всем процессе
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 32))
+
+# Отдельные лимиты по моделям (переопределяются переменными JOB_LIMIT_<МОДЕЛЬ>)
+MODEL_LIMITS = {
+    "nanabanana": int(os.getenv("JOB_LIMIT_NANABANANA", 16)),
+    "nanabanana_pro": int(os.getenv("JOB_LIMIT_NANABANANA_PRO", 8)),
+    "seadream": int(os.getenv("JOB_LIMIT_SEADREAM", 8)),
+    "kling_5": int(os.getenv("JOB_LIMIT_KLING_5", 8)),
+    "kling_10": int(os.getenv("JOB_LIMIT_KLING_10", 4)),
+}
+
+
+@dataclass
+class Job:
+    """Задача генерации, поставленная в очередь из обработчика Telegram."""
+    user_id: int
+    chat_id: int
+    model: str
+    prompt: str
+    photo_id: str
+    cost: int
+    photo_unique_id: str = None
+    duration: int = None
+    priority: int = 0
+    status_message_id: int = None
+    request_id: str = None
+    charged: bool = False
+    # Модель, на которой фактически запущена генерация (замена при сбое выбранной)
+    routed_model: str = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    created: float = field(default_factory=time.time)
+
+    @property
+    def target_model(self) -> str:
+        return self.routed_model or self.model
+
+    @property
+    def is_video(self) -> bool:
+        return self.model.startswith("kling")
+
+    @property
+    def cache_key(self):
+        """Ключ одинаковых запросов: то же фото, тот же промпт, модель (фактическая) и параметры."""
+        if not self.photo_unique_id:
+            return None
+        prompt = " ".join(self.prompt.lower().split())
+        raw = f"{self.photo_unique_id}|{self.target_model}|{self.duration}|{prompt}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class JobQueue:
+    """
+    Очередь генераций с пулом исполнителей.
+
+    Задачи выбираются по приоритету (при равном — по времени постановки),
+    но только если у их модели есть свободный слот: занятая видео-модель
+    не задерживает быстрые фото-задачи за ней.
+    """
+
+    def __init__(self, handler, workers: int = JOB_WORKERS, limits: dict = None):
+        self.handler = handler
+        self.workers = workers
+        self.limits = dict(MODEL_LIMITS if limits is None else limits)
+        self.pending = []
+        self.running = {}
+        self._tasks = set()
+        self._seq = itertools.count()
+        self._stopping = False
+
+    @property
+    def active(self) -> int:
+        return sum(len(jobs) for jobs in self.running.values())
+
+    def submit(self, job: Job) -> int:
+        """Ставит задачу в очередь. Возвращает позицию (0 — выполнение уже началось)."""
+        self.pending.append((-job.priority, next(self._seq), job))
+        self.pending.sort(key=lambda item: item[:2])
+        self._dispatch()
+        return self.position(job)
+
+    def position(self, job: Job) -> int:
+        for index, (_, _, queued) in enumerate(self.pending):
+            if queued is job:
+                return index + 1
+        return 0
+
+    def pending_cost(self, user_id: int) -> int:
+        """Сумма стоимости еще не списанных задач пользователя (в очереди и в работе)."""
+        jobs = [item[2] for item in self.pending] + [j for running in self.running.values() for j in running]
+        return sum(job.cost for job in jobs if job.user_id == user_id and not job.charged)
+
+    def _has_slot(self, model: str) -> bool:
+        return len(self.running.get(model, ())) < self.limits.get(model, self.workers)
+
+    def _dispatch(self):
+        if self._stopping:
+            return
+        index = 0
+        while index < len(self.pending) and self.active < self.workers:
+            job = self.pending[index][2]
+            if not self._has_slot(job.model):
+                index += 1
+                continue
+            del self.pending[index]
+            self.running.setdefault(job.model, []).append(job)
+            task = asyncio.create_task(self._execute(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: Job):
+        try:
+            await self.handler(job)
+        except Exception as e:
+            print(f"❌ Ошибка задачи {job.id} ({job.model}): {e}")
+        finally:
+            self.running[job.model].remove(job)
+            self._dispatch()
+
+    async def stop(self, grace: float = 0):
+        """
+        Перестает запускать задачи, ждет выполняющиеся не дольше grace секунд,
+        остальные отменяет (их состояние остается в журнале и восстановится при старте).
+        """
+        self._stopping = True
+        self.pending.clear()
+        if self._tasks and grace > 0:
+            await asyncio.wait(list(self._tasks), timeout=grace)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class LocalDB:
+    """
+    Локальный SQLite-файл процесса: журнал генераций, состояния FSM, спул событий.
+
+    Соединение открывается при первом запросе (каталог создается, режим WAL).
+    Все запросы выполняются через run() в одном отдельном потоке, поэтому
+    соединение используется последовательно и не блокирует event loop.
+    Файлы должны лежать на постоянном томе (см. [mounts] в fly.toml), чтобы
+    пережить остановку машины и редеплой.
+    """
+
+    def __init__(self, path: str, schema: str, name: str, pragmas: tuple = ()):
+        self.path = path
+        self.schema = schema
+        self.pragmas = pragmas
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Файл могут открыть и другие процессы бота
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            for pragma in self.pragmas:
+                self._conn.execute(f"PRAGMA {pragma}")
+            self._conn.executescript(self.schema)
+        return self._conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            # Незакрытая транзакция сломала бы все следующие записи
+            conn.execute("ROLLBACK")
+            raise
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
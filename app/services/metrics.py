@@ -0,0 +1,245 @@
+import os
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+# Если задан, /metrics отдается только с ?token=<METRICS_TOKEN> или заголовком Authorization: Bearer
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Границы корзин гистограмм (сек): быстрые вызовы API и долгие генерации
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SLOW_BUCKETS = (1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300, 600, 900, 1200, 1800)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self.functions = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def set_function(self, function, **labels):
+        """Значение считается при каждом запросе метрик (например, счетчики, которые ведет сам объект)."""
+        self.functions[self._key(labels)] = function
+
+    def render(self) -> list:
+        for key, function in self.functions.items():
+            try:
+                self.values[key] = function()
+            except Exception:
+                pass
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    """Значение задается вручную (set/inc/dec) или считается при каждом запросе метрик."""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + value
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = FAST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = state[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока (работает и вокруг await)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- МЕТРИКИ БОТА ---
+
+db_seconds = Histogram("db_call_seconds", "Database call latency by function", ("function",))
+polza_seconds = Histogram(
+    "polza_request_seconds", "Polza API latency by operation and model", ("operation", "model"),
+    buckets=FAST_BUCKETS + (120, 300)
+)
+telegram_seconds = Histogram(
+    "telegram_request_seconds", "Telegram Bot API latency by method", ("method",),
+    buckets=FAST_BUCKETS + (120,)
+)
+generation_seconds = Histogram(
+    "generation_seconds", "End-to-end generation time from request to delivery", ("model", "outcome"),
+    buckets=SLOW_BUCKETS
+)
+transcode_seconds = Histogram("transcode_seconds", "Result re-encoding time by output format", ("format",))
+transcode_bytes = Counter("transcode_bytes_total", "Result bytes before and after re-encoding", ("direction",))
+delivery_seconds = Histogram(
+    "delivery_seconds", "Result delivery to Telegram by mode (url, relay) and outcome", ("mode", "outcome"),
+    buckets=FAST_BUCKETS + (120,)
+)
+circuit_state = Gauge("model_circuit_state", "Circuit breaker state by model (0 closed, 1 half-open, 2 open)",
+                      ("model",))
+model_error_rate = Gauge("model_error_rate", "Rolling generation error rate by model", ("model",))
+reroutes = Counter("model_reroutes_total", "Generations rerouted to an equivalent model", ("source", "target"))
+events_buffered = Gauge("events_buffered", "Audit events waiting in memory for the next flush")
+events_spooled = Gauge("events_spooled", "Audit events in the local spool not yet written to the database")
+events_flushed = Counter("events_flushed_total", "Audit events written to the database by table", ("table",))
+failures = Counter("failures_total", "Failures by kind", ("kind",))
+jobs_running = Gauge("jobs_running", "Generations currently executing")
+jobs_queued = Gauge("jobs_queued", "Generations waiting in the queue")
+polls_in_flight = Gauge("polls_in_flight", "Provider tasks awaiting completion")
+requests_in_flight = Gauge("http_requests_in_flight", "Outgoing HTTP requests in progress", ("target",))
+connections_open = Gauge("http_connections_open", "Open pooled HTTP connections", ("target",))
+cache_lookups = Counter("user_cache_lookups_total", "User cache lookups by result (hit, miss)", ("result",))
+cache_size = Gauge("user_cache_size", "Users currently held in the cache")
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    """Middleware сессии aiogram: время и ошибки каждого запроса к Telegram."""
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        requests_in_flight.inc(target="telegram")
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            failures.inc(kind="telegram")
+            raise
+        finally:
+            requests_in_flight.dec(target="telegram")
+            telegram_seconds.observe(time.perf_counter() - started, method=name)
+
+
+def merge(texts: dict, label: str = "worker") -> str:
+    """
+    Объединяет метрики нескольких процессов {значение метки: текст} в один ответ:
+    каждой строке добавляется метка процесса, HELP/TYPE остаются по одному разу.
+    """
+    families, order = {}, []
+    for value, text in texts.items():
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                family = parts[2] if len(parts) > 2 else family
+                if family not in families:
+                    families[family] = {"meta": [], "samples": []}
+                    order.append(family)
+                if len(families[family]["meta"]) < 2 and line not in families[family]["meta"]:
+                    families[family]["meta"].append(line)
+                continue
+            if not line.strip() or family is None:
+                continue
+            name, sep, rest = line.partition("{")
+            extra = f'{label}="{_escape(value)}"'
+            if sep:
+                line = f"{name}{{{extra},{rest}"
+            else:
+                name, _, number = line.partition(" ")
+                line = f"{name}{{{extra}}} {number}"
+            families[family]["samples"].append(line)
+
+    lines = []
+    for family in order:
+        lines.extend(families[family]["meta"])
+        lines.extend(families[family]["samples"])
+    return "\n".join(lines) + "\n"
+
+
+def authorized(request) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    bearer = request.headers.get("Authorization", "")
+    return request.query.get("token") == METRICS_TOKEN or bearer == f"Bearer {METRICS_TOKEN}"
+
+
+def response(text: str) -> web.Response:
+    return web.Response(text=text, content_type="text/plain", charset="utf-8",
+                        headers={"Cache-Control": "no-cache"})
+
+
+async def handle(request):
+    """GET /metrics"""
+    if not authorized(request):
+        return web.Response(text="Forbidden", status=403)
+    return response(render())
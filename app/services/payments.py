@@ -0,0 +1,233 @@
+import asyncio
+import os
+
+from app import supervisor
+from app.bot import bot
+from app.keyboards.reply import main_kb
+from app.services import metrics, tracing
+from app.services.events import event_log
+from app.services.health import backoff
+from app.services.referrals import referral_graph
+import database as db
+
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", 2))
+# Повторы зачисления при сбое базы; после них заказ остается pending до следующего запуска
+PAYMENT_RETRIES = int(os.getenv("PAYMENT_RETRIES", 5))
+PAYMENT_RETRY_BASE = float(os.getenv("PAYMENT_RETRY_BASE", 2))
+PAYMENT_RETRY_MAX = float(os.getenv("PAYMENT_RETRY_MAX", 120))
+
+
+async def _notify_referrer(referrer_id: int, bonus_amount: int, referrer_balance: int):
+    # Уведомляем того, кто пригласил
+    try:
+        await bot.send_message(
+            chat_id=referrer_id,
+            text=(
+                f"🎉 **Реферальный бонус!**\n\n"
+                f"Ваш друг совершил покупку. Вам начислено `{bonus_amount}` ⚡\n"
+                f"Ваш баланс: `{referrer_balance}` ⚡"
+            ),
+            parse_mode="Markdown"
+        )
+    except Exception:
+        pass  # Если пригласивший заблокировал бота
+
+
+async def _notify_buyer(user_id: int, amount: int, new_balance: int, bonus_text: str):
+    # --- АНИМАЦИЯ ОБРАБОТКИ ---
+    status_msg = await bot.send_message(
+        chat_id=user_id,
+        text="⏳ **Платеж получен! Начинаем обработку...**\n`▒▒▒▒▒▒▒▒▒▒ 0%`",
+        parse_mode="Markdown"
+    )
+    await asyncio.sleep(0.7)
+    await status_msg.edit_text(
+        "💳 **Проверка транзакции банком...**\n`█████▒▒▒▒▒ 50%`",
+        parse_mode="Markdown"
+    )
+    await asyncio.sleep(0.7)
+    await status_msg.edit_text(
+        "⚡ **Зачисление генераций в облако...**\n`██████████ 100%`",
+        parse_mode="Markdown"
+    )
+    await asyncio.sleep(0.6)
+    await status_msg.delete()
+
+    # Итоговое уведомление покупателю
+    await bot.send_message(
+        chat_id=user_id,
+        text=(
+            f"✅ **Оплата подтверждена!**\n\n"
+            f"Вам зачислено: `{amount}` ⚡\n"
+            f"Ваш текущий баланс: `{new_balance}` ⚡"
+            f"{bonus_text}"
+        ),
+        reply_markup=main_kb(),
+        parse_mode="Markdown"
+    )
+
+
+class _Settlement:
+    """Зачисленный заказ, по которому еще не выплачены бонусы и не отправлено уведомление."""
+    __slots__ = ("order_key", "user_id", "amount", "balance", "chain", "paid", "bonus_text")
+
+    def __init__(self, order_key: str, user_id: int, amount: int, balance: int, chain: list):
+        self.order_key = order_key
+        self.user_id = user_id
+        self.amount = amount
+        self.balance = balance
+        # [(referrer_id, bonus), ...] и уровни, уже выплаченные прошлыми попытками
+        self.chain = chain
+        self.paid = set()
+        self.bonus_text = ""
+
+
+async def _credit(order_key: str, trace):
+    """
+    Зачисляет заказ покупателю. Смена статуса pending -> credited и
+    начисление выполняются одной транзакцией: повторная обработка (ретрай
+    вебхука, второй исполнитель, перезапуск) ничего не начислит второй раз,
+    а сбой до коммита оставляет заказ pending для повтора.
+    """
+    # Граф нужен для бонусов; загружаем до зачисления, чтобы сбой загрузки оставил заказ pending
+    if not referral_graph.loaded:
+        await referral_graph.load()
+
+    with tracing.span("credit"):
+        order = await db.credit_order(order_key)
+    if not order:
+        return None
+
+    user_id, amount, raw_data = order["user_id"], order["amount"], order.get("raw_data") or {}
+    trace.attrs.update(user_id=user_id, amount=amount)
+    # Уведомление могло попасть в запасной обработчик, а заказ после перезапуска — в любой:
+    # сбрасываем кэш баланса в процессе, который обслуживает покупателя
+    await supervisor.invalidate_user(user_id)
+    event_log.payment(user_id, amount, "success", order_key, raw_data)
+    print(f"✅ УСПЕХ: Начислено {amount} генов пользователю {user_id}")
+
+    # Вся цепочка пригласителей берется из графа в памяти одним вызовом
+    chain = referral_graph.bonus_chain(user_id, amount)
+    referral_graph.record_purchase(user_id, amount, order_key)
+    return _Settlement(order_key, user_id, amount, order["balance"], chain)
+
+
+async def _pay_bonuses(settlement: _Settlement):
+    """Реферальные бонусы по зачисленному заказу; при повторе выплачиваются только оставшиеся уровни."""
+    with tracing.span("referral", levels=len(settlement.chain)):
+        for level, (referrer_id, bonus_amount) in enumerate(settlement.chain):
+            if level in settlement.paid:
+                continue
+            # Ошибка уходит в PaymentPipeline — этап бонусов будет повторен
+            referrer_balance = await db.add_balance(referrer_id, bonus_amount)
+            settlement.paid.add(level)
+            # Пригласителя обслуживает, возможно, другой процесс — там закэширован старый баланс
+            await supervisor.invalidate_user(referrer_id)
+            if level == 0:
+                settlement.bonus_text = f"\n🎁 Ваш пригласитель получил бонус `{bonus_amount}` ⚡"
+            await _notify_referrer(referrer_id, bonus_amount, referrer_balance)
+
+
+async def _notify(settlement: _Settlement):
+    try:
+        await _notify_buyer(settlement.user_id, settlement.amount, settlement.balance, settlement.bonus_text)
+    except Exception as e:
+        print(f"⚠️ Не удалось уведомить покупателя {settlement.user_id}: {e}")
+
+
+class PaymentPipeline:
+    """
+    Фоновая обработка оплат: вебхук только записывает заказ и ставит его сюда.
+    Два этапа с отдельными повторами: зачисление (заказ pending) и затем
+    бонусы пригласителям (заказ уже зачислен, повтор не трогает баланс покупателя).
+    """
+
+    def __init__(self, workers: int = PAYMENT_WORKERS):
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.attempts = {}
+        # order_key -> _Settlement: зачисленные заказы, ожидающие этапа бонусов
+        self.settlements = {}
+        self._tasks = []
+        # Уведомления покупателям (анимация ~2 с) идут отдельно и не занимают исполнителей
+        self._notifications = set()
+
+    def submit(self, order_key: str):
+        self.queue.put_nowait(order_key)
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        # Заказы, записанные до перезапуска, но не успевшие обработаться
+        try:
+            for order_key in await db.pending_orders():
+                self.submit(order_key)
+        except Exception as e:
+            print(f"❌ Ошибка загрузки необработанных заказов: {e}")
+
+    async def stop(self):
+        for task in self._tasks + list(self._notifications):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._notifications, return_exceptions=True)
+        self._tasks = []
+
+    async def process_order(self, order_key: str) -> str:
+        outcome = "error"
+        with tracing.active(tracing.tracer.start(order_key, "payment")) as trace:
+            try:
+                settlement = self.settlements.get(order_key)
+                if settlement is None:
+                    settlement = await _credit(order_key, trace)
+                    if settlement is None:
+                        outcome = "skipped"
+                        return outcome
+                    self.settlements[order_key] = settlement
+                await _pay_bonuses(settlement)
+                del self.settlements[order_key]
+                self._spawn_notify(settlement)
+                outcome = "ok"
+                return outcome
+            finally:
+                tracing.tracer.finish(order_key, outcome)
+
+    def _spawn_notify(self, settlement: _Settlement):
+        task = asyncio.create_task(_notify(settlement))
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    async def _worker(self):
+        while True:
+            order_key = await self.queue.get()
+            try:
+                await self.process_order(order_key)
+                self.attempts.pop(order_key, None)
+            except Exception as e:
+                print(f"❌ Ошибка обработки заказа {order_key}: {e}")
+                event_log.payment(None, 0, f"error: {e}", order_key, {})
+                self._retry(order_key)
+            finally:
+                self.queue.task_done()
+
+    def _retry(self, order_key: str):
+        # Продамус уже получил ответ; повторяется только незавершенный этап с растущей паузой
+        settlement = self.settlements.get(order_key)
+        metrics.failures.inc(kind="payment_bonus" if settlement else "payment_credit")
+        attempt = self.attempts.get(order_key, 0) + 1
+        if attempt > PAYMENT_RETRIES:
+            self.attempts.pop(order_key, None)
+            if settlement is None:
+                # Заказ остался pending — его подхватит start() после перезапуска
+                print(f"⚠️ Заказ {order_key} не зачислен после {PAYMENT_RETRIES} повторов, повтор после перезапуска")
+                return
+            # Покупателю уже зачислено: фиксируем невыплаченные бонусы для ручной сверки
+            del self.settlements[order_key]
+            unpaid = [list(link) for level, link in enumerate(settlement.chain) if level not in settlement.paid]
+            event_log.payment(settlement.user_id, settlement.amount, "bonus_failed", order_key, {"unpaid": unpaid})
+            print(f"⚠️ Бонусы по заказу {order_key} не выплачены после {PAYMENT_RETRIES} повторов: {unpaid}")
+            self._spawn_notify(settlement)
+            return
+        self.attempts[order_key] = attempt
+        delay = backoff(attempt, PAYMENT_RETRY_BASE, PAYMENT_RETRY_MAX)
+        asyncio.get_running_loop().call_later(delay, self.submit, order_key)
+
+
+payment_pipeline = PaymentPipeline()
@@ -0,0 +1,253 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+from app.services.health import backoff
+
+# Ограничение на общее число запросов статуса в секунду (на весь процесс)
+POLL_MAX_RPS = float(os.getenv("POLL_MAX_RPS", 20))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", 2))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", 30))
+# Первая проверка — не позже чем через столько секунд: быстрая генерация не ждет завышенной оценки
+POLL_FIRST_MAX = float(os.getenv("POLL_FIRST_MAX", 3))
+# Колбэк, пришедший раньше, чем задача поставлена на отслеживание, помнится столько секунд
+POLL_EARLY_TTL = float(os.getenv("POLL_EARLY_TTL", 60))
+# Сколько ошибок опроса подряд допускается на одну задачу, прежде чем она считается неудачной
+POLL_ERROR_BUDGET = int(os.getenv("POLL_ERROR_BUDGET", 8))
+
+# Стартовые оценки времени генерации (сек), пока нет собственной статистики
+DEFAULT_EXPECTED = {
+    "nano-banana": 15,
+    "gemini-3-pro-image-preview": 40,
+    "seedream-v4.5": 30,
+    "kling2.5-image-to-video:5": 120,
+    "kling2.5-image-to-video:10": 240,
+}
+
+
+class _Job:
+    __slots__ = ("kind", "model", "request_id", "future", "started", "deadline", "polls", "errors", "last_pending",
+                 "notified", "due")
+
+    def __init__(self, kind, model, request_id, future, timeout):
+        self.kind = kind
+        self.model = model
+        self.request_id = request_id
+        self.future = future
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout
+        self.polls = 0
+        self.errors = 0
+        # Когда провайдер последний раз ответил "еще не готово" (момент отправки запроса)
+        self.last_pending = self.started
+        # Когда провайдер прислал колбэк о готовности
+        self.notified = None
+        # Время ближайшей запланированной проверки (более ранние записи в очереди устарели)
+        self.due = None
+
+
+class PollScheduler:
+    """
+    Единый планировщик опроса статусов генераций.
+
+    Вместо отдельного цикла sleep() на каждую генерацию все незавершенные
+    requestId лежат в одной очереди по времени следующей проверки. Интервал
+    подбирается по модели: пока задача заведомо не готова (по средней
+    длительности прошлых генераций), опрос откладывается, около ожидаемого
+    момента готовности — учащается, затем снова плавно реже.
+    """
+
+    def __init__(self, fetch, max_rps: float = POLL_MAX_RPS, min_interval: float = POLL_MIN_INTERVAL):
+        # fetch(kind, request_id) -> ("pending" | "done" | "failed" | "error", url | None)
+        self.fetch = fetch
+        self.max_rps = max_rps
+        # Если провайдер присылает колбэки, опрос нужен только как редкая подстраховка
+        self.min_interval = min_interval
+        self.expected = dict(DEFAULT_EXPECTED)
+        self.requests_sent = 0
+        self._jobs = {}
+        # requestId -> время колбэка, пришедшего до watch()
+        self._early = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Ссылки на запущенные опросы, чтобы задачи не собрал сборщик мусора
+        self._polls = set()
+
+    # --- СТАТИСТИКА ---
+
+    def _expected_for(self, model: str) -> float:
+        return self.expected.get(model, 60)
+
+    def _observe(self, model: str, duration: float):
+        # Экспоненциальное сглаживание: последние генерации весят больше
+        old = self.expected.get(model)
+        self.expected[model] = duration if old is None else old * 0.8 + duration * 0.2
+
+    def _next_delay(self, job: _Job) -> float:
+        elapsed = time.monotonic() - job.started
+        expected = self._expected_for(job.model)
+        if job.polls == 0:
+            delay = min(POLL_FIRST_MAX, max(0.0, expected * 0.8 - elapsed))
+        elif elapsed < expected * 0.8:
+            delay = expected * 0.8 - elapsed
+        else:
+            delay = (elapsed - expected * 0.8) * 0.25
+        return max(self.min_interval, min(POLL_MAX_INTERVAL, delay))
+
+    # --- ПУБЛИЧНЫЙ API ---
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._jobs)
+
+    def watch(self, kind: str, model: str, request_id: str, timeout: float) -> asyncio.Future:
+        """Ставит requestId на отслеживание. Future вернет URL результата или None."""
+        self._ensure_started()
+        job = self._jobs.get(request_id)
+        if job is None:
+            future = asyncio.get_running_loop().create_future()
+            job = _Job(kind, model, request_id, future, timeout)
+            self._jobs[request_id] = job
+            notified = self._early.pop(request_id, None)
+            if notified is not None and time.monotonic() - notified < POLL_EARLY_TTL:
+                # Провайдер уже сообщил о готовности — проверяем сразу
+                job.notified = notified
+                self._schedule(job, 0)
+            else:
+                self._schedule(job, self._next_delay(job))
+        return job.future
+
+    async def wait(self, kind: str, model: str, request_id: str, timeout: float):
+        future = self.watch(kind, model, request_id, timeout)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            self._jobs.pop(request_id, None)
+            raise
+
+    def model_of(self, request_id: str):
+        job = self._jobs.get(request_id)
+        return job.model if job else None
+
+    def poke(self, request_id: str) -> bool:
+        """
+        Внешний сигнал о готовности (колбэк провайдера): статус проверяется сразу,
+        не дожидаясь расписания. Сигнал для задачи, которую еще не начали
+        отслеживать, запоминается на POLL_EARLY_TTL. False — задача пока неизвестна.
+        """
+        now = time.monotonic()
+        job = self._jobs.get(request_id)
+        if job is None:
+            self._early = {rid: at for rid, at in self._early.items() if now - at < POLL_EARLY_TTL}
+            self._early[request_id] = now
+            return False
+        job.notified = now
+        self._schedule(job, 0)
+        return True
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._polls):
+            task.cancel()
+        await asyncio.gather(*self._polls, return_exceptions=True)
+        for job in list(self._jobs.values()):
+            if not job.future.done():
+                job.future.cancel()
+        self._jobs.clear()
+        self._early.clear()
+        self._heap.clear()
+
+    # --- ВНУТРЕННЕЕ ---
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _schedule(self, job: _Job, delay: float):
+        job.due = time.monotonic() + delay
+        heapq.heappush(self._heap, (job.due, next(self._seq), job.request_id))
+        self._wakeup.set()
+
+    def _finish(self, job: _Job, state: str, url: str = None, finished: float = None):
+        """finished — оценка момента готовности у провайдера (по умолчанию — сейчас, как при колбэке)."""
+        self._jobs.pop(job.request_id, None)
+        if state == "done":
+            self._observe(job.model, max(0.0, (finished or time.monotonic()) - job.started))
+        if not job.future.done():
+            job.future.set_result(url if state == "done" else None)
+
+    async def _run(self):
+        min_gap = 1 / self.max_rps if self.max_rps > 0 else 0
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, _, request_id = self._heap[0]
+            now = time.monotonic()
+            if due > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            job = self._jobs.get(request_id)
+            if job is None or job.future.done():
+                self._jobs.pop(request_id, None)
+                continue
+            if due != job.due:
+                # Проверку перенесли (колбэк попросил проверить раньше)
+                continue
+            if now > job.deadline:
+                print(f"⚠️ Задача {request_id} завершилась по таймауту ({job.polls} опросов).")
+                self._finish(job, "timeout")
+                continue
+
+            task = asyncio.create_task(self._poll(job))
+            self._polls.add(task)
+            task.add_done_callback(self._polls.discard)
+            await asyncio.sleep(min_gap)
+
+    async def _poll(self, job: _Job):
+        job.polls += 1
+        self.requests_sent += 1
+        sent = time.monotonic()
+        try:
+            state, url = await self.fetch(job.kind, job.request_id)
+        except Exception as e:
+            print(f"❌ Ошибка опроса {job.request_id}: {e}")
+            state, url = "error", None
+
+        if job.request_id not in self._jobs:
+            return
+        if state == "error":
+            # Сбой запроса статуса: повтор с растущей паузой, но не бесконечно
+            job.errors += 1
+            if job.errors > POLL_ERROR_BUDGET:
+                print(f"⚠️ Задача {job.request_id}: {job.errors} ошибок опроса подряд, прекращаем ожидание")
+                self._finish(job, "failed")
+                return
+            self._schedule(job, max(self._next_delay(job), backoff(job.errors, self.min_interval, POLL_MAX_INTERVAL)))
+        elif state == "pending":
+            job.errors = 0
+            job.last_pending = sent
+            # После колбэка ссылка может еще не появиться в API — перепроверяем часто, а не по расписанию
+            self._schedule(job, POLL_MIN_INTERVAL if job.notified else self._next_delay(job))
+        else:
+            # Готово в момент колбэка или где-то между последним "pending" и этим запросом: учимся по середине
+            # интервала, а не по моменту обнаружения — иначе оценка привязана к собственной задержке опроса
+            self._finish(job, state, url, finished=job.notified or (job.last_pending + sent) / 2)
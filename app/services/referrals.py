@@ -0,0 +1,159 @@
+import asyncio
+import os
+import time
+
+import database as db
+
+# Проценты бонуса по уровням: [0.1] — 10% только прямому пригласителю.
+# Например, "0.1,0.03" добавит 3% пригласителю пригласителя.
+REFERRAL_LEVELS = [float(x) for x in os.getenv("REFERRAL_LEVELS", "0.1").split(",") if x.strip()]
+# Как часто догружать из БД новые связи и покупки (их могли записать другие процессы).
+# Читаются только записи не старше прошлой загрузки, а не весь граф.
+REFERRAL_GRAPH_REFRESH = float(os.getenv("REFERRAL_GRAPH_REFRESH", 60))
+# Запас по времени при догрузке: расхождение часов и долгие транзакции
+REFERRAL_SYNC_OVERLAP = float(os.getenv("REFERRAL_SYNC_OVERLAP", 300))
+
+
+class ReferralGraph:
+    """
+    Граф приглашений в памяти: кто кого пригласил, рефералы по уровням
+    и заработанные бонусы. Загружается из БД целиком один раз, дальше
+    обновляется вместе с записью в БД (set_referrer, зачисление оплат)
+    и догружает записи других процессов (sync).
+    """
+
+    def __init__(self, levels: list = None):
+        self.levels = list(REFERRAL_LEVELS if levels is None else levels)
+        self.parent = {}
+        self.children = {}
+        self.earned = {}
+        # order_key -> когда учтена покупка: одна покупка может прийти и локально, и при догрузке
+        self.counted = {}
+        self.synced_at = None
+        self.loaded = False
+
+    # --- ЗАГРУЗКА И СИНХРОНИЗАЦИЯ ---
+
+    async def load(self):
+        """Полная загрузка (при старте)."""
+        started = time.time()
+        edges = await db.get_referral_edges()
+        orders = await db.get_credited_orders()
+
+        self.parent, self.children, self.earned, self.counted = {}, {}, {}, {}
+        for user_id, referrer_id in edges:
+            self._link(user_id, referrer_id)
+        for order_key, user_id, amount in orders:
+            self.record_purchase(user_id, amount, order_key)
+        self.synced_at = started
+        self.loaded = True
+
+    async def sync(self) -> tuple:
+        """Догружает связи и покупки, записанные после прошлой загрузки. Возвращает (связей, покупок)."""
+        started = time.time()
+        since = db.utc_timestamp(self.synced_at - REFERRAL_SYNC_OVERLAP)
+        edges = await db.get_referral_edges(since)
+        orders = await db.get_credited_orders(since)
+
+        linked = 0
+        for user_id, referrer_id in edges:
+            linked += self.add(user_id, referrer_id)
+        bought = sum(self.record_purchase(user_id, amount, order_key) for order_key, user_id, amount in orders)
+        self.synced_at = started
+        # Покупки старше окна догрузки повторно не придут
+        edge = started - 2 * (REFERRAL_SYNC_OVERLAP + REFERRAL_GRAPH_REFRESH)
+        self.counted = {key: at for key, at in self.counted.items() if at >= edge}
+        return linked, bought
+
+    def _link(self, user_id: int, referrer_id: int):
+        self.parent[user_id] = referrer_id
+        self.children.setdefault(referrer_id, set()).add(user_id)
+
+    def add(self, user_id: int, referrer_id: int) -> bool:
+        """Та же логика, что в db.set_referrer: реферер задается только один раз."""
+        if user_id == referrer_id or user_id in self.parent:
+            return False
+        self._link(user_id, referrer_id)
+        return True
+
+    def record_purchase(self, user_id: int, amount: int, order_key: str) -> bool:
+        if order_key in self.counted:
+            return False
+        self.counted[order_key] = time.time()
+        for referrer_id, bonus in self.bonus_chain(user_id, amount):
+            self.earned[referrer_id] = self.earned.get(referrer_id, 0) + bonus
+        return True
+
+    # --- ЗАПРОСЫ ---
+
+    def referrer_of(self, user_id: int):
+        return self.parent.get(user_id)
+
+    def referrals_of(self, user_id: int) -> set:
+        return set(self.children.get(user_id, ()))
+
+    def referrals_count(self, user_id: int) -> int:
+        return len(self.children.get(user_id, ()))
+
+    def upline(self, user_id: int, levels: int) -> list:
+        """Цепочка пригласителей вверх: [пригласитель, его пригласитель, ...]."""
+        chain, seen = [], {user_id}
+        current = user_id
+        for _ in range(levels):
+            current = self.parent.get(current)
+            if current is None or current in seen:
+                break
+            chain.append(current)
+            seen.add(current)
+        return chain
+
+    def downline(self, user_id: int, levels: int) -> list:
+        """Рефералы по уровням: [прямые, рефералы прямых, ...]."""
+        result, seen = [], {user_id}
+        current = {user_id}
+        for _ in range(levels):
+            following = set()
+            for node in current:
+                following.update(self.children.get(node, ()))
+            following -= seen
+            if not following:
+                break
+            result.append(following)
+            seen |= following
+            current = following
+        return result
+
+    def earnings(self, user_id: int) -> int:
+        return self.earned.get(user_id, 0)
+
+    def bonus_chain(self, user_id: int, amount: int) -> list:
+        """Все реферальные бонусы за покупку одним вызовом: [(referrer_id, bonus), ...]."""
+        chain = []
+        for referrer_id, percent in zip(self.upline(user_id, len(self.levels)), self.levels):
+            bonus = int(amount * percent)
+            if bonus >= 1:
+                chain.append((referrer_id, bonus))
+        return chain
+
+    def bonus_chains(self, purchases: list) -> dict:
+        """Пакетный вариант: {user_id: [(referrer_id, bonus), ...]} для списка (user_id, amount)."""
+        return {user_id: self.bonus_chain(user_id, amount) for user_id, amount in purchases}
+
+
+referral_graph = ReferralGraph()
+
+
+async def refresh_loop():
+    """Загружает граф при старте и периодически догружает новые записи из БД."""
+    while True:
+        try:
+            if not referral_graph.loaded:
+                await referral_graph.load()
+                print(f"👥 Граф рефералов загружен: {len(referral_graph.parent)} связей")
+            else:
+                linked, bought = await referral_graph.sync()
+                if linked or bought:
+                    print(f"👥 Граф рефералов: +{linked} связей, +{bought} покупок")
+        except Exception as e:
+            print(f"❌ Ошибка загрузки графа рефералов: {e}")
+        await asyncio.sleep(REFERRAL_GRAPH_REFRESH)
@@ -0,0 +1,128 @@
+import os
+import tempfile
+
+import aiofiles
+from aiogram.types import BufferedInputFile, FSInputFile, InputFile
+
+# Файлы крупнее порога сразу пишутся во временный файл, а не держатся в памяти
+RELAY_SPILL_THRESHOLD = int(os.getenv("RELAY_SPILL_THRESHOLD", 8 * 1024 * 1024))
+# Общий лимит памяти на все одновременно передаваемые файлы
+RELAY_MEMORY_BUDGET = int(os.getenv("RELAY_MEMORY_BUDGET", 128 * 1024 * 1024))
+RELAY_CHUNK_SIZE = int(os.getenv("RELAY_CHUNK_SIZE", 64 * 1024))
+RELAY_TMP_DIR = os.getenv("RELAY_TMP_DIR") or None
+
+
+class MemoryBudget:
+    """Счетчик байт, которые сейчас лежат в памяти у всех передач вместе."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def try_acquire(self, size: int) -> bool:
+        if self.used + size > self.limit:
+            return False
+        self.used += size
+        return True
+
+    def release(self, size: int):
+        self.used = max(0, self.used - size)
+
+
+budget = MemoryBudget(RELAY_MEMORY_BUDGET)
+
+
+class _ChunksInputFile(InputFile):
+    """Отдает в Telegram уже скачанные куски без склейки в один bytes."""
+
+    def __init__(self, chunks: list, filename: str):
+        super().__init__(filename=filename, chunk_size=RELAY_CHUNK_SIZE)
+        self.chunks = chunks
+
+    async def read(self, bot):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class RelayedMedia:
+    """
+    Скачанный результат генерации: куски в памяти (в пределах бюджета)
+    или временный файл на диске. После отправки нужно вызвать close().
+    """
+
+    def __init__(self, ext: str):
+        self.ext = ext
+        self.size = 0
+        self._chunks = []
+        self._reserved = 0
+        self._path = None
+        self._file = None
+
+    @property
+    def on_disk(self) -> bool:
+        return self._path is not None
+
+    async def _spill(self):
+        fd, self._path = tempfile.mkstemp(suffix=f".{self.ext}", dir=RELAY_TMP_DIR)
+        os.close(fd)
+        self._file = await aiofiles.open(self._path, "wb")
+        for chunk in self._chunks:
+            await self._file.write(chunk)
+        self._chunks = []
+        budget.release(self._reserved)
+        self._reserved = 0
+
+    async def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._file is None:
+            if self.size <= RELAY_SPILL_THRESHOLD and budget.try_acquire(len(chunk)):
+                self._reserved += len(chunk)
+                self._chunks.append(chunk)
+                return
+            await self._spill()
+        await self._file.write(chunk)
+
+    async def finish(self):
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+
+    def content(self):
+        """Путь к файлу на диске или содержимое из памяти (для обработки в другом потоке/процессе)."""
+        if self.on_disk:
+            return self._path
+        return b"".join(self._chunks)
+
+    def input_file(self, filename: str) -> InputFile:
+        if self.on_disk:
+            return FSInputFile(self._path, filename=filename, chunk_size=RELAY_CHUNK_SIZE)
+        if len(self._chunks) == 1:
+            return BufferedInputFile(self._chunks[0], filename=filename)
+        return _ChunksInputFile(self._chunks, filename=filename)
+
+    def close(self):
+        self._chunks = []
+        budget.release(self._reserved)
+        self._reserved = 0
+        if self._path:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+
+async def receive(response, ext: str) -> RelayedMedia:
+    """Читает тело ответа кусками: в память, пока позволяет бюджет, иначе на диск."""
+    media = RelayedMedia(ext)
+    try:
+        if (response.content_length or 0) > RELAY_SPILL_THRESHOLD:
+            await media._spill()
+        async for chunk in response.content.iter_chunked(RELAY_CHUNK_SIZE):
+            await media.write(chunk)
+        await media.finish()
+    except BaseException:
+        await media.finish()
+        media.close()
+        raise
+    return media
@@ -1,7 +1,19 @@
 import os
 from aiogram import Bot
 
+from app.services.cache import TTLCache
+
+# Ссылка на файл Telegram действительна не меньше часа — кэшируем с запасом
+FILE_PATH_TTL = float(os.getenv("FILE_PATH_TTL", 50 * 60))
+
+# file_id -> file_path
+_file_paths = TTLCache(maxsize=int(os.getenv("FILE_PATH_CACHE_SIZE", 10000)), ttl=FILE_PATH_TTL)
+
+
 async def get_telegram_photo_url(bot: Bot, file_id: str) -> str:
-    file = await bot.get_file(file_id)
-    token = os.getenv("BOT_TOKEN")
-    return f"https://api.telegram.org/file/bot{token}/{file.file_path}"
+    file_path = _file_paths.get(file_id)
+    if file_path is None:
+        file = await bot.get_file(file_id)
+        file_path = file.file_path
+        _file_paths.set(file_id, file_path)
+    return bot.session.api.file_url(bot.token, file_path)
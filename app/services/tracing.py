@@ -0,0 +1,215 @@
+"""
+Трассировка генераций и оплат: этапы одной задачи с временем начала и
+длительностью, записываются в JSONL-файл (по строке на задачу).
+
+Самые медленные трассы:
+    python -m app.services.tracing -n 20 --kind generation
+"""
+import argparse
+import contextvars
+import glob
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Файл трасс (JSONL) и его максимальный размер до ротации в <файл>.1
+TRACE_PATH = os.getenv("TRACE_PATH", "data/traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 50 * 1024 * 1024))
+# Доля трасс, которые пишутся всегда; медленные и неудачные пишутся независимо от нее
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", 120))
+# Результаты, при которых трасса пишется только по выборке
+OK_OUTCOMES = ("ok", "done", "cached", "skipped")
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Одна задача: этапы (spans) с относительным временем начала."""
+
+    def __init__(self, trace_id: str, kind: str, start: float = None, **attrs):
+        self.id = trace_id
+        self.kind = kind
+        self.start = start or time.time()
+        self.attrs = attrs
+        self.spans = []
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+
+    def add(self, name: str, start: float, end: float, **attrs):
+        span = {"name": name, "at": round(start - self.start, 3), "duration": round(end - start, 3)}
+        if attrs:
+            span["attrs"] = attrs
+        self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        started = time.time()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.add(name, started, time.time(), **attrs)
+
+    def to_dict(self, outcome: str) -> dict:
+        return {
+            "trace_id": self.id,
+            "kind": self.kind,
+            "start": round(self.start, 3),
+            "duration": round(time.time() - self.start, 3),
+            "outcome": outcome,
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+
+class Tracer:
+    """Открытые трассы процесса и запись завершенных в файл."""
+
+    def __init__(self, path: str = TRACE_PATH):
+        self.path = path
+        self.traces = {}
+        self.requests = {}
+        # Запись в файл — в отдельном потоке, чтобы не блокировать event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="traces")
+
+    def start(self, trace_id: str, kind: str, start: float = None, **attrs) -> Trace:
+        trace = self.traces.get(trace_id)
+        if trace is None:
+            trace = self.traces[trace_id] = Trace(trace_id, kind, start, **attrs)
+        return trace
+
+    def get(self, trace_id: str):
+        return self.traces.get(trace_id)
+
+    def bind(self, request_id: str, trace_id: str):
+        """Связывает requestId провайдера с трассой: опросы статуса идут из другой задачи."""
+        if request_id and trace_id in self.traces:
+            self.requests[request_id] = trace_id
+
+    def for_request(self, request_id: str):
+        return self.traces.get(self.requests.get(request_id))
+
+    def finish(self, trace_id: str, outcome: str = "ok"):
+        trace = self.traces.pop(trace_id, None)
+        if trace is None:
+            return
+        for request_id in [r for r, t in self.requests.items() if t == trace_id]:
+            del self.requests[request_id]
+        record = trace.to_dict(outcome)
+        if trace.sampled or outcome not in OK_OUTCOMES or record["duration"] >= TRACE_SLOW_SECONDS:
+            self._executor.submit(self._write, json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+    def _write(self, line: str):
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) > TRACE_MAX_BYTES:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            print(f"❌ Ошибка записи трассы: {e}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+tracer = Tracer()
+
+
+# --- ТЕКУЩАЯ ТРАССА (задача asyncio, в которой выполняется генерация или оплата) ---
+
+@contextmanager
+def active(trace: Trace):
+    """Делает трассу текущей для вложенных вызовов (span) в этой задаче."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Этап текущей трассы; без активной трассы ничего не делает."""
+    trace = _current.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+
+@contextmanager
+def request_span(request_id: str, name: str, **attrs):
+    """Этап трассы, найденной по requestId провайдера."""
+    trace = tracer.for_request(request_id)
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+
+# --- CLI ---
+
+def _load(paths: list) -> list:
+    records = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def _default_paths() -> list:
+    # В многопроцессном режиме у каждого обработчика свой файл: traces-<номер>.jsonl
+    root, ext = os.path.splitext(TRACE_PATH)
+    return sorted(set(glob.glob(f"{root}*{ext}") + glob.glob(f"{root}*{ext}.1")))
+
+
+def _print_trace(record: dict):
+    attrs = " ".join(f"{k}={v}" for k, v in record.get("attrs", {}).items() if v is not None)
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["start"]))
+    print(f"{record['duration']:>9.1f}s  {record['trace_id']}  {record['kind']}  {record['outcome']}  {started}  {attrs}")
+    for span in sorted(record.get("spans", []), key=lambda s: s["at"]):
+        extra = " ".join(f"{k}={v}" for k, v in span.get("attrs", {}).items())
+        print(f"           +{span['at']:>8.1f}s  {span['duration']:>8.2f}s  {span['name']}  {extra}".rstrip())
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Самые медленные трассы генераций и оплат")
+    parser.add_argument("-n", type=int, default=10, help="сколько трасс показать")
+    parser.add_argument("--kind", help="generation или payment")
+    parser.add_argument("--outcome", help="фильтр по результату (done, failed, error, ...)")
+    parser.add_argument("--path", action="append",
+                        help="файл трасс (можно несколько); по умолчанию все файлы процессов")
+    args = parser.parse_args(argv)
+
+    records = _load(args.path or _default_paths())
+    if args.kind:
+        records = [r for r in records if r.get("kind") == args.kind]
+    if args.outcome:
+        records = [r for r in records if r.get("outcome") == args.outcome]
+    if not records:
+        print("Трасс не найдено", file=sys.stderr)
+        return 1
+    for record in sorted(records, key=lambda r: r["duration"], reverse=True)[:args.n]:
+        _print_trace(record)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
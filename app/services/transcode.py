@@ -0,0 +1,96 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.services import metrics, tracing
+
+# Формат, в который пережимаются фото перед отправкой: "jpeg", "webp" или "off" (отправлять как есть)
+TRANSCODE_FORMAT = os.getenv("TRANSCODE_FORMAT", "jpeg").lower()
+TRANSCODE_QUALITY = int(os.getenv("TRANSCODE_QUALITY", 87))
+# Telegram все равно уменьшает фото до 2560 px по большей стороне
+TRANSCODE_MAX_SIDE = int(os.getenv("TRANSCODE_MAX_SIDE", 2560))
+# Мелкие файлы отправляются без обработки
+TRANSCODE_MIN_BYTES = int(os.getenv("TRANSCODE_MIN_BYTES", 300 * 1024))
+# Где пережимать: "thread" (Pillow отпускает GIL) или "process"
+TRANSCODE_POOL = os.getenv("TRANSCODE_POOL", "thread")
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", min(4, os.cpu_count() or 1)))
+# Дополнительно присылать исходный файл документом (без сжатия Telegram)
+SEND_ORIGINAL = os.getenv("SEND_ORIGINAL", "").lower() in ("1", "true", "yes")
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow не установлен — результаты отправляются как есть
+    Image = ImageOps = None
+
+_executor = None
+
+
+def enabled() -> bool:
+    return Image is not None and TRANSCODE_FORMAT in ("jpeg", "webp")
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        if TRANSCODE_POOL == "process":
+            _executor = ProcessPoolExecutor(max_workers=TRANSCODE_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+    return _executor
+
+
+def encode(source, fmt: str = TRANSCODE_FORMAT, quality: int = TRANSCODE_QUALITY,
+           max_side: int = TRANSCODE_MAX_SIDE) -> bytes:
+    """Уменьшает изображение до max_side и кодирует в JPEG/WebP. source — bytes или путь к файлу."""
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as original:
+        image = ImageOps.exif_transpose(original)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if fmt == "jpeg" and image.mode != "RGB":
+            if image.mode in ("RGBA", "LA", "P"):
+                # Прозрачность — на белый фон
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            else:
+                image = image.convert("RGB")
+        out = io.BytesIO()
+        if fmt == "webp":
+            image.save(out, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+async def transcode(media, model: str = None):
+    """
+    Пережимает скачанное фото (RelayedMedia) вне event loop.
+    Возвращает (bytes, расширение) или (None, None), если обработка
+    выключена, не нужна или не уменьшила файл — тогда отправляется оригинал.
+    """
+    if not enabled() or media.size < TRANSCODE_MIN_BYTES:
+        return None, None
+    with tracing.span("transcode", format=TRANSCODE_FORMAT, bytes_in=media.size) as span, \
+            metrics.transcode_seconds.time(format=TRANSCODE_FORMAT):
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(_pool(), encode, media.content())
+        except Exception as e:
+            print(f"⚠️ Не удалось пережать результат ({model}): {e}")
+            metrics.failures.inc(kind="transcode")
+            return None, None
+        span["bytes_out"] = len(data)
+    metrics.transcode_bytes.inc(media.size, direction="in")
+    if len(data) >= media.size:
+        metrics.transcode_bytes.inc(media.size, direction="out")
+        return None, None
+    metrics.transcode_bytes.inc(len(data), direction="out")
+    return data, "jpg" if TRANSCODE_FORMAT == "jpeg" else "webp"
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
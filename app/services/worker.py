@@ -0,0 +1,405 @@
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+
+from aiogram.exceptions import TelegramBadRequest, TelegramEntityTooLarge, TelegramNetworkError
+from aiogram.types import BufferedInputFile
+
+from app.bot import bot
+from app.keyboards.reply import main_kb
+from app.services import metrics, tracing, transcode
+from app.services.cache import TTLCache
+from app.services.checkpoint import store, QUEUED, SUBMITTED, CHARGED
+from app.services.events import event_log
+from app.services.generation import submit, wait_result_url, download, charge, cost_for
+from app.services.health import health
+from app.services.jobs import Job, JobQueue
+from app.services.telegram_file import get_telegram_photo_url
+import database as db
+
+# Сколько секунд при остановке ждать генерации, которые уже выполняются.
+# Бюджет остановки: UPDATE_DRAIN_TIMEOUT + JOB_DRAIN_TIMEOUT + EVENTS_CLOSE_TIMEOUT (3 + 12 + 5)
+# укладывается в WORKER_STOP_TIMEOUT (25), а он — в kill_timeout (30 с в fly.toml)
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", 12))
+
+# Доставка результата: "url" — Telegram сам скачивает файл по ссылке провайдера
+# (при отказе — скачивание и загрузка через бота), "relay" — всегда через бота
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "url")
+
+# Кэш готовых результатов: ключ запроса -> file_id уже отправленного в Telegram файла
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 5000))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 24 * 3600))
+result_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+# Генерации в работе: ключ запроса -> future с file_id (одинаковые запросы ждут одну генерацию)
+_inflight = {}
+_background = set()
+
+
+async def _fail(job: Job, text: str):
+    try:
+        await bot.send_message(job.chat_id, text, reply_markup=main_kb())
+    except Exception:
+        pass
+
+
+async def run_job(job: Job):
+    """
+    Выполняет одну генерацию из очереди и отправляет результат пользователю.
+    Каждый шаг отмечается в журнале, поэтому после перезапуска задача
+    продолжается с того же места: без повторного запуска у провайдера и без
+    повторного списания.
+    """
+    media = None
+    result_url = None
+    submitted = None
+    probe = None
+    file_id = None
+    delivered = False
+    interrupted = False
+    outcome = "error"
+    trace = _trace(job)
+    if not trace.spans:
+        trace.add("queued", trace.start, time.time())
+    with tracing.active(trace):
+        try:
+            if not job.request_id:
+                # Модель со сбоями: замена на равноценную или быстрый отказ вместо долгого ожидания
+                target = health.route(job.model)
+                # Метка пробы полуоткрытого автомата, если эта генерация ее заняла
+                probe = health.get(target).probe_at if target else None
+                if target is None:
+                    await _fail(job, "⚠️ Эта модель сейчас недоступна. Попробуйте позже или выберите другую.")
+                    await store.delete(job)
+                    outcome = "unavailable"
+                    return
+                if target != job.model:
+                    await _reroute(job, target)
+
+                with tracing.span("file_resolve"):
+                    photo_url = await get_telegram_photo_url(bot, job.photo_id)
+                with tracing.span("submit", model=job.target_model) as span:
+                    job.request_id = await submit(photo_url, job.prompt, job.target_model, job.duration)
+                    span["request_id"] = job.request_id
+                if job.request_id:
+                    submitted = time.monotonic()
+                    await store.save(job, SUBMITTED)
+                else:
+                    health.record(job.target_model, ok=False)
+
+            if job.request_id:
+                tracing.tracer.bind(job.request_id, job.id)
+                result_url = await wait_result_url(job.request_id, job.target_model, job.duration)
+                # Для возобновленной после перезапуска задачи время генерации неизвестно
+                health.record(job.target_model, ok=bool(result_url),
+                              duration=time.monotonic() - submitted if submitted else None)
+                if result_url and DELIVERY_MODE == "relay":
+                    media, ext = await download(result_url, job.target_model, job.duration)
+
+            if not (media if DELIVERY_MODE == "relay" else result_url):
+                if job.is_video:
+                    await _fail(job, "⚠️ Не удалось дождаться генерации видео. Попробуйте позже.")
+                else:
+                    await _fail(job, "❌ Ошибка нейросети. Попробуйте другой запрос или модель.")
+                await store.delete(job)
+                outcome = "failed"
+                return
+
+            with tracing.span("charge"):
+                if job.charged:
+                    new_balance = await db.get_balance(job.user_id)
+                else:
+                    new_balance = await charge(job.user_id, job.cost)
+                    job.charged = True
+                    await store.save(job, CHARGED)
+
+            sent = None
+            if media is None:
+                sent = await _send_by_url(job, result_url, job.cost, new_balance)
+                if sent is None:
+                    # Telegram не смог забрать файл по ссылке — скачиваем сами
+                    media, ext = await download(result_url, job.target_model, job.duration)
+                    if not media:
+                        raise RuntimeError("не удалось скачать результат для повторной отправки")
+
+            if sent is None:
+                # Фото пережимается под лимиты Telegram: меньше байт на загрузку
+                encoded, encoded_ext = (None, None) if job.is_video else await transcode.transcode(media, job.target_model)
+                if encoded:
+                    file = BufferedInputFile(encoded, filename=f"res.{encoded_ext}")
+                else:
+                    file = media.input_file(f"video_{job.user_id}.mp4" if job.is_video else f"res.{ext or 'png'}")
+                with _delivery("relay", bytes=len(encoded) if encoded else media.size) as span:
+                    sent = await _send_result(job, file, job.cost, new_balance)
+                    span["outcome"] = "ok"
+                if encoded and transcode.SEND_ORIGINAL:
+                    await _send_original(job, media, ext)
+            delivered = True
+            file_id = _sent_file_id(sent)
+            if file_id and job.cache_key:
+                result_cache.set(job.cache_key, {"file_id": file_id, "user_id": job.user_id})
+            await store.delete(job)
+            outcome = "done"
+        except asyncio.CancelledError:
+            # Остановка процесса: запись в журнале остается, задача продолжится после старта
+            interrupted = True
+            raise
+        except Exception as e:
+            print(f"❌ Error in job {job.id} ({job.model}): {e}")
+            if delivered:
+                pass
+            elif job.charged:
+                # Списано, но результат до пользователя не дошел — возвращаем
+                refunded = await _refund(job)
+                await _fail(job, "❌ Не удалось отправить результат."
+                                 + (" Списанные ⚡ возвращены на баланс." if refunded else ""))
+            elif job.is_video:
+                await _fail(job, "❌ Ошибка при создании видео.")
+            else:
+                await _fail(job, "❌ Произошла ошибка системы. Ваш баланс не был списан.")
+            await store.delete(job)
+        finally:
+            if media:
+                media.close()
+            if probe is not None:
+                # Исход уже записан (тогда это no-op) или генерация прервалась до него
+                health.get(job.target_model).release(probe)
+            if not interrupted:
+                _release_inflight(job, file_id)
+                await _delete_status(job)
+                _observe(job, outcome)
+
+
+async def _reroute(job: Job, target: str):
+    """Переводит задачу на модель-замену; списывается не больше цены замены."""
+    print(f"🔀 Задача {job.id}: {job.model} недоступна или медленная, запускаю на {target}")
+    # Ключ кэша меняется вместе с моделью: ждущие такой же запрос к исходной модели запустят свою генерацию
+    _release_inflight(job, None)
+    job.routed_model = target
+    job.cost = min(job.cost, cost_for(target))
+    _trace(job).attrs["routed_model"] = target
+    try:
+        await bot.send_message(job.chat_id, "ℹ️ Выбранная модель сейчас перегружена — запрос выполнит "
+                                            "аналогичная модель, чтобы не заставлять вас ждать.")
+    except Exception:
+        pass
+
+
+async def _refund(job: Job) -> bool:
+    """Возвращает стоимость задачи, списанную до доставки результата."""
+    try:
+        await db.add_balance(job.user_id, job.cost)
+    except Exception as e:
+        print(f"❌ Не удалось вернуть {job.cost} ⚡ пользователю {job.user_id} (задача {job.id}): {e}")
+        metrics.failures.inc(kind="refund")
+        return False
+    job.charged = False
+    return True
+
+
+def _trace(job: Job):
+    return tracing.tracer.start(job.id, "generation", start=job.created, model=job.model,
+                                user_id=job.user_id, duration=job.duration)
+
+
+def _observe(job: Job, outcome: str):
+    """Время от запроса пользователя до доставки результата (для /metrics, трассы и журнала событий)."""
+    elapsed = time.time() - job.created
+    metrics.generation_seconds.observe(elapsed, model=job.model, outcome=outcome)
+    event_log.generation(job, outcome, elapsed)
+    if outcome in ("failed", "error"):
+        metrics.failures.inc(kind=f"generation_{outcome}")
+    tracing.tracer.finish(job.id, outcome)
+
+
+async def _send_result(job: Job, file, cost: int, new_balance: int):
+    """Отправляет результат: загружаемый файл или file_id уже отправленного ранее."""
+    if job.is_video:
+        return await bot.send_video(
+            chat_id=job.chat_id,
+            video=file,
+            caption=(
+                f"✅ **Ваше видео готово!**\n\n"
+                f"💰 Списано: `{cost}` ⚡\n"
+                f"🔋 Баланс: `{new_balance}` ⚡"
+            ),
+            reply_markup=main_kb(),
+            parse_mode="Markdown"
+        )
+    return await bot.send_photo(
+        chat_id=job.chat_id,
+        photo=file,
+        caption=(
+            f"✨ **Ваше фото готово!**\n\n"
+            f"💰 Списано: `{cost}` ⚡\n"
+            f"🔋 Баланс: `{new_balance}` ⚡"
+        ),
+        reply_markup=main_kb(),
+        parse_mode="Markdown"
+    )
+
+
+@contextmanager
+def _delivery(mode: str, **attrs):
+    """Этап upload в трассе и delivery_seconds в /metrics; вызывающий отмечает span["outcome"]."""
+    started = time.perf_counter()
+    with tracing.span("upload", mode=mode, **attrs) as span:
+        try:
+            yield span
+        finally:
+            metrics.delivery_seconds.observe(time.perf_counter() - started, mode=mode,
+                                             outcome=span.get("outcome", "error"))
+
+
+async def _send_by_url(job: Job, url: str, cost: int, new_balance: int):
+    """
+    Отправка ссылкой на файл провайдера: Telegram скачивает его сам, без трафика через бота.
+    Возвращает None, если Telegram отказался (размер, тип файла, ссылка устарела)
+    или не ответил — тогда файл отправляется через бота.
+    """
+    with _delivery("url") as span:
+        try:
+            sent = await _send_result(job, url, cost, new_balance)
+            span["outcome"] = "ok"
+            return sent
+        except (TelegramBadRequest, TelegramEntityTooLarge) as e:
+            span["outcome"] = "rejected"
+            span["reason"] = e.message[:200]
+        except (TelegramNetworkError, asyncio.TimeoutError) as e:
+            span["outcome"] = "network_error"
+            span["reason"] = str(e)[:200] or type(e).__name__
+    print(f"ℹ️ Telegram не принял ссылку для задачи {job.id} ({span['reason']}), отправляю файлом")
+    return None
+
+
+async def _send_original(job: Job, media, ext: str):
+    """Исходный файл без сжатия — документом, после основного фото."""
+    try:
+        with tracing.span("upload_original", bytes=media.size):
+            await bot.send_document(job.chat_id, media.input_file(f"original.{ext or 'png'}"),
+                                    caption="📎 Оригинал без сжатия")
+    except Exception as e:
+        print(f"⚠️ Не удалось отправить оригинал для задачи {job.id}: {e}")
+
+
+def _sent_file_id(message):
+    if message is None:
+        return None
+    if message.video:
+        return message.video.file_id
+    if message.photo:
+        return message.photo[-1].file_id
+    return None
+
+
+async def deliver_cached(job: Job, cached: dict):
+    """
+    Повторная отправка готового результата по file_id — без провайдера и без загрузки.
+    Повтор того же запроса тем же пользователем (двойное нажатие) не списывается.
+    """
+    outcome = "error"
+    try:
+        if cached["user_id"] == job.user_id:
+            cost, new_balance = 0, await db.get_balance(job.user_id)
+        else:
+            cost, new_balance = job.cost, await charge(job.user_id, job.cost)
+        job.cost, job.charged = cost, bool(cost)
+        with tracing.active(_trace(job)), tracing.span("upload", cached=True):
+            await _send_result(job, cached["file_id"], cost, new_balance)
+        print(f"♻️ Результат из кэша для задачи {job.id} ({job.model})")
+        outcome = "cached"
+    except Exception as e:
+        print(f"❌ Error in cached job {job.id} ({job.model}): {e}")
+        refunded = job.charged and await _refund(job)
+        await _fail(job, "❌ Произошла ошибка системы. Попробуйте еще раз."
+                         + (" Списанные ⚡ возвращены на баланс." if refunded else ""))
+    finally:
+        await store.delete(job)
+        await _delete_status(job)
+        _observe(job, outcome)
+
+
+async def _follow(job: Job, leader: asyncio.Future):
+    """Ждет такую же генерацию, уже запущенную другим запросом, и отправляет ее результат."""
+    file_id = await asyncio.shield(leader)
+    cached = result_cache.get(job.cache_key) if file_id else None
+    if cached:
+        await deliver_cached(job, cached)
+    else:
+        # Первая генерация не удалась — запускаем свою
+        _start(job)
+
+
+def _release_inflight(job: Job, file_id):
+    future = _inflight.get(job.cache_key) if job.cache_key else None
+    if future is not None and getattr(future, "job_id", None) == job.id:
+        del _inflight[job.cache_key]
+        if not future.done():
+            future.set_result(file_id)
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _start(job: Job) -> int:
+    """Отдает задачу в очередь, кэш или к уже идущей такой же генерации. Возвращает позицию."""
+    key = job.cache_key
+    # Уже запущенная у провайдера или оплаченная задача доводится до конца сама:
+    # иначе ее генерация потерялась бы, а списание прошло бы второй раз
+    started = bool(job.request_id) or job.charged
+    if key and not started:
+        cached = result_cache.get(key)
+        if cached:
+            _spawn(deliver_cached(job, cached))
+            return 0
+        if key in _inflight:
+            _spawn(_follow(job, _inflight[key]))
+            return 0
+    if key and key not in _inflight:
+        future = asyncio.get_running_loop().create_future()
+        future.job_id = job.id
+        _inflight[key] = future
+    return job_queue.submit(job)
+
+
+async def _delete_status(job: Job):
+    if job.status_message_id:
+        try:
+            await bot.delete_message(job.chat_id, job.status_message_id)
+        except Exception:
+            pass
+
+
+# Общая очередь генераций процесса
+job_queue = JobQueue(run_job)
+metrics.jobs_running.set_function(lambda: job_queue.active)
+metrics.jobs_queued.set_function(lambda: len(job_queue.pending))
+
+
+async def enqueue(job: Job) -> int:
+    """Записывает задачу в журнал и ставит в очередь. Возвращает позицию в очереди."""
+    await store.save(job, QUEUED)
+    _trace(job)
+    return _start(job)
+
+
+async def resume_jobs():
+    """Возвращает в работу генерации, прерванные остановкой процесса."""
+    jobs = await store.unfinished()
+    for _, job in jobs:
+        _start(job)
+    if jobs:
+        print(f"♻️ Восстановлено незавершенных генераций: {len(jobs)}")
+
+
+async def shutdown():
+    await job_queue.stop(grace=JOB_DRAIN_TIMEOUT)
+    for task in list(_background):
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    store.close()
+    transcode.shutdown()
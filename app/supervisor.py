@@ -0,0 +1,417 @@
+import asyncio
+import hmac
+import itertools
+import os
+import signal
+import sys
+from urllib.parse import parse_qs
+
+import aiohttp
+from aiogram.methods import TelegramMethod
+from aiohttp import web
+
+from app.services import metrics
+from app.services.health import health
+import database as db
+
+# Сколько процессов-обработчиков запускать (1 — обычный режим одним процессом)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+# Номер процесса-обработчика; задается супервизором, вручную не нужен
+WORKER_INDEX = os.getenv("BOT_WORKER_INDEX")
+# Обработчики слушают только localhost: порт WORKER_BASE_PORT + номер
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 9000))
+WORKER_UPDATE_PATH = "/internal/update"
+# Сброс кэша пользователя в процессе, который его обслуживает
+WORKER_INVALIDATE_PATH = "/internal/invalidate"
+# Состояние автоматов моделей процесса (сводка /health по всем процессам)
+WORKER_HEALTH_PATH = "/internal/health"
+# Сколько ждать остановки обработчиков (меньше kill_timeout в fly.toml, иначе их убьет платформа)
+# и через сколько перезапускать упавший
+WORKER_STOP_TIMEOUT = float(os.getenv("WORKER_STOP_TIMEOUT", 25))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 2))
+# Сколько при остановке ждать обработки уже принятых обновлений
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", 3))
+# Очередь обновлений на один обработчик и попытки доставки (обработчик мог перезапускаться)
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 10000))
+FORWARD_ATTEMPTS = int(os.getenv("FORWARD_ATTEMPTS", 30))
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def is_worker() -> bool:
+    return WORKER_INDEX is not None
+
+
+def is_primary() -> bool:
+    """Процесс, который выполняет общие фоновые задачи (сверка счетчиков и т.п.)."""
+    return WORKER_INDEX in (None, "0")
+
+
+async def wait_for_stop():
+    """Ждет SIGTERM/SIGINT."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+def owner_of(user_id: int, workers: int = BOT_WORKERS) -> int:
+    """Номер обработчика, который получает обновления пользователя (как в shard_of)."""
+    return user_id % workers
+
+
+# Сессия для служебных запросов к другим обработчикам (создается при первом запросе)
+_session: aiohttp.ClientSession | None = None
+
+
+async def close_session():
+    """Закрывает сессию служебных запросов (вызывается при остановке обработчика)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def _client() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+    return _session
+
+
+async def invalidate_user(user_id: int):
+    """
+    Баланс пользователя изменен не в его процессе (реферальный бонус, заказ,
+    зачисленный другим процессом): сбрасываем кэш в процессе-владельце,
+    иначе там до USER_CACHE_TTL виден старый баланс.
+    """
+    if not is_worker() or owner_of(user_id) == int(WORKER_INDEX):
+        return
+    url = f"http://127.0.0.1:{WORKER_BASE_PORT + owner_of(user_id)}{WORKER_INVALIDATE_PATH}"
+    try:
+        async with _client().post(url, json={"user_id": user_id}) as resp:
+            resp.raise_for_status()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"⚠️ Не удалось сбросить кэш пользователя {user_id} в обработчике {owner_of(user_id)}: {e}")
+
+
+async def handle_invalidate(request):
+    data = await request.json()
+    db.user_cache.pop(int(data["user_id"]))
+    return web.Response(text="OK")
+
+
+async def ask_workers(path: str, payload: dict = None) -> dict:
+    """
+    Служебный запрос ко всем обработчикам (POST, если есть payload, иначе GET).
+    Возвращает {номер: ответ JSON}; недоступные обработчики пропускаются.
+    """
+    async def ask(index: int):
+        url = f"http://127.0.0.1:{WORKER_BASE_PORT + index}{path}"
+        try:
+            async with _client().request("POST" if payload is not None else "GET", url, json=payload) as resp:
+                resp.raise_for_status()
+                return index, await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return index, None
+
+    if not is_worker():
+        return {}
+    answers = await asyncio.gather(*(ask(index) for index in range(BOT_WORKERS)))
+    return {index: answer for index, answer in answers if answer is not None}
+
+
+async def handle_health(request):
+    """Состояния автоматов этого процесса; POST {"reset": модель} сначала сбрасывает автомат."""
+    if request.method == "POST":
+        data = await request.json()
+        health.get(data["reset"]).reset()
+    return web.json_response(health.snapshot())
+
+
+def user_of(update: dict):
+    """id пользователя (или чата), к которому относится обновление; None, если его нет."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        for field in ("from", "user", "chat"):
+            owner = value.get(field)
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+    return None
+
+
+def shard_of(update: dict, workers: int = BOT_WORKERS) -> int:
+    """Номер обработчика для обновления: по id пользователя, чтобы все его события шли в один процесс."""
+    user_id = user_of(update)
+    return (update.get("update_id", 0) if user_id is None else user_id) % workers
+
+
+class OrderedUpdateHandler:
+    """
+    Прием обновлений Telegram по HTTP: ответ отдается сразу, обновления разных
+    пользователей обрабатываются параллельно, а одного пользователя — строго
+    по очереди (иначе, например, фото может обогнать выбор модели).
+    """
+
+    def __init__(self, dispatcher, bot, secret_token: str = None):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        # user_id -> последняя задача пользователя; следующая ждет ее завершения
+        self._tails = {}
+        self._tasks = set()
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+
+    async def handle(self, request):
+        if self.secret_token is not None:
+            token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, self.secret_token):
+                return web.Response(text="Unauthorized", status=401)
+        update = await request.json()
+        user_id = user_of(update)
+        task = asyncio.create_task(self._feed(update, self._tails.get(user_id)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if user_id is not None:
+            self._tails[user_id] = task
+            task.add_done_callback(lambda done: self._release(user_id, done))
+        return web.Response(text="OK")
+
+    async def close(self, timeout: float):
+        """Дает начатым обновлениям завершиться, остальные отменяет."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _release(self, user_id: int, task: asyncio.Task):
+        if self._tails.get(user_id) is task:
+            del self._tails[user_id]
+
+    async def _feed(self, update: dict, previous: asyncio.Task = None):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            result = await self.dispatcher.feed_raw_update(self.bot, update)
+        except Exception:
+            # aiogram уже записал ошибку в лог; очередь пользователя продолжает работу
+            return
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=self.bot, result=result)
+
+
+class Worker:
+    """Процесс-обработчик: свой event loop, свой порт и своя очередь обновлений."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.port = WORKER_BASE_PORT + index
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.queue = asyncio.Queue(maxsize=WORKER_QUEUE_SIZE)
+        self.process = None
+
+    def _env(self) -> dict:
+        env = dict(os.environ)
+        env["BOT_WORKER_INDEX"] = str(self.index)
+        env["PORT"] = str(self.port)
+        # Журнал генераций у каждого процесса свой: после перезапуска он продолжит только свои задачи
+        root, ext = os.path.splitext(os.getenv("JOBS_DB_PATH", "data/jobs.db"))
+        env["JOBS_DB_PATH"] = f"{root}-{self.index}{ext}"
+        root, ext = os.path.splitext(os.getenv("TRACE_PATH", "data/traces.jsonl"))
+        env["TRACE_PATH"] = f"{root}-{self.index}{ext}"
+        # Спул журнала событий тоже свой: иначе процессы отправляют и удаляют чужие записи
+        root, ext = os.path.splitext(os.getenv("EVENTS_SPOOL_PATH", "data/events.db"))
+        env["EVENTS_SPOOL_PATH"] = f"{root}-{self.index}{ext}"
+        return env
+
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(sys.executable, MAIN_SCRIPT, env=self._env())
+        print(f"🧩 Обработчик {self.index} запущен (pid {self.process.pid}, порт {self.port})")
+
+    async def stop(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=WORKER_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+class Supervisor:
+    """
+    Принимает все входящие запросы (обновления Telegram, Prodamus, Polza)
+    и раскладывает их по процессам-обработчикам. Обновления одного
+    пользователя всегда уходят в один процесс и по порядку.
+    """
+
+    def __init__(self, workers: int = BOT_WORKERS):
+        self.workers = [Worker(index) for index in range(workers)]
+        self.session = None
+        self._round_robin = itertools.cycle(self.workers)
+        self.secret = ""
+        self._stopping = False
+        self._tasks = []
+
+    # --- ПРОЦЕССЫ ---
+
+    async def _watch(self, worker: Worker):
+        """Перезапускает обработчик, если он завершился сам."""
+        while not self._stopping:
+            await worker.start()
+            code = await worker.process.wait()
+            if self._stopping:
+                return
+            print(f"⚠️ Обработчик {worker.index} завершился с кодом {code}, перезапуск")
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+
+    # --- ОБНОВЛЕНИЯ TELEGRAM ---
+
+    def dispatch(self, update: dict):
+        worker = self.workers[shard_of(update, len(self.workers))]
+        try:
+            worker.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            print(f"⚠️ Очередь обработчика {worker.index} переполнена, обновление {update.get('update_id')} пропущено")
+
+    async def _forward(self, worker: Worker):
+        """Передает обновления в обработчик строго по одному — порядок событий сохраняется."""
+        while True:
+            update = await worker.queue.get()
+            for attempt in range(FORWARD_ATTEMPTS):
+                try:
+                    async with self.session.post(f"{worker.url}{WORKER_UPDATE_PATH}", json=update) as resp:
+                        if resp.status < 500:
+                            break
+                except aiohttp.ClientError:
+                    pass
+                # Обработчик еще стартует или перезапускается
+                await asyncio.sleep(min(1 + attempt, 5))
+            else:
+                print(f"❌ Обновление {update.get('update_id')} не доставлено обработчику {worker.index}")
+
+    async def telegram_webhook(self, request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not self.secret or not hmac.compare_digest(token, self.secret):
+            return web.Response(text="Unauthorized", status=401)
+        self.dispatch(await request.json())
+        return web.Response(text="OK")
+
+    async def poll(self, bot, allowed_updates: list):
+        """Long polling в одном процессе; разбор и обработка — в обработчиках."""
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.dispatch(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+
+    # --- HTTP-МАРШРУТЫ ---
+
+    async def _proxy(self, request, workers: list):
+        body = await request.read()
+        headers = {"Content-Type": request.headers.get("Content-Type", "application/octet-stream")}
+        if "Sign" in request.headers:
+            # Подпись Продамуса проверяет обработчик
+            headers["Sign"] = request.headers["Sign"]
+        status, text = 502, "Bad gateway"
+        for worker in workers:
+            try:
+                async with self.session.post(f"{worker.url}{request.path_qs}", data=body, headers=headers) as resp:
+                    status, text = resp.status, await resp.text()
+                if status < 500:
+                    break
+            except aiohttp.ClientError as e:
+                print(f"⚠️ Обработчик {worker.index} недоступен: {e}")
+        return web.Response(text=text, status=status)
+
+    async def prodamus(self, request):
+        # Уведомление об оплате идет в процесс покупателя (order_num = <user_id>_<amount>_...)
+        body = await request.read()
+        fields = parse_qs(body.decode(errors="ignore"))
+        order = (fields.get("order_num") or [""])[0]
+        user_id = order.split("_")[0]
+        if user_id.isdigit():
+            first = self.workers[int(user_id) % len(self.workers)]
+        else:
+            first = next(self._round_robin)
+        return await self._proxy(request, [first] + [w for w in self.workers if w is not first])
+
+    async def polza(self, request):
+        # Колбэк адресован процессу, который запустил генерацию (см. network._callback_url)
+        index = request.query.get("worker", "")
+        if index.isdigit() and int(index) < len(self.workers):
+            return await self._proxy(request, [self.workers[int(index)]])
+        return await self._proxy(request, [next(self._round_robin)])
+
+    async def _scrape(self, worker: Worker) -> str:
+        try:
+            async with self.session.get(f"{worker.url}/metrics", params={"token": metrics.METRICS_TOKEN},
+                                        timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                return await resp.text() if resp.status == 200 else ""
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return ""
+
+    async def metrics(self, request):
+        """Метрики всех обработчиков с меткой worker."""
+        if not metrics.authorized(request):
+            return web.Response(text="Forbidden", status=403)
+        texts = await asyncio.gather(*(self._scrape(worker) for worker in self.workers))
+        return metrics.response(metrics.merge({w.index: text for w, text in zip(self.workers, texts)}))
+
+    # --- ЗАПУСК ---
+
+    async def run(self, bot, dp, settings, webhook_path: str):
+        self.secret = settings.webhook_secret
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+        self._tasks = [asyncio.create_task(self._watch(worker)) for worker in self.workers]
+        self._tasks += [asyncio.create_task(self._forward(worker)) for worker in self.workers]
+
+        app = web.Application()
+        app.router.add_post("/payments/prodamus", self.prodamus)
+        app.router.add_post("/polza/callback", self.polza)
+        app.router.add_post(webhook_path, self.telegram_webhook)
+        app.router.add_get("/metrics", self.metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = int(os.getenv("PORT", 8080))
+        await web.TCPSite(runner, "0.0.0.0", port).start()
+        print(f"✅ Супервизор: {len(self.workers)} обработчиков, порт {port}")
+
+        allowed_updates = dp.resolve_used_update_types()
+        try:
+            if settings.bot_mode == "webhook":
+                await bot.set_webhook(
+                    f"{settings.public_url}{webhook_path}",
+                    secret_token=settings.webhook_secret,
+                    allowed_updates=allowed_updates,
+                )
+                await wait_for_stop()
+            else:
+                polling = asyncio.create_task(self.poll(bot, allowed_updates))
+                await wait_for_stop()
+                polling.cancel()
+        finally:
+            self._stopping = True
+            await runner.cleanup()
+            # Обработчики сами доделывают текущие генерации (см. JOB_DRAIN_TIMEOUT)
+            await asyncio.gather(*(worker.stop() for worker in self.workers))
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self.session.close()
+            await bot.session.close()
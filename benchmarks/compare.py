@@ -0,0 +1,55 @@
+"""
+Сравнение двух файлов результатов бенчмарков:
+
+    python -m benchmarks.compare старый.json новый.json [--threshold 10]
+"""
+import argparse
+import json
+import sys
+
+# Метрики, рост которых — ухудшение; для остальных числовых (throughput, mb_per_s) ухудшение — падение
+LOWER_IS_BETTER = ("_ms", "seconds", "peak_python_mb", "status_requests", "overshoot", "errors")
+
+
+def _flatten(data, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарков")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="порог регрессии, %%")
+    args = parser.parse_args(argv)
+
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    before, after = _flatten(old["results"]), _flatten(new["results"])
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for path in sorted(set(before) & set(after)):
+        a, b = before[path], after[path]
+        if a == b:
+            continue
+        change = (b - a) / abs(a) * 100 if a else float("inf")
+        worse = change > 0 if any(marker in path for marker in LOWER_IS_BETTER) else change < 0
+        mark = ""
+        if worse and abs(change) >= args.threshold:
+            mark = "  ⚠️ регрессия"
+            regressions += 1
+        print(f"{path:<70} {a:>12g} {b:>12g} {change:>+9.1f}%{mark}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,27 @@
+"""
+Окружение для бенчмарков. Настройки читаются модулями бота при импорте,
+поэтому этот модуль импортируется первым. Значения из .env (боевые токены,
+прокси, PUBLIC_URL) бенчмаркам не нужны.
+"""
+import os
+import tempfile
+
+TMP = tempfile.mkdtemp(prefix="bench-")
+
+os.environ.update({
+    "BOT_TOKEN": "123456:bench-token",
+    "POLZA_API_KEY": "bench",
+    "PUBLIC_URL": "",
+    "PROXY_URL": "",
+    "PRODAMUS_SECRET_KEY": "bench",
+    "DB_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(TMP, "bench.db"),
+    "JOBS_DB_PATH": os.path.join(TMP, "jobs.db"),
+    "EVENTS_SPOOL_PATH": os.path.join(TMP, "events.db"),
+    "FSM_DB_PATH": os.path.join(TMP, "fsm.db"),
+    "TRACE_PATH": os.path.join(TMP, "traces.jsonl"),
+    "RELAY_TMP_DIR": TMP,
+})
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
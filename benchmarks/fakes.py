@@ -0,0 +1,376 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарков: Polza API, Telegram Bot API
+и Supabase REST (PostgREST). Каждая — aiohttp-приложение в том же процессе
+с настраиваемой задержкой ответа и долей отказов.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+
+class FakeServer:
+    """Общая часть заглушек: запуск на свободном порту, задержка, отказы, счетчики запросов."""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = Counter()
+        self.app = web.Application(middlewares=[self._middleware], client_max_size=1024 ** 3)
+        self.runner = None
+        self.url = None
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests[self.route_name(request)] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            return web.json_response({"error": "injected failure"}, status=503)
+        return await handler(request)
+
+    def route_name(self, request) -> str:
+        return request.method + " " + (request.match_info.route.resource.canonical
+                                       if request.match_info.route.resource else request.path)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+# --- POLZA ---
+
+class FakePolza(FakeServer):
+    """
+    Генерация готова через image_seconds / video_seconds после запуска,
+    результат — файл размером result_size байт (или image — настоящая картинка для фото).
+    """
+
+    def __init__(self, image_seconds: float = 5, video_seconds: float = 15, result_size: int = 1024 * 1024,
+                 image: bytes = None, **kwargs):
+        super().__init__(**kwargs)
+        self.image = image
+        self.image_seconds = image_seconds
+        self.video_seconds = video_seconds
+        self.result_size = result_size
+        self.tasks = {}
+        self._ids = itertools.count(1)
+        self.app.router.add_post("/{kind}/generations", self.submit)
+        self.app.router.add_get("/files/{request_id}", self.download)
+        self.app.router.add_get("/{kind}/{request_id}", self.status)
+
+    async def submit(self, request):
+        kind = request.match_info["kind"]
+        await request.json()
+        request_id = f"{kind[:3]}-{next(self._ids)}"
+        duration = self.video_seconds if kind == "videos" else self.image_seconds
+        self.tasks[request_id] = time.monotonic() + duration
+        return web.json_response({"requestId": request_id})
+
+    async def status(self, request):
+        kind, request_id = request.match_info["kind"], request.match_info["request_id"]
+        ready_at = self.tasks.get(request_id)
+        if ready_at is None:
+            return web.json_response({"status": "error"})
+        if time.monotonic() < ready_at:
+            return web.json_response({"status": "pending"})
+        url = f"{self.url}/files/{request_id}"
+        if kind == "videos":
+            return web.json_response({"status": "COMPLETED", "videoUrl": url})
+        return web.json_response({"status": "COMPLETED", "url": url})
+
+    async def download(self, request):
+        video = request.match_info["request_id"].startswith("vid")
+        if self.image and not video:
+            return web.Response(body=self.image, content_type="image/png")
+        response = web.StreamResponse(headers={"Content-Type": "video/mp4" if video else "image/png"})
+        response.content_length = self.result_size
+        await response.prepare(request)
+        chunk = b"\0" * (256 * 1024)
+        left = self.result_size
+        while left > 0:
+            await response.write(chunk[:left])
+            left -= len(chunk)
+        await response.write_eof()
+        return response
+
+    def polls(self) -> int:
+        return self.requests["GET /{kind}/{request_id}"]
+
+
+def sample_png(side: int) -> bytes:
+    """PNG side x side, похожий по сжимаемости на фото (градиенты + шум). Нужен Pillow."""
+    import io
+    from PIL import Image
+
+    size = (side, side)
+    image = Image.merge("RGB", (
+        Image.effect_mandelbrot(size, (-2, -1.5, 1, 1.5), 100),
+        Image.radial_gradient("L").resize(size),
+        Image.effect_noise(size, 40),
+    ))
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def prodamus_notification(user_id: int, amount: int, order_id: str, suffix) -> tuple:
+    """Уведомление об оплате пакета amount, подписанное как у Продамуса: (форма, заголовки)."""
+    from app.routers.payments import PACKAGES, PRODAMUS_SECRET_KEY, prodamus_signature
+
+    form = {"payment_status": "success", "order_num": f"{user_id}_{amount}_{suffix}",
+            "order_id": order_id, "sum": f"{PACKAGES[amount]}.00"}
+    return form, {"Sign": prodamus_signature(form, PRODAMUS_SECRET_KEY)}
+
+
+# --- TELEGRAM ---
+
+class FakeTelegram(FakeServer):
+    """
+    Bot API: методы, которые использует бот; загружаемые файлы читаются целиком и отбрасываются.
+    Файл, переданный ссылкой, скачивается как это делает Telegram, с его лимитами
+    (фото до 5 МБ, остальное до 20 МБ); иначе — ошибка 400.
+    """
+
+    URL_LIMITS = {"photo": 5 * 1024 * 1024, "video": 20 * 1024 * 1024, "document": 20 * 1024 * 1024}
+
+    def __init__(self, file_size: int = 200 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.file_size = file_size
+        self.uploaded = 0
+        self.fetched = 0
+        self.rejected = 0
+        self._session = None
+        self._ids = itertools.count(1)
+        self.app.router.add_post("/bot{token}/{method}", self.method)
+        self.app.router.add_get("/file/bot{token}/{path:.*}", self.file)
+
+    def route_name(self, request) -> str:
+        return request.match_info.get("method") or "file"
+
+    def _message(self, chat_id, **extra) -> dict:
+        return {"message_id": next(self._ids), "date": int(time.time()),
+                "chat": {"id": int(chat_id or 0), "type": "private"}, **extra}
+
+    async def _fetch_url(self, field: str, url: str) -> bool:
+        """Скачивает файл по ссылке; False — Telegram отклонил бы его."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        limit = self.URL_LIMITS[field]
+        try:
+            async with self._session.get(url) as resp:
+                if resp.status != 200:
+                    return False
+                if field == "photo" and not resp.content_type.startswith("image/"):
+                    return False
+                size = 0
+                async for chunk in resp.content.iter_chunked(256 * 1024):
+                    size += len(chunk)
+                    if size > limit:
+                        return False
+                self.fetched += size
+                return True
+        except aiohttp.ClientError:
+            return False
+
+    async def stop(self):
+        if self._session:
+            await self._session.close()
+        await super().stop()
+
+    async def method(self, request):
+        method = request.match_info["method"]
+        if request.content_type.startswith("multipart/"):
+            fields = {}
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    while chunk := await part.read_chunk(256 * 1024):
+                        self.uploaded += len(chunk)
+                    fields[part.name] = "<file>"
+                else:
+                    fields[part.name] = await part.text()
+        elif request.content_type == "application/json":
+            fields = await request.json()
+        else:
+            fields = dict(await request.post()) or dict(request.query)
+
+        chat_id = fields.get("chat_id")
+        for field in self.URL_LIMITS:
+            value = fields.get(field)
+            if isinstance(value, str) and value.startswith("http") and not await self._fetch_url(field, value):
+                self.rejected += 1
+                return web.json_response({"ok": False, "error_code": 400,
+                                          "description": "Bad Request: failed to get HTTP URL content"}, status=400)
+        file = {"file_id": f"file-{next(self._ids)}", "file_unique_id": f"u{next(self._ids)}"}
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "getFile":
+            result = {**file, "file_path": "photos/file.jpg", "file_size": self.file_size}
+        elif method == "sendPhoto":
+            result = self._message(chat_id, photo=[{**file, "width": 1024, "height": 1024}])
+        elif method == "sendVideo":
+            result = self._message(chat_id, video={**file, "width": 1280, "height": 720, "duration": 5})
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(chat_id, text=fields.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def file(self, request):
+        return web.Response(body=b"\0" * self.file_size, content_type="image/jpeg")
+
+
+# --- SUPABASE (PostgREST) ---
+
+def _utc_timestamp() -> str:
+    # Тот же формат, что database.utc_timestamp
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+
+
+class FakeSupabase(FakeServer):
+    """
+    Таблицы в памяти и минимальный разбор запросов PostgREST, которые делает
+    database.SupabaseBackend: select/insert/upsert/update с фильтрами eq/gte/is/not.is,
+    offset/limit и rpc increment_balance / credit_order / reconcile_counters.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.tables = {"users": [], "payment_orders": [], "payment_logs": [], "generation_logs": [],
+                       "counters": [], "referral_counts": []}
+        self.keys = {"users": "user_id", "payment_orders": "order_key", "counters": "name",
+                     "referral_counts": "referrer_id", "payment_logs": "event_id", "generation_logs": "event_id"}
+        self.app.router.add_post("/rest/v1/rpc/{function}", self.rpc)
+        self.app.router.add_route("*", "/rest/v1/{table}", self.table)
+
+    # --- фильтры ---
+
+    @staticmethod
+    def _match(row: dict, column: str, condition: str) -> bool:
+        value = row.get(column)
+        if condition == "is.null":
+            return value is None
+        if condition == "not.is.null":
+            return value is not None
+        if condition.startswith("gte."):
+            return value is not None and str(value) >= condition[4:]
+        if condition.startswith("eq."):
+            expected = condition[3:]
+            if isinstance(value, bool):
+                return str(value).lower() == expected
+            return value is not None and str(value) == expected
+        return True
+
+    def _filter(self, rows: list, query) -> list:
+        filters = [(k, v) for k, v in query.items() if k not in ("select", "offset", "limit", "on_conflict", "order")]
+        return [row for row in rows if all(self._match(row, k, v) for k, v in filters)]
+
+    @staticmethod
+    def _project(rows: list, select: str) -> list:
+        if not select or select == "*":
+            return [dict(row) for row in rows]
+        columns = [c.strip() for c in select.split(",")]
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+    # --- таблицы ---
+
+    def _user_count_changed(self):
+        self.tables["counters"] = [{"name": "users_total", "value": len(self.tables["users"])}]
+        counts = Counter(u["referrer_id"] for u in self.tables["users"] if u.get("referrer_id") is not None)
+        self.tables["referral_counts"] = [{"referrer_id": k, "referrals": v} for k, v in counts.items()]
+
+    async def table(self, request):
+        name = request.match_info["table"]
+        rows = self.tables.setdefault(name, [])
+        query = request.query
+
+        if request.method == "GET":
+            found = self._filter(rows, query)
+            offset, limit = int(query.get("offset", 0)), query.get("limit")
+            found = found[offset:offset + int(limit)] if limit else found[offset:]
+            return web.json_response(self._project(found, query.get("select")))
+
+        body = await request.json() if request.can_read_body else {}
+        prefer = request.headers.get("Prefer", "")
+
+        if request.method == "POST":
+            items = body if isinstance(body, list) else [body]
+            key = self.keys.get(name)
+            inserted = []
+            for item in items:
+                if key and any(row.get(key) == item.get(key) for row in rows):
+                    if "ignore-duplicates" in prefer:
+                        continue
+                    return web.json_response({"message": "duplicate key"}, status=409)
+                if name == "users" and item.get("referrer_id") is not None:
+                    item["referred_at"] = _utc_timestamp()  # триггер users_referred_at
+                rows.append(dict(item))
+                inserted.append(dict(item))
+            if name == "users":
+                self._user_count_changed()
+            return web.json_response(inserted, status=201)
+
+        if request.method == "PATCH":
+            updated = []
+            for row in self._filter(rows, query):
+                if name == "users" and body.get("referrer_id") not in (None, row.get("referrer_id")):
+                    row["referred_at"] = _utc_timestamp()  # триггер users_referred_at
+                row.update(body)
+                updated.append(dict(row))
+            if name == "users":
+                self._user_count_changed()
+            return web.json_response(updated)
+
+        return web.json_response({"message": "unsupported"}, status=405)
+
+    def _increment(self, user_id: int, amount: int, strict: bool):
+        users = self.tables["users"]
+        row = next((u for u in users if u["user_id"] == user_id), None)
+        if row is None:
+            row = {"user_id": user_id, "balance": 1, "referrer_id": None}
+            users.append(row)
+            self._user_count_changed()
+        new_balance = row["balance"] + amount
+        if new_balance < 0:
+            if strict:
+                return None
+            new_balance = 0
+        row["balance"] = new_balance
+        return new_balance
+
+    async def rpc(self, request):
+        function = request.match_info["function"]
+        params = await request.json() if request.can_read_body else {}
+        if function == "increment_balance":
+            new_balance = self._increment(params["p_user_id"], params["p_amount"], params.get("p_strict"))
+            return web.Response(text=json.dumps(new_balance), content_type="application/json")
+        if function == "credit_order":
+            order = next((o for o in self.tables["payment_orders"]
+                          if o["order_key"] == params["p_order_key"] and o.get("status", "pending") == "pending"), None)
+            if order is None:
+                return web.Response(text="null", content_type="application/json")
+            order["status"] = "credited"
+            order["credited_at"] = _utc_timestamp()
+            result = {key: order.get(key) for key in ("order_key", "user_id", "amount", "raw_data")}
+            result["balance"] = self._increment(order["user_id"], order["amount"], False)
+            return web.json_response(result)
+        if function == "reconcile_counters":
+            self._user_count_changed()
+            return web.Response(text="null", content_type="application/json")
+        return web.json_response({"message": f"unknown function {function}"}, status=404)
@@ -0,0 +1,372 @@
+"""
+Нагрузочный прогон всего бота: тысячи пользователей одновременно проходят
+сценарии через настоящий Dispatcher, роутеры, FSM, очередь генераций и
+конвейер оплат. Telegram, Polza и Supabase — локальные заглушки (benchmarks/fakes.py).
+
+    python -m benchmarks.load                              # ступени 100,500,1000,2000
+    python -m benchmarks.load --ramp 200,2000 --db supabase --latency 0.02
+
+Путь пользователя: /start (часть — по реферальной ссылке) → «👤 Мой баланс» →
+оплата через вебхук Prodamus → фотосессия (фото, модель, описание) →
+оживление фото (фото, длительность, описание).
+
+На каждой ступени считаются обновления в секунду, задержка обработчиков
+(p50/p99, по шагам), задержка event loop и память процесса. Результаты —
+benchmarks/results/load-<коммит>-<время>.json.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+# Задает окружение бота — до импорта его модулей
+from benchmarks.env import RESULTS_DIR, ROOT
+from benchmarks.fakes import FakePolza, FakeSupabase, FakeTelegram, prodamus_notification, sample_png
+from benchmarks.run import _commit, _percentile, _summary
+
+# Незавершенные генерации при остановке не дожидаемся
+os.environ.setdefault("JOB_DRAIN_TIMEOUT", "0")
+
+PHOTO_MODELS = ("model_nanabanana", "model_nanabanana_pro", "model_seadream")
+VIDEO_DURATIONS = ("v_dur_5", "v_dur_10")
+# Сколько генераций покупает каждый пользователь: хватает на фото и видео 10 с
+PURCHASE = 25
+
+
+def _rss_mb() -> float:
+    """Текущий RSS процесса; без /proc — пиковый из getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class Updates:
+    """Синтетические обновления Telegram в формате Bot API."""
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def _message(self, user_id: int, **extra) -> dict:
+        return {"message_id": next(self._ids), "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id), **extra}
+
+    def text(self, user_id: int, text: str) -> dict:
+        return {"update_id": next(self._ids), "message": self._message(user_id, text=text)}
+
+    def photo(self, user_id: int) -> dict:
+        # Уникальные file_unique_id: иначе одинаковые запросы отдавал бы кэш результатов
+        sizes = [{"file_id": f"photo-{user_id}-{n}-{size}", "file_unique_id": f"p{user_id}-{n}-{size}",
+                  "width": size, "height": size} for n in [next(self._ids)] for size in (90, 1280)]
+        return {"update_id": next(self._ids), "message": self._message(user_id, photo=sizes)}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        message = self._message(user_id, text="…")
+        message["from"] = {"id": 1, "is_bot": True, "first_name": "Bench"}
+        return {"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": message,
+        }}
+
+
+class Stage:
+    """Замеры одной ступени нагрузки."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = Counter()
+        self.lag = []
+        self.rss_peak = 0.0
+
+    def record(self, step: str, seconds: float):
+        self.latencies.setdefault(step, []).append(seconds)
+
+    async def monitor(self, interval: float):
+        """Задержка event loop: насколько позже запланированного просыпается sleep."""
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.lag.append(time.perf_counter() - started - interval)
+            if len(self.lag) % 25 == 0:
+                self.rss_peak = max(self.rss_peak, _rss_mb())
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.updates = Updates()
+        self.telegram = self.polza = self.supabase = None
+        self.prodamus_url = None
+        self.http = None
+        self._runner = None
+        self._users = itertools.count(1_000_000)
+
+    # --- ОКРУЖЕНИЕ ---
+
+    async def start(self):
+        import database as db
+        from aiogram.client.telegram import TelegramAPIServer
+        from app import network
+        from app.bot import bot, dp
+        from app.routers import setup_routers
+        from app.routers.payments import prodamus_webhook
+        from app.services.payments import payment_pipeline
+        from app.services import transcode
+        from app.services.referrals import referral_graph
+
+        args = self.args
+        fault = {"latency": args.latency, "jitter": args.jitter, "failure_rate": args.failure_rate}
+        self.telegram = await FakeTelegram(**fault).start()
+        # С Pillow фото-результат — настоящая картинка, чтобы нагрузка включала ее пережатие
+        image = sample_png(args.image_side) if transcode.enabled() and args.image_side else None
+        self.polza = await FakePolza(image_seconds=args.image_seconds, video_seconds=args.video_seconds,
+                                     result_size=args.result_size, image=image, **fault).start()
+        bot.session.api = TelegramAPIServer.from_base(self.telegram.url)
+        network.BASE_URL = self.polza.url
+
+        if args.db == "supabase":
+            self.supabase = await FakeSupabase(**fault).start()
+            db.url, db.key = self.supabase.url, "bench.bench.bench"
+            db._backend = db.SupabaseBackend()
+
+        setup_routers(dp)
+        await network.open_session()
+        await payment_pipeline.start()
+        await referral_graph.load()
+
+        app = web.Application()
+        app.router.add_post("/payments/prodamus", prodamus_webhook)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        self.prodamus_url = f"http://127.0.0.1:{self._runner.addresses[0][1]}/payments/prodamus"
+        self.http = ClientSession()
+        self.bot, self.dp, self.db = bot, dp, db
+
+    async def stop(self):
+        from app import network
+        from app.services import tracing, worker
+        from app.services.events import event_log
+        from app.services.payments import payment_pipeline
+
+        await worker.shutdown()
+        await payment_pipeline.stop()
+        await event_log.close()
+        await network.poller.stop()
+        await network.close_session()
+        await self.dp.storage.close()
+        await self.bot.session.close()
+        await self.http.close()
+        await self._runner.cleanup()
+        for fake in (self.telegram, self.polza, self.supabase):
+            if fake:
+                await fake.stop()
+        tracing.tracer.close()
+
+    # --- ШАГИ ПОЛЬЗОВАТЕЛЯ ---
+
+    async def _feed(self, stage: Stage, step: str, update: dict):
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            stage.errors[step] += 1
+        stage.record(step, time.perf_counter() - started)
+        if self.args.think:
+            await asyncio.sleep(random.uniform(0, self.args.think))
+
+    async def _pay(self, stage: Stage, user_id: int):
+        """Уведомление Prodamus и ожидание зачисления (его делает фоновый конвейер)."""
+        form, headers = prodamus_notification(user_id, PURCHASE, f"load-{user_id}", time.time_ns())
+        started = time.perf_counter()
+        try:
+            async with self.http.post(self.prodamus_url, data=form, headers=headers) as resp:
+                await resp.read()
+                if resp.status != 200:
+                    stage.errors["payment_webhook"] += 1
+        except Exception:
+            stage.errors["payment_webhook"] += 1
+        stage.record("payment_webhook", time.perf_counter() - started)
+
+        deadline = time.perf_counter() + self.args.credit_timeout
+        while time.perf_counter() < deadline:
+            if await self.db.get_balance(user_id) > PURCHASE:
+                stage.record("payment_credited", time.perf_counter() - started)
+                return
+            await asyncio.sleep(0.05)
+        stage.errors["payment_credited"] += 1
+
+    async def journey(self, stage: Stage, user_id: int, referrer_id: int = None):
+        u = self.updates
+        await self._feed(stage, "start", u.text(user_id, f"/start {referrer_id}" if referrer_id else "/start"))
+        await self._feed(stage, "balance", u.text(user_id, "👤 Мой баланс"))
+        await self._pay(stage, user_id)
+
+        await self._feed(stage, "photo_menu", u.text(user_id, "📸 Начать фотосессию"))
+        await self._feed(stage, "photo", u.photo(user_id))
+        await self._feed(stage, "model", u.callback(user_id, random.choice(PHOTO_MODELS)))
+        await self._feed(stage, "prompt", u.text(user_id, "добавь закат и море на фон"))
+
+        await self._feed(stage, "video_menu", u.text(user_id, "🎬 Оживить фото"))
+        await self._feed(stage, "video_photo", u.photo(user_id))
+        await self._feed(stage, "duration", u.callback(user_id, random.choice(VIDEO_DURATIONS)))
+        await self._feed(stage, "video_prompt", u.text(user_id, "девушка поворачивает голову и улыбается"))
+
+    # --- СТУПЕНИ ---
+
+    async def _arrive(self, stage: Stage, delay: float, user_id: int, referrer_id):
+        await asyncio.sleep(delay)
+        await self.journey(stage, user_id, referrer_id)
+
+    async def _drain(self) -> bool:
+        from app.services.worker import job_queue
+
+        deadline = time.perf_counter() + self.args.drain
+        while time.perf_counter() < deadline:
+            if not job_queue.pending and not job_queue.active:
+                return True
+            await asyncio.sleep(0.2)
+        return not job_queue.pending and not job_queue.active
+
+    @staticmethod
+    def _deliveries() -> dict:
+        """Доставки результатов по способу и исходу (url/relay, ok/rejected/error) из метрик."""
+        from app.services import metrics
+
+        return {f"{mode}_{outcome}": state[2] for (mode, outcome), state in metrics.delivery_seconds.values.items()}
+
+    async def stage(self, users: int) -> dict:
+        from app.services.worker import job_queue
+
+        args = self.args
+        stage = Stage()
+        ids = [next(self._users) for _ in range(users)]
+        telegram_before = sum(self.telegram.requests.values())
+        bytes_before = self.telegram.uploaded, self.telegram.fetched
+        deliveries_before = self._deliveries()
+        polza_before = sum(self.polza.requests.values())
+        rss_before = _rss_mb()
+
+        monitor = asyncio.create_task(stage.monitor(args.lag_interval))
+        started = time.perf_counter()
+        journeys = []
+        for index, user_id in enumerate(ids):
+            # Часть пользователей приходит по ссылке уже зарегистрированного
+            referrer_id = random.choice(ids[:index]) if index and random.random() < args.referral_share else None
+            delay = random.uniform(0, args.arrival) if args.arrival else 0
+            journeys.append(self._arrive(stage, delay, user_id, referrer_id))
+        await asyncio.gather(*journeys)
+        wall = time.perf_counter() - started
+        drained = await self._drain() if args.drain else None
+        monitor.cancel()
+        await asyncio.gather(monitor, return_exceptions=True)
+
+        handler_steps = {k: v for k, v in stage.latencies.items() if not k.startswith("payment")}
+        handler_latencies = [x for values in handler_steps.values() for x in values]
+        result = _summary(handler_latencies, wall, errors=sum(stage.errors.values()))
+        result["updates_per_s"] = result.pop("throughput_per_s")
+        result.update({
+            "users": users,
+            "seconds": round(wall, 2),
+            "errors_by_step": dict(stage.errors),
+            "steps": {
+                name: {"p50_ms": round(_percentile(v, 0.5) * 1000, 2), "p99_ms": round(_percentile(v, 0.99) * 1000, 2)}
+                for name, v in stage.latencies.items()
+            },
+            "loop_lag_ms": {
+                "p50": round(_percentile(stage.lag, 0.5) * 1000, 2),
+                "p99": round(_percentile(stage.lag, 0.99) * 1000, 2),
+                "max": round(max(stage.lag, default=0) * 1000, 2),
+            },
+            "rss_mb": {"before": round(rss_before, 1), "peak": round(max(stage.rss_peak, _rss_mb()), 1),
+                       "after": round(_rss_mb(), 1)},
+            "jobs": {"running": job_queue.active, "queued": len(job_queue.pending), "drained": drained},
+            "telegram_requests": sum(self.telegram.requests.values()) - telegram_before,
+            "polza_requests": sum(self.polza.requests.values()) - polza_before,
+            "telegram_uploaded_mb": round((self.telegram.uploaded - bytes_before[0]) / 1024 / 1024, 1),
+            "telegram_fetched_by_url_mb": round((self.telegram.fetched - bytes_before[1]) / 1024 / 1024, 1),
+            "deliveries": {key: count - deliveries_before.get(key, 0)
+                           for key, count in self._deliveries().items() if count - deliveries_before.get(key, 0)},
+        })
+        return result
+
+
+async def run(args) -> dict:
+    report = {
+        "commit": _commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "stages": [],
+    }
+    test = LoadTest(args)
+    # Логи бота (print) не смешиваем с выводом и не копим в памяти
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await test.start()
+        try:
+            for users in args.ramp:
+                print(f"▶ {users} пользователей...", file=sys.stderr)
+                stage = await test.stage(users)
+                report["stages"].append(stage)
+                print(f"  {stage['updates_per_s']} обн/с, p50 {stage['p50_ms']} мс, p99 {stage['p99_ms']} мс, "
+                      f"лаг p99 {stage['loop_lag_ms']['p99']} мс, RSS {stage['rss_mb']['peak']} МБ, "
+                      f"ошибок {stage['errors']}", file=sys.stderr)
+        finally:
+            await test.stop()
+    return report
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на локальных заглушках")
+    parser.add_argument("--ramp", default="100,500,1000,2000", help="пользователей на ступенях, через запятую")
+    parser.add_argument("--db", choices=("sqlite", "supabase"), default="sqlite",
+                        help="SQLite или заглушка Supabase (PostgREST по HTTP)")
+    parser.add_argument("--output", help="файл результатов (JSON)")
+    parser.add_argument("--arrival", type=float, default=1.0, help="за сколько секунд приходят все пользователи ступени")
+    parser.add_argument("--think", type=float, default=0.0, help="случайная пауза между действиями, до N с")
+    parser.add_argument("--referral-share", type=float, default=0.3, help="доля пользователей по реферальной ссылке")
+    parser.add_argument("--credit-timeout", type=float, default=30, help="сколько ждать зачисления оплаты, с")
+    parser.add_argument("--drain", type=float, default=0.0,
+                        help="ждать завершения генераций после ступени, не дольше N с (0 — не ждать)")
+    parser.add_argument("--lag-interval", type=float, default=0.02, help="период замера задержки event loop, с")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушек, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--image-seconds", type=float, default=2, help="время генерации фото у заглушки")
+    parser.add_argument("--video-seconds", type=float, default=5, help="время генерации видео у заглушки")
+    parser.add_argument("--result-size", type=int, default=256 * 1024, help="размер результата, байт")
+    parser.add_argument("--image-side", type=int, default=1536,
+                        help="сторона PNG-результата для фото, px (нужен Pillow; 0 — байты размером --result-size)")
+    args = parser.parse_args(argv)
+    args.ramp = [int(x) for x in args.ramp.split(",") if x.strip()]
+
+    os.chdir(ROOT)  # assets/offer.pdf и прочие относительные пути
+    report = asyncio.run(run(args))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report["stages"], ensure_ascii=False, indent=2))
+    print(f"💾 Результаты: {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
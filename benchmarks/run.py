@@ -0,0 +1,344 @@
+"""
+Бенчмарки компонентов бота на локальных заглушках Polza, Telegram и Supabase.
+
+    python -m benchmarks.run                                  # все сценарии
+    python -m benchmarks.run --only db,polza --latency 0.03   # выборочно, с задержкой сети
+    python -m benchmarks.compare benchmarks/results/a.json benchmarks/results/b.json
+
+Результаты пишутся в JSON (по умолчанию benchmarks/results/<коммит>-<время>.json).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from aiohttp import ClientSession, web
+
+# Задает окружение бота — до импорта его модулей
+from benchmarks.env import RESULTS_DIR, ROOT, TMP as _TMP
+from benchmarks.fakes import FakePolza, FakeSupabase, FakeTelegram, prodamus_notification, sample_png
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summary(latencies: list, wall: float, **extra) -> dict:
+    return {
+        "ops": len(latencies),
+        "throughput_per_s": round(len(latencies) / wall, 2) if wall else 0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        **extra,
+    }
+
+
+async def _measure(make_call, count: int, concurrency: int) -> dict:
+    """Выполняет count вызовов make_call(i) не более чем по concurrency одновременно."""
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await make_call(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return _summary(latencies, time.perf_counter() - started, errors=errors)
+
+
+# --- СЦЕНАРИИ ---
+
+async def bench_db(args) -> dict:
+    """Операции database.py на SQLite и на заглушке Supabase (PostgREST)."""
+    import database as db
+
+    supabase = await FakeSupabase(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate).start()
+    results = {}
+    original = db._backend
+    try:
+        db.url, db.key = supabase.url, "bench.bench.bench"
+        backends = {"sqlite": db.SQLiteBackend(os.path.join(_TMP, "db-bench.db")), "supabase": db.SupabaseBackend()}
+        for name, backend in backends.items():
+            db._backend = backend
+            db.user_cache.clear()
+            n, c = args.db_ops, args.concurrency
+            stats = {}
+            stats["get_balance_cold"] = await _measure(lambda i: db.get_balance(10_000 + i), n, c)
+            stats["get_balance_cached"] = await _measure(lambda i: db.get_balance(10_000 + i), n, c)
+            stats["update_balance"] = await _measure(lambda i: db.update_balance(10_000 + i, 1), n, c)
+            stats["use_generation"] = await _measure(lambda i: db.use_generation(10_000 + i), n, c)
+            stats["get_users_count"] = await _measure(lambda i: db.get_users_count(), n, c)
+
+            async def order(i, prefix=name):
+                key = f"bench-{prefix}-{i}"
+                await db.record_order(key, 10_000 + i, 10, {})
+                await db.credit_order(key)
+            stats["order_record_credit"] = await _measure(order, n, c)
+            results[name] = stats
+            backend.close()
+        results["supabase_requests"] = dict(supabase.requests)
+    finally:
+        db._backend = original
+        await supabase.stop()
+    return results
+
+
+async def _generations(args, video: bool) -> dict:
+    from app import network
+
+    polza = await FakePolza(image_seconds=args.image_seconds, video_seconds=args.video_seconds,
+                            result_size=args.result_size, latency=args.latency, jitter=args.jitter,
+                            failure_rate=args.failure_rate).start()
+    network.BASE_URL = polza.url
+    await network.open_session()
+    done = 0
+    expected = args.video_seconds if video else args.image_seconds
+
+    async def one(i):
+        nonlocal done
+        if video:
+            media, _ = await network.process_video_polza("bench", "http://example/photo.jpg", 5)
+        else:
+            media, _ = await network.process_with_polza("bench", "nanabanana", "http://example/photo.jpg")
+        if media:
+            done += 1
+            media.close()
+
+    try:
+        stats = await _measure(one, args.generations, args.generations)
+        stats.update({
+            "provider_seconds": expected,
+            "completed": done,
+            "status_requests": polza.polls(),
+            "status_requests_per_generation": round(polza.polls() / max(1, args.generations), 2),
+            "overshoot_mean_s": round(stats["mean_ms"] / 1000 - expected, 3),
+        })
+        return stats
+    finally:
+        await network.poller.stop()
+        await network.close_session()
+        await polza.stop()
+
+
+async def bench_polza(args) -> dict:
+    """Стоимость ожидания генераций: запросы статуса на генерацию и задержка после готовности."""
+    return {"images": await _generations(args, video=False), "videos": await _generations(args, video=True)}
+
+
+async def bench_download(args) -> dict:
+    """Скачивание результата: пиковая память Python-кучи и скорость для разных размеров."""
+    from app import network
+
+    results = {}
+    for size_mb in args.download_sizes:
+        polza = await FakePolza(result_size=int(size_mb * 1024 * 1024)).start()
+        network.BASE_URL = polza.url
+        await network.open_session()
+        try:
+            tracemalloc.start()
+            started = time.perf_counter()
+            media, ext = await network._download_content(f"{polza.url}/files/img-1")
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[f"{size_mb}MB"] = {
+                "seconds": round(elapsed, 4),
+                "mb_per_s": round(size_mb / elapsed, 1) if elapsed else 0,
+                "peak_python_mb": round(peak / 1024 / 1024, 2),
+                "on_disk": bool(media and media.on_disk),
+            }
+            if media:
+                media.close()
+        finally:
+            await network.close_session()
+            await polza.stop()
+    return results
+
+
+async def bench_telegram(args) -> dict:
+    """Отправка результата в Telegram: загрузка файла sendPhoto / повтор по file_id."""
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import BufferedInputFile
+    from app.bot import bot
+
+    telegram = await FakeTelegram(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate).start()
+    bot.session.api = TelegramAPIServer.from_base(telegram.url)
+    payload = b"\0" * int(args.result_size)
+    try:
+        upload = await _measure(
+            lambda i: bot.send_photo(1, BufferedInputFile(payload, "res.png")), args.telegram_ops, args.concurrency
+        )
+        by_id = await _measure(lambda i: bot.send_photo(1, "file-1"), args.telegram_ops, args.concurrency)
+        upload["uploaded_mb"] = round(telegram.uploaded / 1024 / 1024, 2)
+        return {"send_photo_upload": upload, "send_photo_file_id": by_id}
+    finally:
+        await bot.session.close()
+        await telegram.stop()
+
+
+async def bench_transcode(args) -> dict:
+    """Пережатие результата перед отправкой: время кодирования, размер и время загрузки в Telegram."""
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.types import BufferedInputFile
+    from app.bot import bot
+    from app.services import relay, transcode
+
+    if not transcode.enabled():
+        return {"skipped": "нужен Pillow и TRANSCODE_FORMAT=jpeg/webp"}
+    telegram = await FakeTelegram(latency=args.latency, jitter=args.jitter).start()
+    bot.session.api = TelegramAPIServer.from_base(telegram.url)
+    results = {}
+    try:
+        for side in args.transcode_sides:
+            png = sample_png(side)
+            media = relay.RelayedMedia("png")
+            for offset in range(0, len(png), relay.RELAY_CHUNK_SIZE):
+                await media.write(png[offset:offset + relay.RELAY_CHUNK_SIZE])
+            await media.finish()
+
+            encode = await _measure(lambda i: transcode.transcode(media), args.transcode_ops, args.concurrency)
+            data, ext = await transcode.transcode(media)
+            original = await _measure(lambda i: bot.send_photo(1, media.input_file("res.png")),
+                                      args.transcode_ops, args.concurrency)
+            encoded = await _measure(lambda i: bot.send_photo(1, BufferedInputFile(data or png, f"res.{ext}")),
+                                     args.transcode_ops, args.concurrency)
+            media.close()
+            results[f"{side}px"] = {
+                "original_kb": len(png) // 1024,
+                "encoded_kb": len(data or png) // 1024,
+                "encode": encode,
+                "upload_original": original,
+                "upload_encoded": encoded,
+            }
+    finally:
+        await bot.session.close()
+        await telegram.stop()
+    return results
+
+
+async def bench_prodamus(args) -> dict:
+    """Обработчик вебхука Prodamus: время ответа (зачисление идет в фоне и здесь не учитывается)."""
+    import database as db
+    from app.routers.payments import prodamus_webhook
+    from app.services.payments import payment_pipeline
+
+    db._backend = db.SQLiteBackend(os.path.join(_TMP, "prodamus.db"))
+    app = web.Application()
+    app.router.add_post("/payments/prodamus", prodamus_webhook)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/payments/prodamus"
+
+    async with ClientSession() as session:
+        async def notify(i):
+            form, headers = prodamus_notification(20_000 + i, 10, f"p-{i}", i)
+            async with session.post(url, data=form, headers=headers) as resp:
+                await resp.read()
+
+        async def repeat(i):
+            await notify(i % 50)
+        try:
+            first = await _measure(notify, args.webhook_ops, args.concurrency)
+            duplicates = await _measure(repeat, args.webhook_ops, args.concurrency)
+        finally:
+            await runner.cleanup()
+    queued = payment_pipeline.queue.qsize()
+    return {"new_orders": first, "duplicate_notifications": duplicates, "queued_for_crediting": queued}
+
+
+SCENARIOS = {
+    "db": bench_db,
+    "polza": bench_polza,
+    "download": bench_download,
+    "telegram": bench_telegram,
+    "transcode": bench_transcode,
+    "prodamus": bench_prodamus,
+}
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def run(args) -> dict:
+    import contextlib
+    import io
+
+    report = {
+        "commit": _commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": {},
+    }
+    for name in args.only:
+        print(f"▶ {name}...", file=sys.stderr)
+        started = time.perf_counter()
+        # Логи бота (print) не смешиваем с выводом бенчмарка
+        with contextlib.redirect_stdout(io.StringIO()):
+            report["results"][name] = await SCENARIOS[name](args)
+        print(f"  готово за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    return report
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Бенчмарки компонентов бота на локальных заглушках")
+    parser.add_argument("--only", default=",".join(SCENARIOS), help="сценарии через запятую: " + ",".join(SCENARIOS))
+    parser.add_argument("--output", help="файл результатов (JSON)")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушек, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--db-ops", type=int, default=500)
+    parser.add_argument("--generations", type=int, default=50, help="одновременных генераций в сценарии polza")
+    parser.add_argument("--image-seconds", type=float, default=5, help="время генерации фото у заглушки")
+    parser.add_argument("--video-seconds", type=float, default=15, help="время генерации видео у заглушки")
+    parser.add_argument("--result-size", type=int, default=1024 * 1024, help="размер результата, байт")
+    parser.add_argument("--download-sizes", default="1,20,100", help="размеры для сценария download, МБ")
+    parser.add_argument("--telegram-ops", type=int, default=200)
+    parser.add_argument("--webhook-ops", type=int, default=500)
+    parser.add_argument("--transcode-sides", default="1024,2048,4096", help="стороны фото для сценария transcode, px")
+    parser.add_argument("--transcode-ops", type=int, default=20)
+    args = parser.parse_args(argv)
+    args.only = [name.strip() for name in args.only.split(",") if name.strip()]
+    args.download_sizes = [float(x) for x in args.download_sizes.split(",")]
+    args.transcode_sides = [int(x) for x in args.transcode_sides.split(",")]
+    unknown = [name for name in args.only if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    report = asyncio.run(run(args))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report["results"], ensure_ascii=False, indent=2))
+    print(f"💾 Результаты: {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,530 @@
+import asyncio
+import functools
+import json
 import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
 from supabase import create_client, Client
+from supabase.lib.client_options import SyncClientOptions
 from dotenv import load_dotenv
 
+from app.services import metrics
+from app.services.cache import TTLCache
+
 load_dotenv()
 
 url: str = os.getenv("SUPABASE_URL")
 key: str = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
 
+# "supabase" — боевая база, "sqlite" — локальная замена для тестов и отладки
+DB_BACKEND = os.getenv("DB_BACKEND", "supabase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "local.db")
+
+# Размер пула потоков и соединений к Supabase.
+# Все запросы к БД выполняются в этом пуле, чтобы не блокировать event loop бота.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 16))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", 15))
+
+# Кэш строк пользователей в памяти процесса (баланс, реферер)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+
+INITIAL_BALANCE = 1
+
+
+def utc_timestamp(ts: float = None) -> str:
+    """Время в UTC в формате, который одинаково сравнивается в SQLite и принимается Postgres."""
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts))
+
+
+class SupabaseBackend:
+    """Запросы к Supabase (PostgREST). Методы синхронные и вызываются только из _executor."""
+
+    def __init__(self):
+        # Один httpx-клиент на весь процесс: соединения переиспользуются (keep-alive)
+        self.http = httpx.Client(
+            timeout=DB_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=DB_POOL_SIZE,
+                max_keepalive_connections=DB_POOL_SIZE,
+                keepalive_expiry=60,
+            ),
+        )
+        self.client: Client = create_client(url, key, options=SyncClientOptions(httpx_client=self.http))
+
+    def close(self):
+        self.http.close()
+
+    def get_users_count(self):
+        # Счетчик поддерживается триггером (sql/003_counters.sql) — чтение одной строки
+        res = self.client.table("counters").select("value").eq("name", "users_total").execute()
+        return res.data[0]["value"] if res.data else 0
+
+    def get_balance(self, user_id: int):
+        response = self.client.table("users").select("balance").eq("user_id", user_id).execute()
+
+        if not response.data:
+            # Если пользователя нет, создаем запись.
+            # Поле referrer_id будет NULL по умолчанию, если не было заполнено функцией set_referrer ранее.
+            self.client.table("users").insert({"user_id": user_id, "balance": INITIAL_BALANCE}).execute()
+            return INITIAL_BALANCE
+
+        return response.data[0]["balance"]
+
+    def increment_balance(self, user_id: int, amount: int, strict: bool):
+        # Хранимая функция increment_balance (sql/001_increment_balance.sql):
+        # создание пользователя, изменение и чтение баланса — один запрос и одна транзакция.
+        res = self.client.rpc("increment_balance", {
+            "p_user_id": user_id,
+            "p_amount": amount,
+            "p_strict": strict,
+        }).execute()
+        return res.data
+
+    def insert_events(self, table: str, rows: list):
+        # Пачка одним запросом; уникальный event_id (sql/004_event_logs.sql) отсекает повторы
+        return self.client.table(table).upsert(rows, on_conflict="event_id", ignore_duplicates=True).execute()
+
+    def record_order(self, order_key: str, user_id: int, amount: int, raw_data: dict):
+        # Уникальный order_key: повторное уведомление о том же заказе ничего не вставит
+        res = self.client.table("payment_orders").upsert({
+            "order_key": order_key,
+            "user_id": user_id,
+            "amount": amount,
+            "status": "pending",
+            "raw_data": raw_data
+        }, on_conflict="order_key", ignore_duplicates=True).execute()
+        return bool(res.data)
+
+    def credit_order(self, order_key: str):
+        # Хранимая функция credit_order (sql/002_payment_orders.sql): смена статуса
+        # pending -> credited и начисление баланса — одна транзакция
+        res = self.client.rpc("credit_order", {"p_order_key": order_key}).execute()
+        return res.data or None
+
+    def pending_orders(self):
+        res = self.client.table("payment_orders").select("order_key").eq("status", "pending").execute()
+        return [row["order_key"] for row in res.data]
+
+    def set_referrer(self, user_id: int, referrer_id: int):
+        # Проверяем, есть ли уже такой юзер
+        res = self.client.table("users").select("referrer_id").eq("user_id", user_id).execute()
+
+        if not res.data:
+            # Если юзера ВООБЩЕ нет — создаем его сразу с реферером
+            res = self.client.table("users").insert({
+                "user_id": user_id,
+                "balance": INITIAL_BALANCE,
+                "referrer_id": referrer_id
+            }).execute()
+            return bool(res.data)
+        # Если юзер есть, но referrer_id пустой (NULL) — обновляем его
+        if res.data[0].get("referrer_id") is None:
+            res = self.client.table("users").update({"referrer_id": referrer_id}) \
+                .eq("user_id", user_id).is_("referrer_id", "null").execute()
+            return bool(res.data)
+        return False
+
+    def _select_all(self, make_query, page: int = 1000):
+        # PostgREST отдает не больше page строк за запрос — читаем постранично
+        rows, start = [], 0
+        while True:
+            chunk = make_query().range(start, start + page - 1).execute().data
+            rows.extend(chunk)
+            if len(chunk) < page:
+                return rows
+            start += page
+
+    def get_referral_edges(self, since: str = None):
+        # referred_at ставит триггер (sql/005_referral_sync.sql)
+        def query():
+            q = self.client.table("users").select("user_id, referrer_id").not_.is_("referrer_id", "null")
+            return q.gte("referred_at", since) if since else q
+        return [(int(row["user_id"]), int(row["referrer_id"])) for row in self._select_all(query)]
+
+    def get_credited_orders(self, since: str = None):
+        def query():
+            q = self.client.table("payment_orders").select("order_key, user_id, amount").eq("status", "credited")
+            return q.gte("credited_at", since) if since else q
+        return [(row["order_key"], int(row["user_id"]), int(row["amount"])) for row in self._select_all(query)]
+
+    def get_referrals_count(self, user_id: int):
+        res = self.client.table("referral_counts").select("referrals").eq("referrer_id", user_id).execute()
+        return res.data[0]["referrals"] if res.data else 0
+
+    def reconcile_counters(self):
+        self.client.rpc("reconcile_counters", {}).execute()
+
+
+class SQLiteBackend:
+    """Локальная замена Supabase на SQLite с той же семантикой запросов."""
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                balance INTEGER NOT NULL DEFAULT 0,
+                referrer_id INTEGER,
+                referred_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS referral_counts (
+                referrer_id INTEGER PRIMARY KEY,
+                referrals INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TRIGGER IF NOT EXISTS users_counters_insert AFTER INSERT ON users BEGIN
+                INSERT INTO counters (name, value) VALUES ('users_total', 1)
+                    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+                INSERT INTO referral_counts (referrer_id, referrals)
+                    SELECT NEW.referrer_id, 1 WHERE NEW.referrer_id IS NOT NULL
+                    ON CONFLICT(referrer_id) DO UPDATE SET referrals = referrals + 1;
+            END;
+            CREATE TRIGGER IF NOT EXISTS users_counters_delete AFTER DELETE ON users BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = 'users_total';
+                UPDATE referral_counts SET referrals = referrals - 1 WHERE referrer_id = OLD.referrer_id;
+            END;
+            CREATE TRIGGER IF NOT EXISTS users_counters_referrer AFTER UPDATE OF referrer_id ON users
+            WHEN OLD.referrer_id IS NOT NEW.referrer_id BEGIN
+                UPDATE referral_counts SET referrals = referrals - 1 WHERE referrer_id = OLD.referrer_id;
+                INSERT INTO referral_counts (referrer_id, referrals)
+                    SELECT NEW.referrer_id, 1 WHERE NEW.referrer_id IS NOT NULL
+                    ON CONFLICT(referrer_id) DO UPDATE SET referrals = referrals + 1;
+            END;
+            CREATE TABLE IF NOT EXISTS payment_orders (
+                order_key TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                raw_data TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                credited_at TEXT
+            );
+            CREATE TABLE IF NOT EXISTS payment_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                amount INTEGER,
+                status TEXT,
+                order_id TEXT,
+                raw_data TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                event_id TEXT UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS generation_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT UNIQUE,
+                job_id TEXT,
+                user_id INTEGER,
+                model TEXT,
+                routed_model TEXT,
+                cost INTEGER,
+                duration REAL,
+                outcome TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # База, созданная до журнала событий и инкрементальной загрузки графа рефералов
+        if self._add_column("payment_logs", "event_id TEXT"):
+            self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS payment_logs_event_id ON payment_logs (event_id)")
+        self._add_column("users", "referred_at TEXT")
+        self._add_column("payment_orders", "credited_at TEXT")
+
+    def _add_column(self, table: str, column: str) -> bool:
+        columns = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+        if column.split()[0] in columns:
+            return False
+        self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+        return True
+
+    def close(self):
+        self.conn.close()
+
+    def _one(self, sql: str, *params):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def get_users_count(self):
+        row = self._one("SELECT value FROM counters WHERE name = 'users_total'")
+        return row[0] if row else 0
+
+    def get_balance(self, user_id: int):
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO users (user_id, balance) VALUES (?, ?) ON CONFLICT(user_id) DO NOTHING",
+                (user_id, INITIAL_BALANCE)
+            )
+            return self.conn.execute("SELECT balance FROM users WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def _increment(self, user_id: int, amount: int, strict: bool):
+        # Вызывается внутри открытой транзакции
+        self.conn.execute(
+            "INSERT INTO users (user_id, balance) VALUES (?, ?) ON CONFLICT(user_id) DO NOTHING",
+            (user_id, INITIAL_BALANCE)
+        )
+        row = self.conn.execute(
+            "UPDATE users SET balance = MAX(0, balance + ?) "
+            "WHERE user_id = ? AND (? = 0 OR balance + ? >= 0) RETURNING balance",
+            (amount, user_id, int(strict), amount)
+        ).fetchone()
+        return row[0] if row else None
+
+    def increment_balance(self, user_id: int, amount: int, strict: bool):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                balance = self._increment(user_id, amount, strict)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return balance
+
+    def insert_events(self, table: str, rows: list):
+        columns = sorted({column for row in rows for column in row})
+        values = [
+            tuple(json.dumps(v, ensure_ascii=False) if isinstance(v, (dict, list)) else v
+                  for v in (row.get(column) for column in columns))
+            for row in rows
+        ]
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    values
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
 
-def get_users_count():
+    def record_order(self, order_key: str, user_id: int, amount: int, raw_data: dict):
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO payment_orders (order_key, user_id, amount, raw_data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(order_key) DO NOTHING",
+                (order_key, user_id, amount, json.dumps(raw_data, ensure_ascii=False))
+            )
+            return cur.rowcount > 0
+
+    def credit_order(self, order_key: str):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "UPDATE payment_orders SET status = 'credited', credited_at = ? "
+                    "WHERE order_key = ? AND status = 'pending' RETURNING order_key, user_id, amount, raw_data",
+                    (utc_timestamp(), order_key)
+                ).fetchone()
+                balance = self._increment(row[1], row[2], False) if row else None
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return {"order_key": row[0], "user_id": row[1], "amount": row[2], "raw_data": json.loads(row[3] or "{}"),
+                "balance": balance}
+
+    def pending_orders(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT order_key FROM payment_orders WHERE status = 'pending'").fetchall()
+        return [row[0] for row in rows]
+
+    def set_referrer(self, user_id: int, referrer_id: int):
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO users (user_id, balance, referrer_id, referred_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET referrer_id = excluded.referrer_id, "
+                "referred_at = excluded.referred_at WHERE users.referrer_id IS NULL",
+                (user_id, INITIAL_BALANCE, referrer_id, utc_timestamp())
+            )
+            return cur.rowcount > 0
+
+    def get_referral_edges(self, since: str = None):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT user_id, referrer_id FROM users WHERE referrer_id IS NOT NULL AND (? IS NULL OR referred_at >= ?)",
+                (since, since)
+            ).fetchall()
+
+    def get_credited_orders(self, since: str = None):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT order_key, user_id, amount FROM payment_orders "
+                "WHERE status = 'credited' AND (? IS NULL OR credited_at >= ?) ORDER BY created_at",
+                (since, since)
+            ).fetchall()
+
+    def get_referrals_count(self, user_id: int):
+        row = self._one("SELECT referrals FROM referral_counts WHERE referrer_id = ?", user_id)
+        return row[0] if row else 0
+
+    def reconcile_counters(self):
+        with self.lock:
+            self.conn.executescript("""
+                BEGIN;
+                INSERT INTO counters (name, value) VALUES ('users_total', (SELECT COUNT(*) FROM users))
+                    ON CONFLICT(name) DO UPDATE SET value = excluded.value;
+                INSERT INTO referral_counts (referrer_id, referrals)
+                    SELECT referrer_id, COUNT(*) FROM users WHERE referrer_id IS NOT NULL GROUP BY referrer_id
+                    ON CONFLICT(referrer_id) DO UPDATE SET referrals = excluded.referrals;
+                DELETE FROM referral_counts
+                    WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.referrer_id = referral_counts.referrer_id);
+                COMMIT;
+            """)
+
+
+_backend = SQLiteBackend() if DB_BACKEND == "sqlite" else SupabaseBackend()
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+# user_id -> {"balance": ...}; обновляется при каждой записи (write-through)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+metrics.cache_lookups.set_function(lambda: user_cache.hits, result="hit")
+metrics.cache_lookups.set_function(lambda: user_cache.misses, result="miss")
+metrics.cache_size.set_function(lambda: len(user_cache))
+
+
+async def _run(func, *args):
+    """Выполняет синхронный вызов БД в пуле потоков, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args))
+    except Exception:
+        metrics.failures.inc(kind="db")
+        raise
+    finally:
+        metrics.db_seconds.observe(time.perf_counter() - started, function=func.__name__)
+
+
+def _cache_update(user_id: int, **fields):
+    row = user_cache.pop(user_id) or {}
+    row.update(fields)
+    user_cache.set(user_id, row)
+
+
+def close():
+    """Закрывает пул потоков и соединения с БД (вызывается при остановке бота)."""
+    _executor.shutdown(wait=True)
+    _backend.close()
+
+
+# --- АСИНХРОННЫЙ API (используется роутерами и сервисами) ---
+
+async def get_users_count():
     """Возвращает общее количество пользователей в таблице users."""
     try:
-        response = supabase.table("users").select("*", count="exact").execute()
-        return response.count if response.count is not None else 0
+        return await _run(_backend.get_users_count)
     except Exception as e:
         print(f"❌ Ошибка Supabase при подсчете пользователей: {e}")
         return 0
 
 
-def get_balance(user_id: int):
+async def get_balance(user_id: int):
     """Получает баланс. Если пользователя нет — создает его."""
-    try:
-        response = supabase.table("users").select("balance").eq("user_id", user_id).execute()
+    row = user_cache.get(user_id)
+    if row and "balance" in row:
+        return row["balance"]
 
-        if not response.data:
-            # Если пользователя нет, создаем запись.
-            # Поле referrer_id будет NULL по умолчанию, если не было заполнено функцией set_referrer ранее.
-            initial_balance = 1
-            supabase.table("users").insert({"user_id": user_id, "balance": initial_balance}).execute()
-            return initial_balance
-
-        return response.data[0]["balance"]
+    try:
+        balance = await _run(_backend.get_balance, user_id)
+        _cache_update(user_id, balance=balance)
+        return balance
     except Exception as e:
         print(f"❌ Ошибка get_balance: {e}")
         return 0
 
 
-def update_balance(user_id: int, amount: int):
-    """Универсальная функция изменения баланса."""
-    current_balance = get_balance(user_id)
-    new_balance = max(0, current_balance + amount)
-    return supabase.table("users").update({"balance": new_balance}).eq("user_id", user_id).execute()
+async def update_balance(user_id: int, amount: int, strict: bool = False):
+    """
+    Атомарно изменяет баланс одним запросом и возвращает новое значение.
+    По умолчанию баланс не опускается ниже нуля. При strict=True списание
+    не выполняется вовсе, если средств недостаточно, — тогда возвращается None.
+    """
+    balance = await _run(_backend.increment_balance, user_id, amount, strict)
+    if balance is not None:
+        _cache_update(user_id, balance=balance)
+    else:
+        # Списание отклонено — значит, закэшированный баланс устарел
+        user_cache.pop(user_id)
+    return balance
+
+
+async def use_generation(user_id: int):
+    return await update_balance(user_id, -1, strict=True)
+
 
+async def add_balance(user_id: int, count: int):
+    return await update_balance(user_id, count)
 
-def use_generation(user_id: int):
-    return update_balance(user_id, -1)
 
+async def insert_events(table: str, rows: list):
+    """Вставляет пачку событий журнала (payment_logs, generation_logs); повторы по event_id пропускаются."""
+    return await _run(_backend.insert_events, table, rows)
 
-def add_balance(user_id: int, count: int):
-    return update_balance(user_id, count)
 
+async def reconcile_counters():
+    """Пересчитывает поддерживаемые счетчики с нуля (исправляет возможный дрейф)."""
+    await _run(_backend.reconcile_counters)
 
-def log_payment(user_id: int, amount: int, status: str, order_id: str, raw_data: dict):
-    return supabase.table("payment_logs").insert({
-        "user_id": user_id,
-        "amount": amount,
-        "status": status,
-        "order_id": order_id,
-        "raw_data": raw_data
-    }).execute()
 
+async def record_order(order_key: str, user_id: int, amount: int, raw_data: dict) -> bool:
+    """Записывает заказ в журнал оплат. False — такой заказ уже был записан ранее."""
+    return await _run(_backend.record_order, order_key, user_id, amount, raw_data)
 
-def set_referrer(user_id: int, referrer_id: int):
+
+async def credit_order(order_key: str):
+    """
+    Атомарно переводит заказ pending -> credited и начисляет его сумму покупателю.
+    Возвращает заказ с новым балансом (поле balance) или None, если заказ уже зачислен.
+    При ошибке ничего не меняется — заказ остается pending и может быть обработан снова.
+    """
+    order = await _run(_backend.credit_order, order_key)
+    if order:
+        _cache_update(order["user_id"], balance=order["balance"])
+    return order
+
+
+async def pending_orders():
+    """Заказы, записанные, но еще не обработанные (например, из-за перезапуска)."""
+    return await _run(_backend.pending_orders)
+
+
+async def set_referrer(user_id: int, referrer_id: int) -> bool:
+    """Задает пригласителя, если его еще нет. True — связь записана этим вызовом."""
     if user_id == referrer_id:
-        return
+        return False
 
     try:
-        # Проверяем, есть ли уже такой юзер
-        res = supabase.table("users").select("referrer_id").eq("user_id", user_id).execute()
-
-        if not res.data:
-            # Если юзера ВООБЩЕ нет — создаем его сразу с реферером
-            supabase.table("users").insert({
-                "user_id": user_id,
-                "balance": 1,
-                "referrer_id": referrer_id
-            }).execute()
-        else:
-            # Если юзер есть, но referrer_id пустой (NULL) — обновляем его
-            if res.data[0].get("referrer_id") is None:
-                supabase.table("users").update({"referrer_id": referrer_id}).eq("user_id", user_id).execute()
+        return await _run(_backend.set_referrer, user_id, referrer_id)
     except Exception as e:
         print(f"ОШИБКА set_referrer: {e}")
+        return False
 
 
-def get_referrer(user_id: int):
-    """Возвращает ID того, кто пригласил этого пользователя"""
-    try:
-        res = supabase.table("users").select("referrer_id").eq("user_id", user_id).execute()
-        if res.data and res.data[0].get("referrer_id"):
-            return int(res.data[0]["referrer_id"])
-    except Exception as e:
-        print(f"❌ Ошибка get_referrer: {e}")
-    return None
+async def get_referral_edges(since: str = None):
+    """Связи (user_id, referrer_id) для графа рефералов в памяти: все или появившиеся с момента since."""
+    return await _run(_backend.get_referral_edges, since)
+
 
+async def get_credited_orders(since: str = None):
+    """Зачисленные покупки (order_key, user_id, amount): все или зачисленные с момента since."""
+    return await _run(_backend.get_credited_orders, since)
 
-def get_referrals_count(user_id: int):
+
+async def get_referrals_count(user_id: int):
     """Считает сколько человек пригласил пользователь"""
     try:
-        res = supabase.table("users").select("*", count="exact").eq("referrer_id", user_id).execute()
-        return res.count if res.count is not None else 0
+        return await _run(_backend.get_referrals_count, user_id)
     except Exception as e:
         print(f"❌ Ошибка get_referrals_count: {e}")
-        return 0
\ No newline at end of file
+        return 0
@@ -2,25 +2,96 @@ import asyncio
 import os
 from aiohttp import web
 from aiogram.client.session.aiohttp import AiohttpSession
-from app.bot import bot, dp
+from aiogram.webhook.aiohttp_server import setup_application
+from app.bot import bot, dp, settings
 from app.routers import setup_routers
 from app.routers.payments import prodamus_webhook
+from app.routers.polza import polza_callback
+from app import network, supervisor
+from app.services import metrics, tracing, worker
+from app.services.events import event_log
+from app.services.payments import payment_pipeline
+from app.services.counters import reconcile_loop
+from app.services.referrals import refresh_loop
+import database as db
+
+
+WEBHOOK_PATH = "/telegram/webhook"
+
+
+async def run_webhook():
+    """Регистрирует вебхук в Telegram и работает до SIGTERM/SIGINT."""
+    # Накопившиеся обновления не сбрасываем: машина с auto_stop просыпается как раз от них
+    await bot.set_webhook(
+        f"{settings.public_url}{WEBHOOK_PATH}",
+        secret_token=settings.webhook_secret,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    print(f"✅ Вебхук Telegram: {settings.public_url}{WEBHOOK_PATH}")
+    await supervisor.wait_for_stop()
+
+
+async def run_supervisor():
+    """Многопроцессный режим (BOT_WORKERS > 1): этот процесс только принимает и раскладывает запросы."""
+    setup_routers(dp)
+    await supervisor.Supervisor().run(bot, dp, settings, WEBHOOK_PATH)
 
 
 async def main():
     # 1. Настраиваем роутеры бота
     setup_routers(dp)
 
+    # Данные бота (username для реферальных ссылок) запрашиваем один раз
+    try:
+        await bot.me()
+    except Exception as e:
+        print(f"⚠️ Не удалось получить данные бота: {e}")
+
+    # Общий HTTP-клиент для Polza: соединения живут все время работы бота
+    await network.open_session()
+
+    # Продолжаем генерации, прерванные прошлой остановкой (редеплой, auto_stop)
+    await worker.resume_jobs()
+
+    # Журнал оплат и генераций: сначала дописываем то, что осталось в спуле с прошлого запуска
+    await event_log.start()
+
+    # Фоновая обработка оплат (и заказов, не успевших обработаться до перезапуска)
+    await payment_pipeline.start()
+
+    # Периодическая сверка счетчиков пользователей (одна на все процессы)
+    reconcile_task = asyncio.create_task(reconcile_loop()) if supervisor.is_primary() else None
+    # Граф рефералов в памяти (загрузка и периодическое обновление)
+    referrals_task = asyncio.create_task(refresh_loop())
+
     # 2. Настройка веб-сервера
     app = web.Application()
     app.router.add_post("/payments/prodamus", prodamus_webhook)
+    app.router.add_post("/polza/callback", polza_callback)
+    app.router.add_get("/metrics", metrics.handle)
+
+    updates = None
+    if supervisor.is_worker():
+        # Обновления присылает супервизор, уже распределенные по пользователям
+        updates = supervisor.OrderedUpdateHandler(dp, bot)
+        updates.register(app, supervisor.WORKER_UPDATE_PATH)
+        app.router.add_post(supervisor.WORKER_INVALIDATE_PATH, supervisor.handle_invalidate)
+        app.router.add_route("*", supervisor.WORKER_HEALTH_PATH, supervisor.handle_health)
+        setup_application(app, dp, bot=bot)
+    elif settings.bot_mode == "webhook":
+        # Обновления Telegram приходят на тот же сервер; Telegram сразу получает ответ 200,
+        # а события одного пользователя обрабатываются по очереди
+        updates = supervisor.OrderedUpdateHandler(dp, bot, secret_token=settings.webhook_secret)
+        updates.register(app, WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
 
     runner = web.AppRunner(app)
     await runner.setup()
 
     # Railway порт
     port = int(os.getenv("PORT", 8080))
-    site = web.TCPSite(runner, "0.0.0.0", port)
+    host = "127.0.0.1" if supervisor.is_worker() else "0.0.0.0"
+    site = web.TCPSite(runner, host, port)
 
     # 3. Запуск сервера платежей
     await site.start()
@@ -32,19 +103,43 @@ async def main():
     print("🚀 Попытка запуска бота...")
 
     try:
-        # Запускаем polling
-        # Удаляем лишние запросы при старте, чтобы не ловить таймаут на проверке связи
-        await dp.start_polling(bot, skip_updates=True)
+        if supervisor.is_worker():
+            await supervisor.wait_for_stop()
+        elif settings.bot_mode == "webhook":
+            await run_webhook()
+        else:
+            # Запускаем polling
+            # Удаляем лишние запросы при старте, чтобы не ловить таймаут на проверке связи
+            await dp.start_polling(bot, skip_updates=True)
     except Exception as e:
         print(f"❌ Ошибка сети или Telegram API: {e}")
     finally:
         # Корректное закрытие всего при выходе
+        # Даем текущим генерациям шанс завершиться, остальные восстановятся из журнала
+        if updates:
+            await updates.close(supervisor.UPDATE_DRAIN_TIMEOUT)
+        await worker.shutdown()
+        await payment_pipeline.stop()
+        tracing.tracer.close()
+        if reconcile_task:
+            reconcile_task.cancel()
+        referrals_task.cancel()
+        await dp.storage.close()
         await bot.session.close()
+        await network.poller.stop()
+        await network.close_session()
+        await supervisor.close_session()
         await runner.cleanup()
+        # Последняя пачка событий — после остановки генераций и оплат, пока база открыта
+        await event_log.close()
+        db.close()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if supervisor.BOT_WORKERS > 1 and not supervisor.is_worker():
+            asyncio.run(run_supervisor())
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         print("\n🛑 Бот и сервер остановлены")
\ No newline at end of file
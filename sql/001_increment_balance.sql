@@ -0,0 +1,27 @@
+-- Атомарное изменение баланса одним запросом.
+-- Создает пользователя (если его нет), меняет баланс и возвращает новое значение.
+-- p_strict = true: списание не выполняется, если средств не хватает (возвращается NULL).
+create or replace function increment_balance(
+    p_user_id bigint,
+    p_amount integer,
+    p_strict boolean default false
+)
+returns integer
+language plpgsql
+as $$
+declare
+    new_balance integer;
+begin
+    insert into users (user_id, balance)
+    values (p_user_id, 1)
+    on conflict (user_id) do nothing;
+
+    update users
+       set balance = greatest(0, balance + p_amount)
+     where user_id = p_user_id
+       and (not p_strict or balance + p_amount >= 0)
+    returning balance into new_balance;
+
+    return new_balance;
+end;
+$$;
@@ -0,0 +1,55 @@
+-- Журнал заказов Prodamus: одна строка на заказ, повторные уведомления отбрасываются.
+-- status: pending -> credited (credit_order ниже)
+create table if not exists payment_orders (
+    order_key  text primary key,
+    user_id    bigint not null,
+    amount     integer not null,
+    status     text not null default 'pending',
+    raw_data   jsonb,
+    created_at timestamptz not null default now()
+);
+
+-- Время зачисления: по нему граф рефералов догружает новые покупки
+alter table payment_orders add column if not exists credited_at timestamptz;
+
+create index if not exists payment_orders_credited_at_idx
+    on payment_orders (credited_at)
+    where credited_at is not null;
+
+create index if not exists payment_orders_pending_idx
+    on payment_orders (status)
+    where status = 'pending';
+
+-- Зачисление заказа: смена статуса и начисление баланса в одной транзакции.
+-- Если процесс упадет до коммита, заказ останется pending и будет обработан после перезапуска.
+-- Возвращает заказ с новым балансом или NULL, если заказ уже зачислен.
+create or replace function credit_order(p_order_key text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    o payment_orders%rowtype;
+    new_balance integer;
+begin
+    update payment_orders
+       set status = 'credited',
+           credited_at = now()
+     where order_key = p_order_key
+       and status = 'pending'
+    returning * into o;
+
+    if not found then
+        return null;
+    end if;
+
+    new_balance := increment_balance(o.user_id, o.amount, false);
+
+    return jsonb_build_object(
+        'order_key', o.order_key,
+        'user_id', o.user_id,
+        'amount', o.amount,
+        'raw_data', o.raw_data,
+        'balance', new_balance
+    );
+end;
+$$;
@@ -0,0 +1,68 @@
+-- Поддерживаемые счетчики вместо count(*) по всей таблице users.
+-- Обновляются триггером при вставке/удалении пользователя и изменении referrer_id,
+-- reconcile_counters() пересчитывает их с нуля (периодическая сверка из бота).
+create table if not exists counters (
+    name  text primary key,
+    value bigint not null default 0
+);
+
+create table if not exists referral_counts (
+    referrer_id bigint primary key,
+    referrals   integer not null default 0
+);
+
+create or replace function users_counters_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'INSERT' then
+        insert into counters (name, value) values ('users_total', 1)
+        on conflict (name) do update set value = counters.value + 1;
+    elsif tg_op = 'DELETE' then
+        update counters set value = value - 1 where name = 'users_total';
+    end if;
+
+    if tg_op in ('UPDATE', 'DELETE') and old.referrer_id is not null
+       and (tg_op = 'DELETE' or old.referrer_id is distinct from new.referrer_id) then
+        update referral_counts set referrals = referrals - 1 where referrer_id = old.referrer_id;
+    end if;
+
+    if tg_op in ('INSERT', 'UPDATE') and new.referrer_id is not null
+       and (tg_op = 'INSERT' or old.referrer_id is distinct from new.referrer_id) then
+        insert into referral_counts (referrer_id, referrals) values (new.referrer_id, 1)
+        on conflict (referrer_id) do update set referrals = referral_counts.referrals + 1;
+    end if;
+
+    if tg_op = 'DELETE' then
+        return old;
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists users_counters on users;
+create trigger users_counters
+    after insert or delete or update of referrer_id on users
+    for each row execute function users_counters_trigger();
+
+create or replace function reconcile_counters()
+returns void
+language plpgsql
+as $$
+begin
+    insert into counters (name, value)
+    values ('users_total', (select count(*) from users))
+    on conflict (name) do update set value = excluded.value;
+
+    -- Без голого delete: pg_safeupdate отклоняет delete/update без where
+    insert into referral_counts (referrer_id, referrals)
+    select referrer_id, count(*) from users where referrer_id is not null group by referrer_id
+    on conflict (referrer_id) do update set referrals = excluded.referrals;
+
+    delete from referral_counts rc
+    where not exists (select 1 from users u where u.referrer_id = rc.referrer_id);
+end;
+$$;
+
+select reconcile_counters();
@@ -0,0 +1,21 @@
+-- Журнал событий с отложенной записью (app/services/events.py).
+-- Бот отправляет события пачками и может повторить пачку после сбоя,
+-- поэтому у каждого события есть event_id: повторная вставка ничего не добавит.
+alter table payment_logs add column if not exists event_id text;
+create unique index if not exists payment_logs_event_id on payment_logs (event_id);
+
+create table if not exists generation_logs (
+    id           bigserial primary key,
+    event_id     text unique,
+    job_id       text,
+    user_id      bigint,
+    model        text,
+    routed_model text,
+    cost         integer,
+    duration     numeric,
+    outcome      text,
+    created_at   timestamptz default now()
+);
+
+create index if not exists generation_logs_user_id on generation_logs (user_id);
+create index if not exists generation_logs_created_at on generation_logs (created_at);
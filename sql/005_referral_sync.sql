@@ -0,0 +1,26 @@
+-- Инкрементальная загрузка графа рефералов: время появления связи "кто кого пригласил".
+-- Бот при старте читает граф целиком, а дальше догружает только связи с referred_at
+-- (и покупки с payment_orders.credited_at) не старше прошлой загрузки.
+alter table users add column if not exists referred_at timestamptz;
+
+create index if not exists users_referred_at_idx
+    on users (referred_at)
+    where referred_at is not null;
+
+create or replace function users_referred_at_trigger()
+returns trigger
+language plpgsql
+as $$
+begin
+    if new.referrer_id is not null
+       and (tg_op = 'INSERT' or old.referrer_id is distinct from new.referrer_id) then
+        new.referred_at := now();
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists users_referred_at on users;
+create trigger users_referred_at
+    before insert or update of referrer_id on users
+    for each row execute function users_referred_at_trigger();
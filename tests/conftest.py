@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+# Модули читают настройки при импорте: тесты работают только с локальной SQLite
+# и временными файлами, значения из .env (токены, режим вебхука) не используются
+_TMP = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ.update({
+    "DB_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(_TMP, "test.db"),
+    "BOT_TOKEN": "123456:test-token",
+    "BOT_MODE": "polling",
+    "BOT_WORKERS": "1",
+    "POLZA_CALLBACKS": "0",
+    "JOBS_DB_PATH": os.path.join(_TMP, "jobs.db"),
+    "FSM_DB_PATH": os.path.join(_TMP, "fsm.db"),
+    "EVENTS_SPOOL_PATH": os.path.join(_TMP, "events.db"),
+    "TRACE_PATH": os.path.join(_TMP, "traces.jsonl"),
+})
+
+import database as db  # noqa: E402
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = db.SQLiteBackend(str(tmp_path / "test.db"))
+    yield backend
+    backend.close()
@@ -0,0 +1,45 @@
+import time
+
+from app.services.cache import TTLCache
+
+
+def test_get_counts_hits_and_misses():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set(1, "a")
+    assert cache.get(1) == "a"
+    assert cache.get(2) is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.get(1)
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+
+
+def test_expired_entry_is_a_miss():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set(1, "a", ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get(1, "default") == "default"
+    assert len(cache) == 0
+
+
+def test_pop_ignores_expired_entry():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set(1, {"balance": 5}, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.pop(1) is None
+    assert len(cache) == 0
+
+
+def test_pop_returns_live_entry():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set(1, {"balance": 5})
+    assert cache.pop(1) == {"balance": 5}
+    assert cache.get(1) is None
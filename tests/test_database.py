@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+import database as db
+from database import INITIAL_BALANCE
+
+
+def _counter(backend, name="users_total"):
+    row = backend._one("SELECT value FROM counters WHERE name = ?", name)
+    return row[0] if row else 0
+
+
+# --- БАЛАНС ---
+
+def test_increment_creates_user_with_initial_balance(backend):
+    assert backend.increment_balance(1, 5, strict=False) == INITIAL_BALANCE + 5
+    assert backend.get_balance(1) == INITIAL_BALANCE + 5
+
+
+def test_non_strict_decrement_is_clamped_at_zero(backend):
+    backend.increment_balance(1, 2, strict=False)
+    assert backend.increment_balance(1, -100, strict=False) == 0
+    assert backend.get_balance(1) == 0
+
+
+def test_strict_decrement_with_enough_funds(backend):
+    backend.increment_balance(1, 2, strict=False)
+    assert backend.increment_balance(1, -3, strict=True) == 0
+
+
+def test_strict_decrement_short_of_funds_changes_nothing(backend):
+    backend.increment_balance(1, 1, strict=False)
+    assert backend.increment_balance(1, -5, strict=True) is None
+    assert backend.get_balance(1) == INITIAL_BALANCE + 1
+
+
+# --- ЗАКАЗЫ ---
+
+def test_order_is_recorded_once(backend):
+    assert backend.record_order("o1", 1, 10, {"order_num": "1_10"}) is True
+    assert backend.record_order("o1", 1, 10, {"order_num": "1_10"}) is False
+
+
+def test_order_is_credited_once(backend):
+    backend.record_order("o1", 1, 10, {"order_num": "1_10"})
+    order = backend.credit_order("o1")
+    assert order == {"order_key": "o1", "user_id": 1, "amount": 10, "raw_data": {"order_num": "1_10"},
+                     "balance": INITIAL_BALANCE + 10}
+    assert backend.credit_order("o1") is None
+    assert backend.get_balance(1) == INITIAL_BALANCE + 10
+    assert backend.pending_orders() == []
+
+
+def test_failed_credit_leaves_order_pending(backend):
+    backend.record_order("o1", 1, 10, {})
+
+    def fail(*args):
+        raise RuntimeError("db down")
+    backend._increment = fail
+    with pytest.raises(RuntimeError):
+        backend.credit_order("o1")
+    del backend._increment
+    assert backend.pending_orders() == ["o1"]
+    assert backend.credit_order("o1")["balance"] == INITIAL_BALANCE + 10
+
+
+# --- СЧЕТЧИКИ ---
+
+def test_users_counter_follows_inserts(backend):
+    backend.get_balance(1)
+    backend.get_balance(2)
+    backend.get_balance(1)
+    assert _counter(backend) == 2
+    assert backend.get_users_count() == 2
+
+
+def test_referral_counter_on_new_user(backend):
+    backend.set_referrer(2, 1)
+    assert backend.get_referrals_count(1) == 1
+    assert _counter(backend) == 1
+
+
+def test_referral_counter_on_existing_user(backend):
+    backend.get_balance(2)
+    backend.set_referrer(2, 1)
+    assert backend.get_referrals_count(1) == 1
+    assert _counter(backend) == 1
+
+
+def test_referrer_is_set_only_once(backend):
+    backend.set_referrer(2, 1)
+    backend.set_referrer(2, 3)
+    assert backend.get_referral_edges() == [(2, 1)]
+    assert backend.get_referrals_count(1) == 1
+    assert backend.get_referrals_count(3) == 0
+
+
+def test_reconcile_restores_counters(backend):
+    backend.set_referrer(2, 1)
+    backend.set_referrer(3, 1)
+    backend.conn.execute("UPDATE counters SET value = 100")
+    backend.conn.execute("UPDATE referral_counts SET referrals = 0")
+    backend.reconcile_counters()
+    assert _counter(backend) == 2
+    assert backend.get_referrals_count(1) == 2
+
+
+# --- РЕФЕРАЛЫ ---
+
+def test_set_referrer_reports_write(backend):
+    assert backend.set_referrer(2, 1) is True
+    assert backend.set_referrer(2, 3) is False
+
+
+def test_referral_edges_and_orders_since(backend):
+    backend.set_referrer(2, 1)
+    backend.record_order("o1", 2, 10, {})
+    backend.credit_order("o1")
+    assert backend.get_referral_edges() == [(2, 1)]
+    assert backend.get_credited_orders() == [("o1", 2, 10)]
+
+    future = db.utc_timestamp(time.time() + 60)
+    assert backend.get_referral_edges(future) == []
+    assert backend.get_credited_orders(future) == []
+    past = db.utc_timestamp(time.time() - 60)
+    assert backend.get_referral_edges(past) == [(2, 1)]
+    assert backend.get_credited_orders(past) == [("o1", 2, 10)]
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import database as db
+from app.services.events import GENERATION_LOGS, PAYMENT_LOGS, EventLog
+
+
+class FakeDatabase:
+    """Вставки событий в базу; failing=True имитирует недоступную базу."""
+
+    def __init__(self):
+        self.inserted = []
+        self.attempts = []
+        self.failing = False
+
+    async def insert_events(self, table: str, events: list):
+        self.attempts.append([event["event_id"] for event in events])
+        if self.failing:
+            raise RuntimeError("database unavailable")
+        self.inserted.append((table, events))
+
+
+@pytest.fixture
+def database(monkeypatch):
+    fake = FakeDatabase()
+    monkeypatch.setattr(db, "insert_events", fake.insert_events)
+    return fake
+
+
+def _emit(log: EventLog, order_id: str):
+    log.payment(1, 10, "success", order_id, {})
+
+
+def test_flush_sends_events_grouped_by_table(tmp_path, database):
+    async def main():
+        log = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+        try:
+            _emit(log, "order-1")
+            log.emit(GENERATION_LOGS, job_id="job-1", outcome="done")
+            _emit(log, "order-2")
+            assert await log.flush()
+            assert log.spooled == 0
+            assert await log.db.run(log._count) == 0
+        finally:
+            await log.close()
+
+    asyncio.run(main())
+    tables = {table: [event.get("order_id") or event.get("job_id") for event in events]
+              for table, events in database.inserted}
+    assert tables == {PAYMENT_LOGS: ["order-1", "order-2"], GENERATION_LOGS: ["job-1"]}
+    event = database.inserted[0][1][0]
+    assert event["event_id"] and event["created_at"].endswith("+00:00")
+
+
+def test_events_stay_spooled_until_acknowledged(tmp_path, database):
+    path = str(tmp_path / "events.db")
+
+    async def fail():
+        log = EventLog(path, flush_interval=60)
+        _emit(log, "order-1")
+        database.failing = True
+        assert not await log.flush()
+        assert log.spooled == 1
+        await log.close()
+
+    async def restart():
+        database.failing = False
+        log = EventLog(path, flush_interval=60)
+        try:
+            await log.start()
+            assert log.spooled == 1
+            assert await log.flush()
+            assert log.spooled == 0
+        finally:
+            await log.close()
+
+    asyncio.run(fail())
+    assert database.inserted == []
+    asyncio.run(restart())
+    assert [event["order_id"] for _, events in database.inserted for event in events] == ["order-1"]
+
+
+def test_retried_batch_keeps_event_ids(tmp_path, database):
+    async def main():
+        log = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+        try:
+            _emit(log, "order-1")
+            database.failing = True
+            await log.flush()
+            database.failing = False
+            await log.flush()
+        finally:
+            await log.close()
+
+    asyncio.run(main())
+    # Повтор отправляет те же event_id: база отбросит дубли (upsert по event_id)
+    assert len(database.attempts) == 2
+    assert database.attempts[0] == database.attempts[1]
+
+
+def test_buffer_is_kept_when_spool_fails(tmp_path, database, monkeypatch):
+    async def main():
+        log = EventLog(str(tmp_path / "events.db"), flush_interval=60)
+        try:
+            _emit(log, "order-1")
+
+            def broken(batch):
+                raise OSError("disk full")
+
+            monkeypatch.setattr(log, "_spool", broken)
+            with pytest.raises(OSError):
+                await log.flush()
+            assert len(log.buffer) == 1
+            monkeypatch.undo()
+            monkeypatch.setattr(db, "insert_events", database.insert_events)
+            assert await log.flush()
+            assert log.buffer == []
+        finally:
+            await log.close()
+
+    asyncio.run(main())
+    assert len(database.inserted) == 1
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+
+from app.services.fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+def test_state_and_data_survive_restart(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def write():
+        storage = SQLiteStorage(path, flush_interval=60)
+        await storage.set_state(KEY, "photo:waiting")
+        await storage.set_data(KEY, {"model": "seadream"})
+        await storage.close()
+
+    async def read():
+        storage = SQLiteStorage(path)
+        try:
+            return await storage.get_state(KEY), await storage.get_data(KEY)
+        finally:
+            await storage.close()
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == ("photo:waiting", {"model": "seadream"})
+
+
+def test_cleared_state_is_deleted_from_disk(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=60)
+        try:
+            await storage.set_state(KEY, "photo:waiting")
+            await storage.flush()
+            await storage.set_state(KEY, None)
+            await storage.set_data(KEY, {})
+            await storage.flush()
+            count = storage.db.connect().execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+            assert count == 0
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
+
+
+def test_expired_dialog_starts_clean(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), ttl=0.01, flush_interval=60)
+        try:
+            await storage.set_state(KEY, "photo:waiting")
+            await storage.set_data(KEY, {"model": "seadream"})
+            time.sleep(0.02)
+            assert await storage.get_state(KEY) is None
+            assert await storage.get_data(KEY) == {}
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
+
+
+def test_returned_data_is_a_copy(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=60)
+        try:
+            await storage.set_data(KEY, {"model": "seadream"})
+            data = await storage.get_data(KEY)
+            data["model"] = "kling_5"
+            assert await storage.get_data(KEY) == {"model": "seadream"}
+        finally:
+            await storage.close()
+
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+import pytest
+
+from app.services import health as health_module
+from app.services.health import CLOSED, HALF_OPEN, OPEN, HealthRegistry, ModelHealth, RetryBudget
+
+
+@pytest.fixture
+def no_cooldown(monkeypatch):
+    monkeypatch.setattr(health_module, "BREAKER_COOLDOWN", 0)
+
+
+def _open(health: ModelHealth):
+    for _ in range(health_module.BREAKER_CONSECUTIVE):
+        health.record(ok=False)
+    assert health.state == OPEN
+
+
+def test_consecutive_failures_open_the_breaker():
+    health = ModelHealth("seadream")
+    for _ in range(health_module.BREAKER_CONSECUTIVE - 1):
+        health.record(ok=False)
+    assert health.state == CLOSED
+    health.record(ok=False)
+    assert health.state == OPEN
+    assert not health.acquire()
+
+
+def test_error_rate_opens_the_breaker():
+    health = ModelHealth("seadream")
+    for i in range(health_module.BREAKER_MIN_CALLS):
+        health.record(ok=i % 2 == 0)
+    assert health.state == OPEN
+
+
+def test_half_open_allows_a_single_probe(no_cooldown):
+    health = ModelHealth("seadream")
+    _open(health)
+    assert health.acquire()
+    assert health.state == HALF_OPEN
+    assert not health.acquire()
+
+
+def test_successful_probe_closes_the_breaker(no_cooldown):
+    health = ModelHealth("seadream")
+    _open(health)
+    health.acquire()
+    health.record(ok=True, duration=10)
+    assert health.state == CLOSED
+    assert health.errors == 0
+
+
+def test_failed_probe_reopens_the_breaker(no_cooldown):
+    health = ModelHealth("seadream")
+    _open(health)
+    health.acquire()
+    health.record(ok=False)
+    assert health.state == OPEN
+
+
+def test_released_probe_can_be_taken_again(no_cooldown):
+    health = ModelHealth("seadream")
+    _open(health)
+    health.acquire()
+    probe = health.probe_at
+    health.release(probe)
+    assert health.acquire()
+    # Чужая (устаревшая) метка не освобождает текущую пробу
+    health.release(probe - 1)
+    assert not health.acquire()
+
+
+def test_route_falls_back_to_healthy_spare(monkeypatch):
+    monkeypatch.setattr(health_module, "MODEL_FALLBACKS", {"nanabanana": "seadream"})
+    registry = HealthRegistry()
+    _open(registry.get("nanabanana"))
+    assert registry.route("nanabanana") == "seadream"
+    _open(registry.get("seadream"))
+    assert registry.route("nanabanana") is None
+
+
+def test_retry_budget_refills_from_successes():
+    budget = RetryBudget(ratio=0.5, maximum=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
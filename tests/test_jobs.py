@@ -0,0 +1,168 @@
+import asyncio
+
+from app.services.checkpoint import CHARGED, QUEUED, SUBMITTED, JobStore
+from app.services.jobs import Job, JobQueue
+
+
+def _job(model: str = "nanabanana", **fields) -> Job:
+    fields = {"user_id": 1, "chat_id": 1, "prompt": "cat", "photo_id": "photo", "cost": 1, **fields}
+    return Job(model=model, **fields)
+
+
+# --- ОЧЕРЕДЬ ---
+
+def test_model_limit_does_not_block_other_models():
+    async def main():
+        release = asyncio.Event()
+        started = []
+
+        async def handler(job):
+            started.append(job.model)
+            await release.wait()
+
+        queue = JobQueue(handler, workers=3, limits={"kling_10": 1})
+        queue.submit(_job("kling_10"))
+        assert queue.submit(_job("kling_10")) == 1
+        queue.submit(_job("nanabanana"))
+        await asyncio.sleep(0)
+        assert sorted(started) == ["kling_10", "nanabanana"]
+        assert queue.active == 2
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert started.count("kling_10") == 2
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_total_worker_limit_and_priority():
+    async def main():
+        release = asyncio.Event()
+        started = []
+
+        async def handler(job):
+            started.append(job.prompt)
+            await release.wait()
+
+        queue = JobQueue(handler, workers=1, limits={})
+        queue.submit(_job(prompt="first"))
+        queue.submit(_job(prompt="low"))
+        assert queue.submit(_job(prompt="high", priority=1)) == 1
+        await asyncio.sleep(0)
+        assert started == ["first"]
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert started == ["first", "high", "low"]
+        await queue.stop()
+
+    asyncio.run(main())
+
+
+def test_pending_cost_counts_only_uncharged_jobs():
+    async def main():
+        release = asyncio.Event()
+
+        async def handler(job):
+            await release.wait()
+
+        queue = JobQueue(handler, workers=1, limits={})
+        queue.submit(_job(cost=3))
+        queue.submit(_job(cost=5, charged=True))
+        queue.submit(_job(cost=7))
+        await asyncio.sleep(0)
+        assert queue.pending_cost(1) == 10
+        assert queue.pending_cost(2) == 0
+        release.set()
+        await queue.stop(grace=1)
+
+    asyncio.run(main())
+
+
+def test_stop_cancels_jobs_after_grace():
+    async def main():
+        cancelled = []
+
+        async def handler(job):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(job.id)
+                raise
+
+        queue = JobQueue(handler, workers=2, limits={})
+        job = _job()
+        queue.submit(job)
+        queue.submit(_job())
+        await asyncio.sleep(0)
+        await queue.stop(grace=0.01)
+        assert job.id in cancelled
+        assert queue.submit(_job()) == 1
+
+    asyncio.run(main())
+
+
+# --- ЖУРНАЛ (checkpoint) ---
+
+def test_store_resumes_unfinished_jobs(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def save():
+        store = JobStore(path)
+        queued, submitted, charged = _job(), _job(request_id="req-1"), _job(request_id="req-2", charged=True)
+        await store.save(queued, QUEUED)
+        await store.save(submitted, QUEUED)
+        await store.save(submitted, SUBMITTED)
+        await store.save(charged, CHARGED)
+        done = _job()
+        await store.save(done, QUEUED)
+        await store.delete(done)
+        store.close()
+        return queued, submitted, charged
+
+    async def load():
+        store = JobStore(path)
+        try:
+            return await store.unfinished()
+        finally:
+            store.close()
+
+    queued, submitted, charged = asyncio.run(save())
+    restored = asyncio.run(load())
+    assert [(state, job.id) for state, job in restored] == [
+        (QUEUED, queued.id), (SUBMITTED, submitted.id), (CHARGED, charged.id)
+    ]
+    assert restored[1][1].request_id == "req-1"
+    assert restored[2][1].charged is True
+    assert restored[0][1] == queued
+
+
+# --- ВОЗОБНОВЛЕНИЕ ---
+
+def test_resumed_started_jobs_skip_cache_and_coalescing(monkeypatch):
+    from app.services import worker
+
+    async def main():
+        submitted = []
+        monkeypatch.setattr(worker.job_queue, "submit", lambda job: submitted.append(job) or 1)
+        monkeypatch.setattr(worker, "_inflight", {})
+        fresh = _job(photo_unique_id="u1")
+        worker.result_cache.set(fresh.cache_key, {"file_id": "file", "user_id": 2})
+        try:
+            # Уже запущенная у провайдера и уже оплаченная задачи доводятся до конца сами
+            for job in (_job(photo_unique_id="u1", request_id="req"), _job(photo_unique_id="u1", charged=True)):
+                assert worker._start(job) == 1
+            assert len(submitted) == 2
+            assert worker._inflight[fresh.cache_key].job_id == submitted[0].id
+        finally:
+            worker.result_cache.pop(fresh.cache_key)
+
+    asyncio.run(main())
+
+
+def test_cache_key_follows_routed_model():
+    job = _job(photo_unique_id="u1")
+    rerouted = _job(photo_unique_id="u1", routed_model="seadream")
+    assert job.cache_key != rerouted.cache_key
+    assert _job(photo_unique_id="u1", model="seadream").cache_key == rerouted.cache_key
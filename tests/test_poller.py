@@ -0,0 +1,126 @@
+import asyncio
+
+from app.services.poller import PollScheduler
+
+MODEL = "nano-banana"
+
+
+def _scheduler(fetch, expected: float = 0.01) -> PollScheduler:
+    scheduler = PollScheduler(fetch, max_rps=1000, min_interval=0.01)
+    scheduler.expected[MODEL] = expected
+    return scheduler
+
+
+def test_wait_returns_url_once_done():
+    states = iter([("pending", None), ("pending", None), ("done", "https://result")])
+
+    async def fetch(kind, request_id):
+        return next(states)
+
+    async def main():
+        scheduler = _scheduler(fetch)
+        try:
+            assert await scheduler.wait("image", MODEL, "r1", timeout=5) == "https://result"
+            assert scheduler.requests_sent == 3
+            assert scheduler.in_flight == 0
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_failed_generation_returns_none():
+    async def fetch(kind, request_id):
+        return "failed", None
+
+    async def main():
+        scheduler = _scheduler(fetch)
+        try:
+            assert await scheduler.wait("image", MODEL, "r1", timeout=5) is None
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_timeout_returns_none():
+    async def fetch(kind, request_id):
+        return "pending", None
+
+    async def main():
+        scheduler = _scheduler(fetch)
+        try:
+            assert await scheduler.wait("image", MODEL, "r1", timeout=0.05) is None
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_completed_duration_updates_expected_time():
+    async def fetch(kind, request_id):
+        return "done", "https://result"
+
+    async def main():
+        scheduler = _scheduler(fetch, expected=100)
+        try:
+            scheduler.poke("r1")
+            await scheduler.wait("image", MODEL, "r1", timeout=5)
+            # Колбэк пришел сразу: оценка сдвигается к нулю
+            assert scheduler.expected[MODEL] < 100
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_poke_checks_status_before_schedule():
+    async def fetch(kind, request_id):
+        return "done", "https://result"
+
+    async def main():
+        # Без колбэка первая проверка была бы через POLL_FIRST_MAX секунд
+        scheduler = _scheduler(fetch, expected=100)
+        try:
+            future = scheduler.watch("image", MODEL, "r1", timeout=60)
+            assert scheduler.poke("r1")
+            assert await asyncio.wait_for(future, timeout=1) == "https://result"
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_early_poke_is_remembered():
+    async def fetch(kind, request_id):
+        return "done", "https://result"
+
+    async def main():
+        scheduler = _scheduler(fetch, expected=100)
+        try:
+            assert not scheduler.poke("r1")
+            future = scheduler.watch("image", MODEL, "r1", timeout=60)
+            assert await asyncio.wait_for(future, timeout=1) == "https://result"
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
+
+
+def test_poll_errors_are_retried():
+    answers = iter([Exception("boom"), ("done", "https://result")])
+
+    async def fetch(kind, request_id):
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def main():
+        scheduler = _scheduler(fetch)
+        try:
+            assert await scheduler.wait("image", MODEL, "r1", timeout=5) == "https://result"
+        finally:
+            await scheduler.stop()
+
+    asyncio.run(main())
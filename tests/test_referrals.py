@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+import database as db
+from app.services import referrals
+from app.services.referrals import ReferralGraph
+
+
+@pytest.fixture
+def graph(backend, monkeypatch):
+    monkeypatch.setattr(db, "_backend", backend)
+    return ReferralGraph(levels=[0.1, 0.05])
+
+
+def _credit(backend, order_key: str, user_id: int, amount: int):
+    backend.record_order(order_key, user_id, amount, {})
+    backend.credit_order(order_key)
+
+
+def test_referrer_is_set_only_once():
+    graph = ReferralGraph()
+    assert graph.add(2, 1)
+    assert not graph.add(2, 3)
+    assert not graph.add(4, 4)
+    assert graph.referrer_of(2) == 1
+    assert graph.referrals_of(1) == {2}
+
+
+def test_bonus_chain_follows_levels_and_stops_at_cycles():
+    graph = ReferralGraph(levels=[0.1, 0.05, 0.01])
+    graph.add(3, 2)
+    graph.add(2, 1)
+    graph.add(1, 3)
+    assert graph.upline(3, 3) == [2, 1]
+    assert graph.bonus_chain(3, 100) == [(2, 10), (1, 5)]
+    assert graph.downline(1, 2) == [{2}, {3}]
+
+
+def test_purchase_is_counted_once():
+    graph = ReferralGraph(levels=[0.1])
+    graph.add(2, 1)
+    assert graph.record_purchase(2, 100, "order-1")
+    assert not graph.record_purchase(2, 100, "order-1")
+    assert graph.earnings(1) == 10
+
+
+def test_load_reads_edges_and_credited_orders(graph, backend):
+    backend.set_referrer(2, 1)
+    backend.set_referrer(3, 2)
+    _credit(backend, "order-1", 3, 100)
+    backend.record_order("order-2", 3, 100, {})
+
+    asyncio.run(graph.load())
+    assert graph.loaded
+    assert graph.upline(3, 2) == [2, 1]
+    # Незачисленный заказ бонусов не дает
+    assert graph.earnings(2) == 10
+    assert graph.earnings(1) == 5
+
+
+def test_sync_picks_up_writes_of_other_processes(graph, backend, monkeypatch):
+    backend.set_referrer(2, 1)
+    asyncio.run(graph.load())
+
+    backend.set_referrer(3, 1)
+    _credit(backend, "order-1", 2, 100)
+    graph.record_purchase(2, 100, "order-1")
+    assert asyncio.run(graph.sync()) == (1, 0)
+    assert graph.referrals_count(1) == 2
+    assert graph.earnings(1) == 10
+
+    # Старые записи за пределами окна догрузки не перечитываются
+    monkeypatch.setattr(referrals, "REFERRAL_SYNC_OVERLAP", 0)
+    graph.synced_at = time.time() + 60
+    assert asyncio.run(graph.sync()) == (0, 0)
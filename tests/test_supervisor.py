@@ -0,0 +1,72 @@
+import asyncio
+import random
+
+from app.supervisor import OrderedUpdateHandler, owner_of, shard_of, user_of
+
+
+class _Request:
+    def __init__(self, update: dict):
+        self.update = update
+        self.headers = {}
+
+    async def json(self):
+        return self.update
+
+
+class _Dispatcher:
+    def __init__(self):
+        self.handled = []
+
+    async def feed_raw_update(self, bot, update):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        self.handled.append((update["message"]["from"]["id"], update["update_id"]))
+
+
+def test_updates_of_one_user_go_to_one_worker():
+    message = {"update_id": 1, "message": {"message_id": 5, "from": {"id": 42}, "chat": {"id": 42}}}
+    callback = {"update_id": 2, "callback_query": {"id": "x", "from": {"id": 42}, "data": "pay_10_149"}}
+    assert shard_of(message, 4) == shard_of(callback, 4) == owner_of(42, 4) == 2
+
+
+def test_chat_is_used_when_there_is_no_sender():
+    post = {"update_id": 3, "channel_post": {"message_id": 1, "chat": {"id": -1001}}}
+    assert user_of(post) == -1001
+    assert shard_of(post, 4) == -1001 % 4
+
+
+def test_update_without_user_is_spread_by_update_id():
+    assert user_of({"update_id": 7, "poll": {"id": "p"}}) is None
+    assert shard_of({"update_id": 7, "poll": {"id": "p"}}, 4) == 3
+
+
+def test_member_updates_use_the_user():
+    update = {"update_id": 9, "my_chat_member": {"chat": {"id": 1}, "from": {"id": 13}}}
+    assert shard_of(update, 5) == 3
+
+
+def test_handler_keeps_order_per_user():
+    async def main():
+        dispatcher = _Dispatcher()
+        handler = OrderedUpdateHandler(dispatcher, bot=None)
+        for update_id in range(30):
+            update = {"update_id": update_id, "message": {"from": {"id": update_id % 3}}}
+            response = await handler.handle(_Request(update))
+            assert response.status == 200
+        await handler.close(timeout=5)
+        return dispatcher.handled
+
+    handled = asyncio.run(main())
+    assert len(handled) == 30
+    for user_id in range(3):
+        ids = [update_id for owner, update_id in handled if owner == user_id]
+        assert ids == sorted(ids)
+
+
+def test_handler_rejects_wrong_secret():
+    async def main():
+        handler = OrderedUpdateHandler(_Dispatcher(), bot=None, secret_token="secret")
+        request = _Request({"update_id": 1})
+        request.headers = {"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+        return (await handler.handle(request)).status
+
+    assert asyncio.run(main()) == 401